@@ -0,0 +1,267 @@
+#!/usr/bin/env python
+"""
+Benchmarks of each stage of the processing chain on synthetic data.
+
+Generates a synthetic site (see cassandra_fs_pp.synthetic), times each
+processing stage and saves the timings to JSON, together with the git commit
+and package versions, so that runs can be compared between commits:
+
+    python benchmarks/run_benchmarks.py -years 10 -n_dtc 5 -outfile before.json
+    git checkout <other commit>
+    python benchmarks/run_benchmarks.py -years 10 -n_dtc 5 -data_root <kept data> -compare before.json
+
+"""
+
+import argparse
+import contextlib
+import datetime as dt
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+import cassandra_fs_pp as fspp
+from cassandra_fs_pp import level2
+from cassandra_fs_pp import synthetic
+
+
+def git_commit() -> str | None:
+    """ Commit hash of the repository containing this script, if any. """
+    try:
+        out = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)), check=True)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return out.stdout.strip()
+
+
+def timeit(
+    func,
+    repeat : int,
+    setup=None
+    ) -> list:
+    """
+    Time a function, silencing its terminal output.
+
+    :param func: function to time. Called with the output of setup, if given.
+    :param repeat: number of times to run func.
+    :param setup: function run (untimed) before each call of func.
+    :returns: list of run times in seconds.
+    """
+    times = []
+    for i in range(repeat):
+        with contextlib.redirect_stdout(io.StringIO()):
+            args = () if setup is None else (setup(),)
+            t0 = time.perf_counter()
+            func(*args)
+            times.append(time.perf_counter() - t0)
+    return times
+
+
+def peak_memory(
+    func
+    ) -> float:
+    """
+    Peak memory traced while running a function once, silencing its terminal output.
+
+    :param func: function to run.
+    :returns: peak traced memory in MB.
+    """
+    tracemalloc.start()
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            func()
+        return tracemalloc.get_traced_memory()[1] / 1e6
+    finally:
+        tracemalloc.stop()
+
+
+def downcast_memory(
+    metafile : str,
+    data_root : str
+    ) -> dict:
+    """
+    Peak memory of level0_to_level1 and level1_to_level2, with the data 
+    downcast to compact dtypes (the default) and without, see 
+    fs_pp.downcast_dtypes. The level-0 cache is not used.
+
+    :param metafile: metadata TOML file of site.
+    :param data_root: data_root of site.
+    :returns: dict of <stage>_<downcast|no_downcast>: peak traced memory in MB.
+    """
+    results = {}
+    for downcast in [True, False]:
+        site = fspp.fs(metafile, data_root)
+        site.level0_cache = None
+        site.config['level0_1']['downcast'] = downcast
+        name = 'downcast' if downcast else 'no_downcast'
+        results['level0_to_level1_%s' %name] = peak_memory(site.level0_to_level1)
+        results['level1_to_level2_%s' %name] = peak_memory(site.level1_to_level2)
+    return results
+
+
+def startup_times(
+    repeat : int
+    ) -> dict:
+    """
+    Time the start-up of each command-line tool, running it with -h in a 
+    new interpreter, see cassandra_fs_pp.cli.
+
+    :param repeat: number of times to run each tool.
+    :returns: dict of startup_<tool>: list of run times in seconds.
+    """
+    results = {}
+    for tool in ['process_l1', 'process_l2', 'process_batch', 'plot_l2']:
+        code = 'from cassandra_fs_pp import cli; cli.%s(["-h"])' %tool
+        results['startup_%s' %tool] = timeit(lambda: subprocess.run([sys.executable, '-c', code],
+            capture_output=True, check=True), repeat)
+    return results
+
+
+def run_benchmarks(
+    metafile : str,
+    data_root : str,
+    repeat : int=3
+    ) -> dict:
+    """
+    Time each stage of the processing chain of a site.
+
+    :param metafile: metadata TOML file of site.
+    :param data_root: data_root of site.
+    :param repeat: number of times to run each stage.
+    :returns: dict of stage: list of run times in seconds.
+    """
+    site = fspp.fs(metafile, data_root)
+    results = {}
+
+    results['level0_to_level1'] = timeit(site.level0_to_level1, repeat)
+    site.ds_level1.index.name = 'time'
+    level1 = site.ds_level1.copy()
+
+    results['_apply_valid_data_ranges'] = timeit(site._apply_valid_data_ranges, repeat,
+        setup=level1.copy)
+    with contextlib.redirect_stdout(io.StringIO()):
+        site.ds_level1 = site._apply_valid_data_ranges(level1.copy())
+        udg = site._normalise_udg()
+
+    results['_normalise_udg'] = timeit(site._normalise_udg, repeat)
+    results['_filter_udg'] = timeit(lambda: site._filter_udg(udg), repeat)
+    results['_calibrate_ec'] = timeit(site._calibrate_ec, repeat)
+
+    udg_median = udg.rolling('3D', center=True).median()
+    tdrs = list(site.config['level1_2']['tdr_info'].keys())
+    results['_calc_depth_tdr'] = timeit(
+        lambda: [site._calc_depth_tdr(tdr, udg_median) for tdr in tdrs], repeat)
+
+    def _level1_to_level2(level1):
+        site.ds_level1 = level1
+        site.level1_to_level2()
+    results['level1_to_level2'] = timeit(_level1_to_level2, repeat, setup=level1.copy)
+
+    outfile = os.path.join(data_root, 'firn_stations/level-2', 'benchmark.nc')
+    results['write_level2'] = timeit(lambda: level2.write_level2(site, outfile=outfile), repeat)
+
+    results.update(startup_times(repeat))
+
+    results = {'rows':len(level1), 'columns':len(level1.columns), 'stages':results,
+        'peak_memory_mb':downcast_memory(metafile, data_root)}
+    return results
+
+
+def compare(
+    current : dict,
+    baseline : dict
+    ) -> pd.DataFrame:
+    """
+    Compare the fastest run time of each stage against a baseline.
+
+    :param current: output of this script.
+    :param baseline: output of this script from another commit.
+    :returns: DataFrame of baseline and current times, and their ratio.
+    """
+    table = pd.DataFrame({
+        'baseline_s':{k:np.min(v) for k, v in baseline['results']['stages'].items()},
+        'current_s':{k:np.min(v) for k, v in current['results']['stages'].items()}
+    })
+    table['ratio'] = table['current_s'] / table['baseline_s']
+    return table
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser('Benchmark the processing chain on synthetic data.')
+
+    parser.add_argument('-data_root', type=str, default=None,
+        help='Folder of synthetic data. Generated if it does not contain the site, by default in a temporary folder.')
+    parser.add_argument('-site', type=str, default='FSX', help='Name of synthetic site.')
+    parser.add_argument('-years', type=float, default=1, help='Length of synthetic record in years.')
+    parser.add_argument('-freq', type=str, default='10min', help='Sampling interval of synthetic data.')
+    parser.add_argument('-n_tdr', type=int, default=3, help='Number of TDRs.')
+    parser.add_argument('-n_dtc', type=int, default=1, help='Number of DTC chains.')
+    parser.add_argument('-bale_days', type=int, default=30, help='Length of level-0 bales in days.')
+    parser.add_argument('-repeat', type=int, default=3, help='Number of times to run each stage.')
+    parser.add_argument('-outfile', type=str, default=None,
+        help='JSON file of results, by default benchmark_<commit>.json in the current directory.')
+    parser.add_argument('-compare', type=str, default=None,
+        help='JSON file of results of a previous run to compare against.')
+
+    args = parser.parse_args()
+
+    params = {k:getattr(args, k) for k in ['site', 'years', 'freq', 'n_tdr', 'n_dtc', 'bale_days']}
+
+    with contextlib.ExitStack() as stack:
+        data_root = args.data_root
+        if data_root is None:
+            data_root = stack.enter_context(tempfile.TemporaryDirectory())
+        metafile = os.path.join(data_root, 'firn_stations/ppconfig', '%s.toml' %args.site)
+        if not os.path.exists(metafile):
+            print('Generating synthetic data in %s ...' %data_root)
+            t0 = time.perf_counter()
+            metafile = synthetic.make_site(data_root, site=args.site, years=args.years,
+                freq=args.freq, n_tdr=args.n_tdr, n_dtc=args.n_dtc, bale_days=args.bale_days)
+            print('... done in %.1f s.' %(time.perf_counter() - t0))
+        else:
+            print('Using existing synthetic data in %s (generation options ignored).' %data_root)
+            params = {'site':args.site, 'data_root':data_root}
+
+        results = run_benchmarks(metafile, data_root, repeat=args.repeat)
+
+    commit = git_commit()
+    out = {
+        'commit':commit,
+        'date':dt.datetime.now().isoformat('T', 'seconds'),
+        'python':platform.python_version(),
+        'platform':platform.platform(),
+        'versions':{'pandas':pd.__version__, 'numpy':np.__version__, 'xarray':xr.__version__},
+        'params':params,
+        'repeat':args.repeat,
+        'results':results
+    }
+
+    outfile = args.outfile
+    if outfile is None:
+        outfile = 'benchmark_%s.json' %(commit[:8] if commit is not None else 'nocommit')
+    with open(outfile, 'w') as f:
+        json.dump(out, f, indent=1)
+
+    print('%s rows x %s columns' %(results['rows'], results['columns']))
+    for stage, times in results['stages'].items():
+        print('%-26s min %8.3f s  mean %8.3f s' %(stage, np.min(times), np.mean(times)))
+    for stage, mb in results['peak_memory_mb'].items():
+        print('%-36s peak %8.1f MB' %(stage, mb))
+    print('Saved to %s.' %outfile)
+
+    if args.compare is not None:
+        with open(args.compare, 'r') as f:
+            baseline = json.load(f)
+        print('\nCompared with %s (commit %s):' %(args.compare, baseline['commit']))
+        print(compare(out, baseline).to_string(float_format='%.3f'))
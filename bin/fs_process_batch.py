@@ -0,0 +1,11 @@
+#!/usr/bin/env python
+"""
+Process several sites from level-0 through to level-2, one site per process.
+
+Each site's output is logged to its own file in firn_stations/logs. A summary
+of the status and timings of every site is printed at the end.
+"""
+from cassandra_fs_pp import cli
+
+if __name__ == '__main__':
+    cli.process_batch()
@@ -1,4 +1,3 @@
-from cassandra_fs_pp.fs_pp import fs
 
 try:
     from cassandra_fs_pp.version import version as __version__  # noqa
@@ -10,3 +9,13 @@ except ImportError:  # pragma: no cover
         "virtualenv) and then install it in-place by running: "
         "pip install -e ."
     )
+
+
+def __getattr__(name):
+    # fs is imported on first use, so that the command-line tools can parse
+    # their arguments without importing pandas, see cassandra_fs_pp.cli.
+    if name == 'fs':
+        from cassandra_fs_pp.fs_pp import fs
+        globals()['fs'] = fs
+        return fs
+    raise AttributeError('module %r has no attribute %r' %(__name__, name))
@@ -0,0 +1,218 @@
+"""
+On-disk cache of parsed level-0 files.
+
+Parsing the raw level-0 files is the slowest part of producing Level-1 data,
+yet the files themselves rarely change. The cache stores each parsed file as a
+binary columnar blob (Feather, or pickle if pyarrow is not available). Entries
+are keyed by the hash of the file contents combined with the options used to
+load it, so changing either results in a cache miss.
+
+The cache is limited in size; the least-recently-used entries are evicted
+first.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import time
+
+import pandas as pd
+
+# Increment if the format of the cached data changes.
+CACHE_VERSION = 4
+
+# Column in which the index is stored in Feather files, which have no index.
+_INDEX_COLUMN = '__index__'
+
+
+def file_hash(
+    filename : str,
+    blocksize : int=2**20
+    ) -> str:
+    """
+    SHA-256 hash of the contents of a file.
+
+    :param filename: path/filename of file to hash.
+    :param blocksize: number of bytes to read at a time.
+    """
+    h = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(blocksize), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _have_pyarrow() -> bool:
+    try:
+        import pyarrow
+    except ImportError:
+        return False
+    return True
+
+
+class Level0Cache():
+
+    def __init__(
+        self,
+        root : str,
+        max_bytes : int | None=None
+        ) -> None:
+        """
+        Initialise the cache.
+
+        :param root: directory in which to store cached data. Created if needed.
+        :param max_bytes: maximum total size of the cache. If None, unlimited.
+        """
+        self.root = root
+        self.max_bytes = max_bytes
+        if _have_pyarrow():
+            self.fmt = 'feather'
+        else:
+            self.fmt = 'pkl'
+        os.makedirs(self.root, exist_ok=True)
+        return
+
+
+    def key(
+        self,
+        filename : str,
+        load_opts : dict
+        ) -> str:
+        """
+        Cache key of a level-0 file: hash of its contents and the load options.
+
+        :param filename: path/filename of level-0 file.
+        :param load_opts: the options with which the file is loaded.
+        """
+        h = hashlib.sha256()
+        h.update(file_hash(filename).encode())
+        h.update(json.dumps(load_opts, sort_keys=True, default=str).encode())
+        h.update(str(CACHE_VERSION).encode())
+        return h.hexdigest()
+
+
+    def _path(
+        self,
+        key : str
+        ) -> str:
+        return os.path.join(self.root, '%s.%s' %(key, self.fmt))
+
+
+    def get(
+        self,
+        key : str
+        ) -> pd.DataFrame | None:
+        """
+        Retrieve cached data.
+
+        :param key: see key().
+        :returns: the cached DataFrame, or None if not in the cache.
+        """
+        p = self._path(key)
+        if not os.path.exists(p):
+            return None
+
+        if self.fmt == 'feather':
+            data = pd.read_feather(p)
+            with open(p + '.json', 'r') as f:
+                meta = json.load(f)
+            data = data.set_index(_INDEX_COLUMN)
+            data.index.name = meta['index']
+            data.attrs = meta['attrs']
+        else:
+            data = pd.read_pickle(p)
+
+        # Mark as recently used.
+        now = time.time()
+        os.utime(p, (now, now))
+        return data
+
+
+    def put(
+        self,
+        key : str,
+        data : pd.DataFrame
+        ) -> None:
+        """
+        Add data to the cache.
+
+        Data are first written to a temporary file and then moved into place,
+        so that concurrent workers never see partially-written entries.
+
+        :param key: see key().
+        :param data: DataFrame to cache.
+        """
+        p = self._path(key)
+        tmp = '%s.%s.tmp' %(p, os.getpid())
+        if self.fmt == 'feather':
+            meta = {'index':data.index.name, 'attrs':data.attrs}
+            with open(tmp + '.json', 'w') as f:
+                json.dump(meta, f)
+            data.rename_axis(_INDEX_COLUMN).reset_index().to_feather(tmp)
+            os.replace(tmp + '.json', p + '.json')
+        else:
+            data.to_pickle(tmp)
+        os.replace(tmp, p)
+        return
+
+
+    def _entries(self) -> list:
+        """
+        List cache entries as (last used time, size in bytes, path), oldest first.
+        """
+        entries = []
+        for f in os.listdir(self.root):
+            if not f.endswith('.' + self.fmt):
+                continue
+            p = os.path.join(self.root, f)
+            stat = os.stat(p)
+            size = stat.st_size
+            if os.path.exists(p + '.json'):
+                size += os.stat(p + '.json').st_size
+            entries.append((stat.st_mtime, size, p))
+        entries.sort()
+        return entries
+
+
+    def size(self) -> int:
+        """ Total size of the cache in bytes. """
+        return sum([e[1] for e in self._entries()])
+
+
+    def evict(self) -> int:
+        """
+        Remove the least-recently-used entries until the cache is within its
+        size limit.
+
+        :returns: number of entries removed.
+        """
+        if self.max_bytes is None:
+            return 0
+        entries = self._entries()
+        total = sum([e[1] for e in entries])
+        n = 0
+        for _, size, p in entries:
+            if total <= self.max_bytes:
+                break
+            self._remove(p)
+            total -= size
+            n += 1
+        return n
+
+
+    def clear(self) -> None:
+        """ Remove all entries from the cache. """
+        for _, _, p in self._entries():
+            self._remove(p)
+        return
+
+
+    def _remove(
+        self,
+        p : str
+        ) -> None:
+        os.remove(p)
+        if os.path.exists(p + '.json'):
+            os.remove(p + '.json')
+        return
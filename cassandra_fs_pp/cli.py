@@ -0,0 +1,288 @@
+"""
+Command-line tools of the processing chain, installed as console scripts
+(see setup.py) and wrapped by the scripts in bin/.
+
+Arguments are parsed before pandas, xarray or matplotlib are imported, so
+that e.g. -h, or a run which stops because its output already exists,
+returns quickly. The libraries are imported by the stage which needs them,
+see cassandra_fs_pp.pipeline.
+"""
+from __future__ import annotations
+
+import argparse
+import datetime as dt
+import logging
+import os
+import sys
+
+from cassandra_fs_pp import pipeline
+
+
+def process_l1(
+    argv : list | None=None
+    ) -> None:
+    """
+    Process level-0 data of a site up to level-1 status, see pipeline.run_level1.
+
+    :param argv: command-line arguments. If None, uses sys.argv.
+    """
+    parser = argparse.ArgumentParser('Process level-0 data up to level-1 status.')
+
+    parser.add_argument('site', type=str, help='Name of site, normally corresponding to TOML metadata file.')
+
+    cwd = os.getcwd()
+    parser.add_argument('-data_root', type=str, default=cwd,
+        help='Path to root of data (see README), defaults to current directory.')
+
+    parser.add_argument('-metafile', type=str, default=None, 
+        help='Path to metadata TOML file, normally set automatically.')
+
+    parser.add_argument('-outfile', type=str, default=None, 
+        help='Path to output file, normally set automatically.')
+
+    parser.add_argument('-format', type=str, default=None, choices=['csv', 'parquet', 'feather'],
+        help='Format of output file, overrides `l1_format` in the TOML file (default csv). If -outfile is provided then the format is inferred from its extension.')
+
+    parser.add_argument('-ow', action='store_true',
+        help='If provided, forces over-write of existing file.')
+
+    parser.add_argument('-incremental', action='store_true',
+        help='If provided, only load level-0 files which are new or have changed since the existing Level-1 file was written, and merge them into it.')
+
+    parser.add_argument('-stream', action='store_true',
+        help='If provided, process level-0 files in chunks and write the Level-1 file as it is made, so that the whole record is never held in memory. Cannot be combined with -incremental.')
+
+    parser.add_argument('-jobs', type=int, default=None,
+        help='Number of workers with which to load level-0 files concurrently, overrides `jobs` in the TOML file. Use 0 for all CPUs.')
+
+    parser.add_argument('-no_cache', action='store_true',
+        help='If provided, do not use the level-0 cache even if enabled in the TOML file.')
+
+    parser.add_argument('-clear_cache', action='store_true',
+        help='If provided, empty the level-0 cache before processing.')
+
+    parser.add_argument('-profile', action='store_true',
+        help='If provided, report the time and memory taken by each stage of processing, and profile function calls. Reports are saved to firn_stations/logs.')
+
+    args = parser.parse_args(argv)
+
+    if args.profile:
+        logging.basicConfig(level=logging.INFO, format='%(message)s')
+
+    pipeline.run_level1(args.site, args.data_root, 
+        metafile=args.metafile, 
+        outfile=args.outfile, 
+        fmt=args.format,
+        overwrite=args.ow, 
+        incremental=args.incremental, 
+        jobs=args.jobs, 
+        use_cache=not args.no_cache, 
+        clear_cache=args.clear_cache,
+        profile=args.profile,
+        stream=args.stream)
+
+    return
+
+
+def process_l2(
+    argv : list | None=None
+    ) -> None:
+    """
+    Process level-1 data of a site up to level-2 status, see pipeline.run_level2.
+
+    :param argv: command-line arguments. If None, uses sys.argv.
+    """
+    parser = argparse.ArgumentParser('Process level-1 data up to level-2 status.')
+
+    parser.add_argument('site', type=str, help='Name of site, normally corresponding to TOML metadata file.')
+
+    cwd = os.getcwd()
+    parser.add_argument('-data_root', type=str, default=cwd,
+        help='Path to Level-1 file (no need to specify if current directory is the data_root directory).')
+
+    parser.add_argument('-metafile', type=str, default=None, 
+        help='Path to metadata TOML file, normally set automatically.')
+
+    parser.add_argument('-infile', type=str, default=None, 
+        help='Path to Level-1 file, normally found automatically.')
+
+    parser.add_argument('-outfile', type=str, default=None, 
+        help='Path to output NetCDF, normally set automatically.')
+
+    parser.add_argument('-ow', action='store_true',
+        help='If provided, forces over-write of existing file.')
+
+    parser.add_argument('-chunk_size', type=int, default=None,
+        help='Number of time steps to write to NetCDF at once (default 50000).')
+
+    parser.add_argument('-complevel', type=int, default=None,
+        help='zlib compression level (1-9) of NetCDF variables. Default no compression.')
+
+    parser.add_argument('-append', action='store_true',
+        help='Append only new time steps to an existing NetCDF file, rather than re-writing it.')
+
+    parser.add_argument('-profile', action='store_true',
+        help='If provided, report the time and memory taken by each stage of processing, and profile function calls. Reports are saved to firn_stations/logs.')
+
+    args = parser.parse_args(argv)
+
+    if args.profile:
+        logging.basicConfig(level=logging.INFO, format='%(message)s')
+
+    pipeline.run_level2(args.site, args.data_root,
+        metafile=args.metafile,
+        infile=args.infile,
+        outfile=args.outfile,
+        overwrite=args.ow,
+        chunk_size=args.chunk_size,
+        complevel=args.complevel,
+        append=args.append,
+        profile=args.profile)
+
+    return
+
+
+def process_batch(
+    argv : list | None=None
+    ) -> None:
+    """
+    Process several sites from level-0 to level-2, see pipeline.run_batch.
+
+    :param argv: command-line arguments. If None, uses sys.argv.
+    """
+    parser = argparse.ArgumentParser('Process several sites from level-0 to level-2.')
+
+    parser.add_argument('sites', type=str, nargs='*', 
+        help='Names of sites, normally corresponding to TOML metadata files. If none are given, processes all sites with TOML files in firn_stations/ppconfig.')
+
+    cwd = os.getcwd()
+    parser.add_argument('-data_root', type=str, default=cwd,
+        help='Path to root of data (see README), defaults to current directory.')
+
+    parser.add_argument('-workers', type=int, default=None,
+        help='Number of sites to process concurrently, defaults to one per site up to the number of CPUs.')
+
+    parser.add_argument('-log_dir', type=str, default=None,
+        help='Directory in which to save the log of each site, defaults to firn_stations/logs.')
+
+    parser.add_argument('-ow', action='store_true',
+        help='If provided, forces over-write of existing files.')
+
+    parser.add_argument('-incremental', action='store_true',
+        help='If provided, only load level-0 files which are new or have changed since the existing Level-1 file was written.')
+
+    parser.add_argument('-stream', action='store_true',
+        help='If provided, process level-0 files of each site in chunks so that memory use does not grow with the length of the record. Cannot be combined with -incremental.')
+
+    parser.add_argument('-jobs', type=int, default=None,
+        help='Number of workers with which to load level-0 files of each site, overrides `jobs` in the TOML files.')
+
+    parser.add_argument('-skip_l1', action='store_true',
+        help='If provided, do not process level-0 to level-1, only level-1 to level-2.')
+
+    parser.add_argument('-skip_l2', action='store_true',
+        help='If provided, do not process level-1 to level-2.')
+
+    parser.add_argument('-profile', action='store_true',
+        help='If provided, report the time and memory taken by each stage of processing of each site to firn_stations/logs.')
+
+    args = parser.parse_args(argv)
+
+    sites = args.sites
+    if len(sites) == 0:
+        sites = pipeline.list_sites(args.data_root)
+    if len(sites) == 0:
+        raise IOError('No sites specified and no TOML files found in firn_stations/ppconfig.')
+
+    print('Processing %s sites: %s' %(len(sites), ', '.join(sites)))
+    summary = pipeline.run_batch(sites, args.data_root, 
+        workers=args.workers,
+        log_dir=args.log_dir,
+        do_level1=not args.skip_l1,
+        do_level2=not args.skip_l2,
+        level1_opts={'overwrite':args.ow, 'incremental':args.incremental, 'jobs':args.jobs, 
+            'profile':args.profile, 'stream':args.stream},
+        level2_opts={'overwrite':args.ow, 'profile':args.profile})
+
+    print(summary.to_string(float_format='%.1f'))
+
+    if (summary['status'] != 'ok').any():
+        sys.exit(1)
+    return
+
+
+def plot_l2(
+    argv : list | None=None
+    ) -> None:
+    """
+    Plot all variables of a Level-2 NetCDF file, see plotting.render_figures.
+
+    :param argv: command-line arguments. If None, uses sys.argv.
+    """
+    p = argparse.ArgumentParser('Plot Level-2 data for site.')
+    p.add_argument('site', type=str, help='Name of site, e.g. FS1.')
+    p.add_argument('-inpath', type=str, default='.', help='Path to where dataset is stored.')
+    p.add_argument('-infilename', type=str, default=None, help='Filename of the xarray dataset, defaults to <site>.nc.')
+    p.add_argument('-outpath', type=str, default='.', help='Path to store the figures to, defaults to the current working directory.')
+
+    p.add_argument('-start', default=None,
+        type=lambda v: dt.datetime.strptime(v, '%Y-%m-%d'),
+        help='Constrain the time range of each figure to the specified start and finish dates. Use the year-first format, e.g. 2022-06-30. Must be used in conjunction with -finish.'
+    )
+
+    p.add_argument('-finish', default=None,
+        type=lambda v: dt.datetime.strptime(v, '%Y-%m-%d'),
+        help='Constrain the time range of each figure to the specified start and finish dates. Use the year-first format, e.g. 2022-06-30. Must be used in conjunction with -start.'
+    )
+
+    p.add_argument('-tdr_sensors', type=int, nargs='+', default=None,
+        help='Only plot these TDR sensors, e.g. -tdr_sensors 1 2. Defaults to all TDRs.')
+
+    p.add_argument('-workers', type=int, default=None,
+        help='Number of processes with which to render figures concurrently. Defaults to one per figure, up to the number of CPUs.')
+
+    p.add_argument('-dpi', type=int, default=300, help='Resolution of figures.')
+
+    p.add_argument('-format', type=str, default='png', 
+        help='File format of figures, e.g. png (default), or pdf/svg for vector figures.')
+
+    p.add_argument('-no_decimate', action='store_true',
+        help='If provided, draw every sample. By default long series are reduced to the samples visible at the resolution of the figures, keeping spikes and gaps.')
+
+    p.add_argument('-rasterize', action='store_true',
+        help='If provided, rasterize the dense parts of figures (scatters, lines, meshes), which keeps vector formats small.')
+
+    args = p.parse_args(argv)
+
+    if args.infilename is None:
+        args.infilename = args.site.upper() + '.nc'
+    filename = os.path.join(args.inpath, args.infilename)
+    if not os.path.exists(filename):
+        raise IOError('Level-2 file %s does not exist.' %filename)
+
+    from cassandra_fs_pp import level2, plotting
+
+    # Set figures filename time suffix.
+    if args.start is not None:
+        tstr = '_' + args.start.strftime('%Y%m%d') + '_' + args.finish.strftime('%Y%m%d')
+    else:
+        tstr = ''
+
+    sensors = None if args.tdr_sensors is None else {'tdr_sensor': args.tdr_sensors}
+
+    with level2.open_level2(filename) as data:
+        jobs = plotting.figure_jobs(data, args.site, tstr=tstr, fmt=args.format)
+
+    print('Rendering %s figures ...' %len(jobs))
+    timings = plotting.render_figures(filename, jobs, args.site, 
+        outpath=args.outpath, 
+        start=args.start, 
+        finish=args.finish,
+        workers=args.workers, 
+        dpi=args.dpi, 
+        rasterize=args.rasterize,
+        decimate=not args.no_decimate,
+        sensors=sensors)
+    print('Total rendering time %.1f s' %timings['seconds'].sum())
+
+    return
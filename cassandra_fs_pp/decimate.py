@@ -0,0 +1,182 @@
+"""
+Decimation of long time series for plotting.
+
+Years of 10-minute records hold many more samples than a figure has pixels
+across. These functions choose which samples to draw so that a series looks
+the same at the output resolution:
+
+* lines: largest-triangle-three-buckets (LTTB), which keeps the samples
+  that shape the line, including spikes;
+* scatters and heatmaps: the minimum and maximum of each pixel-wide bucket
+  of time, so that the envelope, and so any spike, is kept.
+
+Each function returns the positions of the samples to keep, in time order,
+so that the same selection can be applied to other variables (e.g. the
+depth and colour of a scatter). The first NaN of each run of NaNs is kept,
+so that gaps in the record still break lines and leave blanks in heatmaps.
+"""
+from __future__ import annotations
+
+import numpy as np
+
+
+def pixel_budget(
+    fig,
+    ax,
+    dpi : int
+    ) -> int:
+    """
+    Width of axes in pixels when the figure is saved at dpi.
+    """
+    return max(int(np.ceil(fig.get_figwidth() * dpi * ax.get_position().width)), 1)
+
+
+def _as_float(
+    t
+    ) -> np.ndarray:
+    """ Times (e.g. DatetimeIndex) or other x values as float64, relative to the first. """
+    t = np.asarray(t)
+    if t.dtype.kind == 'M':
+        t = t.astype('datetime64[ns]').astype('int64')
+    t = t.astype('float64')
+    if len(t) > 0:
+        t = t - t[0]
+    return t
+
+
+def _nan_run_starts(
+    valid : np.ndarray
+    ) -> np.ndarray:
+    """ Positions of the first sample of each run of invalid samples. """
+    return np.flatnonzero(~valid & np.r_[True, valid[:-1]])
+
+
+def lttb(
+    x,
+    y : np.ndarray,
+    n_out : int
+    ) -> np.ndarray:
+    """
+    Largest-triangle-three-buckets downsampling of a line.
+
+    The first and last samples are kept. The others are split into n_out-2
+    buckets of equal size, and from each bucket the sample which forms the
+    largest triangle with the sample kept from the previous bucket and the
+    average of the next bucket is kept.
+
+    :param x: x values (e.g. times), in increasing order.
+    :param y: y values, without NaNs.
+    :param n_out: number of samples to keep.
+    :returns: positions of samples to keep.
+    """
+    n = len(y)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    x = _as_float(x)
+    y = np.asarray(y, dtype='float64')
+
+    edges = np.linspace(1, n - 1, n_out - 1).astype('int64')
+    keep = np.empty(n_out, dtype='int64')
+    keep[0] = 0
+    keep[-1] = n - 1
+    a = 0
+    for i in range(n_out - 2):
+        lo, hi = edges[i], edges[i + 1]
+        next_hi = edges[i + 2] if i + 2 < len(edges) else n
+        avg_x = x[hi:next_hi].mean()
+        avg_y = y[hi:next_hi].mean()
+        area = np.abs((x[a] - avg_x) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (avg_y - y[a]))
+        a = lo + np.argmax(area)
+        keep[i + 1] = a
+    return keep
+
+
+def decimate_line(
+    x,
+    y : np.ndarray,
+    n_out : int
+    ) -> np.ndarray:
+    """
+    Samples of a line to draw, by LTTB, keeping gaps.
+
+    :param x: x values (e.g. times), in increasing order.
+    :param y: y values, NaN where missing.
+    :param n_out: number of samples to keep, e.g. twice the pixel budget.
+    :returns: positions of samples to keep, in order.
+    """
+    y = np.asarray(y, dtype='float64')
+    if len(y) <= n_out:
+        return np.arange(len(y))
+    valid = ~np.isnan(y)
+    positions = np.flatnonzero(valid)
+    keep = positions[lttb(np.asarray(x)[valid], y[valid], n_out)]
+    return np.union1d(keep, _nan_run_starts(valid))
+
+
+def _bucket(
+    x,
+    n_buckets : int
+    ) -> np.ndarray:
+    """ Bucket of each sample, dividing the range of x into n_buckets of equal width. """
+    x = _as_float(x)
+    span = x[-1] if len(x) > 0 else 0
+    if span <= 0:
+        return np.zeros(len(x), dtype='int64')
+    return np.minimum((x / span * n_buckets).astype('int64'), n_buckets - 1)
+
+
+def decimate_points(
+    x,
+    y : np.ndarray,
+    n_buckets : int
+    ) -> np.ndarray:
+    """
+    Samples to draw, by the minimum and maximum of each bucket of x.
+
+    :param x: x values (e.g. times), in increasing order.
+    :param y: values of which to keep the envelope, NaN where missing.
+    :param n_buckets: number of buckets, e.g. the pixel budget.
+    :returns: positions of samples to keep, in order.
+    """
+    y = np.asarray(y, dtype='float64')
+    if len(y) <= 2 * n_buckets:
+        return np.arange(len(y))
+    valid = ~np.isnan(y)
+    positions = np.flatnonzero(valid)
+    buckets = _bucket(x, n_buckets)[valid]
+    order = np.lexsort((y[valid], buckets))
+    sorted_buckets = buckets[order]
+    first = np.r_[True, sorted_buckets[1:] != sorted_buckets[:-1]]
+    last = np.r_[sorted_buckets[1:] != sorted_buckets[:-1], True]
+    keep = positions[order[first | last]]
+    return np.union1d(keep, _nan_run_starts(valid))
+
+
+def decimate_columns(
+    x,
+    values : np.ndarray,
+    n_buckets : int,
+    axis : int=-1
+    ) -> np.ndarray:
+    """
+    Time steps of a heatmap to draw, by the minimum and maximum of each bucket of x.
+
+    In each bucket, the time steps which hold the lowest and the highest
+    value of any sensor are kept.
+
+    :param x: x values (e.g. times) along axis, in increasing order.
+    :param values: 2-D array of values, NaN where missing.
+    :param n_buckets: number of buckets, e.g. the pixel budget.
+    :param axis: axis of values along x.
+    :returns: positions along axis to keep, in order.
+    """
+    values = np.moveaxis(np.asarray(values, dtype='float64'), axis, 0)
+    if len(values) <= 2 * n_buckets:
+        return np.arange(len(values))
+    valid = ~np.isnan(values).all(axis=1)
+    lows = np.full(len(values), np.nan)
+    highs = np.full(len(values), np.nan)
+    lows[valid] = np.nanmin(values[valid], axis=1)
+    highs[valid] = np.nanmax(values[valid], axis=1)
+    keep = np.union1d(decimate_points(x, lows, n_buckets), decimate_points(x, highs, n_buckets))
+    return np.union1d(keep, _nan_run_starts(valid))
@@ -15,16 +15,418 @@ import re
 import copy
 import numpy as np
 import glob
+import functools
+import concurrent.futures
+import collections
+import itertools
+import json
+import tempfile
+import hashlib
+
+from cassandra_fs_pp import toa5
+from cassandra_fs_pp.cache import Level0Cache, file_hash
+from cassandra_fs_pp.instrument import Profiler, instrumented
+from cassandra_fs_pp.merge import SortedMerge
+from cassandra_fs_pp.paths import LEVEL1_FORMATS, level1_default_path, level2_default_path
+from cassandra_fs_pp.schema import SiteSchema, site_schema
+from cassandra_fs_pp.sink import Level1Sink
 
 REQUIRED_CONFIG_KEYS = ['site']
 REQUIRED_CONFIG_L0_KEYS = ['header', 'skiprows', 'index_col']
 
 
+@functools.lru_cache(maxsize=None)
+def _load_valid_data_ranges(
+    spec_file : str,
+    mtime : float
+    ) -> list:
+    """
+    Load the valid data ranges specification.
+
+    Each entry is parsed to a (family, key, vmin, vmax) tuple, where family
+    is "tdr" (key is the TDR variable, e.g. T) or "ec" (key is None) for 
+    array-type variables, or else "column" (key is the column name), see
+    schema.SiteSchema. Cached per file; `mtime` ensures that the cache is 
+    invalidated if the file is edited.
+
+    :param spec_file: TOML file of valid data ranges.
+    :param mtime: modification time of spec_file.
+    """
+    with open(spec_file, "rb") as f:
+        spec = tomli.load(f)
+
+    parsed = []
+    for col in spec:
+        if col[0:3].upper() == 'TDR':
+            family, key = 'tdr', col[4:]
+        elif col[0:2].upper() == 'EC':
+            family, key = 'ec', None
+        else:
+            family, key = 'column', col
+        vmin, vmax = spec[col]
+        parsed.append((family, key, vmin, vmax))
+    return parsed
+
+
+@functools.lru_cache(maxsize=32)
+def _valid_range_arrays(
+    spec_file : str,
+    mtime : float,
+    columns : tuple
+    ) -> tuple:
+    """
+    Resolve the valid data ranges specification against a set of columns.
+
+    Where several entries apply to the same column, the narrowest range 
+    results, as if each were applied in turn.
+
+    :param spec_file: TOML file of valid data ranges.
+    :param mtime: modification time of spec_file.
+    :param columns: tuple of column names.
+    :returns: (array of positions of the columns which have a valid range,
+    in column order, array of minima, array of maxima)
+    """
+    spec = _load_valid_data_ranges(spec_file, mtime)
+    schema = site_schema(columns)
+    ranges = {}
+    for family, key, vmin, vmax in spec:
+        if family == 'tdr':
+            positions = schema.tdr_positions(key)
+        elif family == 'ec':
+            positions = schema.ec_positions()
+        else:
+            positions = [schema.surface[key]] if key in schema.surface else []
+        for i in positions:
+            lo, hi = ranges.get(i, (-np.inf, np.inf))
+            ranges[i] = (max(lo, vmin), min(hi, vmax))
+
+    positions = np.array(sorted(ranges.keys()), dtype='int64')
+    vmin = np.array([ranges[i][0] for i in positions], dtype='float64')
+    vmax = np.array([ranges[i][1] for i in positions], dtype='float64')
+    return positions, vmin, vmax
+
+
+@functools.lru_cache(maxsize=None)
+def _load_ec_calibrations(
+    cal_file : str,
+    mtime : float
+    ) -> pd.DataFrame:
+    """
+    Load EC calibration coefficients.
+
+    Cached per file; `mtime` ensures that the cache is invalidated if the 
+    file is edited.
+
+    :param cal_file: CSV file of coefficients m and c, indexed by EC column name.
+    :param mtime: modification time of cal_file.
+    :returns: DataFrame of calibrations. Do not modify, it is memoized.
+    """
+    return pd.read_csv(cal_file, index_col=0)
+
+
+@functools.lru_cache(maxsize=32)
+def _ec_calibration_arrays(
+    cal_file : str,
+    mtime : float,
+    columns : tuple
+    ) -> tuple:
+    """
+    Align EC calibration coefficients with a set of EC columns.
+
+    Sensors without calibration are given the average coefficients of the 
+    calibrated sensors.
+
+    :param cal_file: CSV file of coefficients m and c, indexed by EC column name.
+    :param mtime: modification time of cal_file.
+    :param columns: tuple of EC column names.
+    :returns: (array of m, array of c, list of columns without calibration)
+    """
+    calibrations = _load_ec_calibrations(cal_file, mtime)
+    aligned = calibrations.reindex(columns)
+    missing = [c for c, ok in zip(columns, aligned['m'].notna() & aligned['c'].notna()) if not ok]
+    m = aligned['m'].fillna(calibrations['m'].mean()).to_numpy(dtype='float64')
+    c = aligned['c'].fillna(calibrations['c'].mean()).to_numpy(dtype='float64')
+    return m, c, missing
+
+
+# Used to find the sensor ID of array-type variables.
+# First try array-type variable, e.g. DTC1(10)
+_RE_ARRAY_ID = re.compile(r'\((?P<id>[0-9]+)\)$')
+# If that doesn't work, try generic multiple type, e.g. TDR1_T
+_RE_MULTIPLE_ID = re.compile(r'[A-Za-z]+(?P<id>[0-9]+)\_')
+_RE_RENUMBER = re.compile(r'\*')
+
+
+@functools.lru_cache(maxsize=None)
+def _load_l2_column_rules(
+    mapping_file : str,
+    mtime : float
+    ) -> list:
+    """
+    Load and compile the level-1 -> level-2 column name mapping rules.
+
+    Cached per file; `mtime` ensures that the cache is invalidated if the 
+    file is edited.
+
+    :param mapping_file: filename of old->new regexes.
+    :param mtime: modification time of mapping_file.
+    :returns: list of (compiled level-1 regex, level-2 name template).
+    """
+    mapping = pd.read_csv(mapping_file)
+    rules = []
+    for old, new in zip(mapping['level0'], mapping['level2']):
+        rules.append((re.compile(old), new))
+    return rules
+
+
+@functools.lru_cache(maxsize=32)
+def _l2_column_mapping(
+    mapping_file : str,
+    mtime : float,
+    columns : tuple
+    ) -> dict:
+    """
+    Resolve the column name mapping rules against a set of level-1 columns.
+
+    The columns are matched against all the rules in a single pass. A rule 
+    which matches several columns is treated as an 'array'-type variable
+    (e.g. DTC) and the sensor ID of each column is substituted into the 
+    level-2 name template. A rule which matches only one column is applied as-is.
+    Where several rules match a column, the last one in the file wins.
+
+    :param mapping_file: filename of old->new regexes.
+    :param mtime: modification time of mapping_file.
+    :param columns: tuple of level-1 column names.
+    :returns: dict of old:new column names. Do not modify, it is memoized.
+    """
+    rules = _load_l2_column_rules(mapping_file, mtime)
+
+    matches = [[] for r in rules]
+    for col in columns:
+        for i, (regex, _) in enumerate(rules):
+            if regex.search(col):
+                matches[i].append(col)
+
+    new_mapping = {}
+    for (_, template), cols in zip(rules, matches):
+        # 'Array'-type variables (e.g. DTC)
+        if len(cols) > 1:
+            for col in cols:
+                # Get sensor number
+                res = _RE_ARRAY_ID.search(col)
+                if res == None:
+                    res = _RE_MULTIPLE_ID.search(col)
+                if res == None:
+                    print('Could not find sensor ID.')
+                    raise ValueError
+
+                sensor_id = res.groupdict()['id']
+                new_mapping[col] = _RE_RENUMBER.sub(sensor_id, template)
+        elif len(cols) == 1:
+            new_mapping[cols[0]] = template
+
+    return new_mapping
+
+
+def _smallest_int_dtype(
+    vmin : int,
+    vmax : int
+    ) -> np.dtype | None:
+    """
+    Smallest signed integer dtype which can hold values from vmin to vmax,
+    or None if they do not fit in int64 (e.g. large uint64 values).
+    """
+    for dtype in ['int8', 'int16', 'int32', 'int64']:
+        info = np.iinfo(dtype)
+        if info.min <= vmin and vmax <= info.max:
+            return np.dtype(dtype)
+    return None
+
+
+def downcast_dtypes(
+    df : pd.DataFrame,
+    float_dtype : str='float32'
+    ) -> pd.DataFrame:
+    """
+    Apply the memory-lean dtype policy to a DataFrame of measurements.
+
+    Floating-point columns (sensor channels) become float_dtype. Integer
+    columns (e.g. RECORD, Q) become the smallest integer dtype which holds 
+    their values. Other columns (e.g. booleans, and pandas nullable dtypes)
+    are left as they are.
+
+    All columns which change are converted in one go, and df is returned 
+    as-is if none change.
+
+    :param df: DataFrame to convert.
+    :param float_dtype: dtype of floating-point columns.
+    :returns: converted DataFrame.
+    """
+    float_dtype = np.dtype(float_dtype)
+    # Final dtype of each column, by position.
+    final = []
+    for i, dtype in enumerate(df.dtypes):
+        new = dtype
+        if isinstance(dtype, np.dtype) and dtype.kind == 'f':
+            new = float_dtype
+        elif isinstance(dtype, np.dtype) and dtype.kind in 'iu' and len(df) > 0:
+            values = df.iloc[:, i]
+            new = _smallest_int_dtype(int(values.min()), int(values.max()))
+            if new is None:
+                new = dtype
+        final.append(new)
+
+    dtypes = {c:new for c, dtype, new in zip(df.columns, df.dtypes, final) if new != dtype}
+    if not df.columns.is_unique:
+        # astype converts every column of a name, so only convert the names
+        # whose columns all end up with the same dtype.
+        by_name = {}
+        for c, new in zip(df.columns, final):
+            by_name.setdefault(c, set()).add(new)
+        dtypes = {c:new for c, new in dtypes.items() if len(by_name[c]) == 1}
+
+    if len(dtypes) > 0 and df.columns.is_unique:
+        # Build from arrays, so that columns of the same dtype are held in
+        # one block (astype leaves one block per column, which slows down
+        # every later operation across columns).
+        attrs = df.attrs
+        df = pd.DataFrame({c:df[c].to_numpy(dtype=dtypes[c]) if c in dtypes else df[c].array
+            for c in df.columns}, index=df.index)
+        df.attrs = attrs
+    elif len(dtypes) > 0:
+        df = df.astype(dtypes)
+    return df
+
+
+def _regularise(
+    index : pd.DatetimeIndex,
+    limit : int=3
+    ) -> tuple:
+    """
+    Map an irregularly-sampled record onto a regular time grid.
+
+    UDGs are sampled more often in summer than in winter. The grid step is 
+    the most common sampling interval. Each record is held (forward-filled)
+    from its grid point until the next record, for at most `limit` further 
+    steps, so records of a sparser regime (e.g. hourly winter records on a 
+    10-minute grid) are held for limit+1 steps and then leave a gap. This 
+    is the same as pd.Series.resample(step).ffill(limit), but computed on 
+    integer positions so that the grid is never built as an index.
+
+    Records which do not fall on the grid (e.g. a regime whose interval is
+    not a multiple of the step) are held from the next grid point, for at 
+    most `limit` steps. Where several records fall between the same two 
+    grid points, only the last is held.
+
+    :param index: monotonic increasing DatetimeIndex of the record.
+    :param limit: maximum number of grid steps to hold each record beyond its own.
+    :returns: (step as Timedelta, grid position of each record, number of 
+    grid points held by each record, length of grid)
+    """
+    t = index.asi8
+    if len(t) < 2:
+        raise ValueError('At least two records are needed to regularise a record.')
+    diffs = np.diff(t)
+    values, counts = np.unique(diffs, return_counts=True)
+    # Ties go to the shortest interval.
+    step = values[np.argmax(counts)]
+    offset = t - t[0]
+    positions = -(-offset // step)
+    on_grid = offset % step == 0
+    ends = np.append(positions[1:], positions[-1] + 1)
+    hold = np.minimum(ends - positions, limit + on_grid.astype('int64'))
+    n_grid = positions[-1] + 1
+    return pd.Timedelta(step, unit='ns'), positions, hold, n_grid
+
+
+def _rolling_median_at(
+    values : np.ndarray,
+    positions : np.ndarray,
+    hold : np.ndarray,
+    n_grid : int,
+    window : int
+    ) -> np.ndarray:
+    """
+    Rolling median of a regularised record, at the grid position of each record.
+
+    :param values: 2-D array of records x channels.
+    :param positions, hold, n_grid: see _regularise.
+    :param window: number of grid steps in the median window, ending at 
+    (and including) each position. NaNs are skipped.
+    :returns: float64 array of the same shape as values.
+    """
+    grid = np.full((n_grid, values.shape[1]), np.nan, dtype=values.dtype)
+    rows = np.repeat(np.arange(len(positions)), hold)
+    steps = np.arange(len(rows)) - np.repeat(np.cumsum(hold) - hold, hold)
+    grid[positions[rows] + steps] = values[rows]
+    # pandas implements the rolling median with a skiplist, O(n log window),
+    # and applies it to each channel in turn.
+    med = pd.DataFrame(grid).rolling(window, min_periods=1).median().to_numpy()
+    return med[positions]
+
+
+def _level0_file_changed(
+    filename : str,
+    load_opts : dict,
+    entry : dict
+    ) -> bool:
+    """
+    Check whether a level-0 file differs from its entry in a Level-1 manifest.
+
+    The content hash is only computed if the size or modification time differ.
+
+    :param filename: path/filename of level-0 file.
+    :param load_opts: the options with which the file would be loaded.
+    :param entry: the manifest entry of the file.
+    """
+    if entry.get('options') != json.loads(json.dumps(load_opts)):
+        return True
+    stat = os.stat(filename)
+    if stat.st_size != entry.get('size'):
+        return True
+    if stat.st_mtime != entry.get('mtime'):
+        return file_hash(filename) != entry.get('sha256')
+    return False
+
+
+def _load_level0_file_worker(
+    filename : str,
+    load_opts : dict,
+    cache_root : str | None=None
+    ) -> pd.DataFrame:
+    """
+    Load a level-0 file in a worker process, see fs._load_level0_file.
+
+    Only the arguments are sent to the worker, rather than the whole fs object.
+
+    :param filename: file path and name of the file to open.
+    :param load_opts: dict of options to pass to pd.read_csv.
+    :param cache_root: directory of the level-0 cache, or None if it is not enabled.
+    """
+    if cache_root is None:
+        return fs._read_level0_file(filename, load_opts)
+
+    cache = Level0Cache(cache_root)
+    key = cache.key(filename, load_opts)
+    data = cache.get(key)
+    if data is None:
+        data = fs._read_level0_file(filename, load_opts)
+        cache.put(key, data)
+    return data
+
+
 class fs():
     
     config = None
     data_root = None
     ds_level1 = None
+    level0_metadata = None
+    level0_cache = None
+    valid_range_flags = None
+    duplicates_report = None
+    profiler = None
+    _ec_missing_reported = None
+    _udg_median_memo = None
 
     def __init__(
         self,
@@ -39,9 +441,48 @@ class fs():
         """
         self._load_config(config_file)
         self.data_root = data_root
+        # Summary of each level-0 file ingested into ds_level1, see 
+        # _record_level0_file.
+        self._level0_summary = {}
+        # Manifest of the Level-1 dataset from which ds_level1 was loaded.
+        self._level1_manifest = None
+        # Records the time and memory taken by each stage of processing, see 
+        # instrument.Profiler.
+        self.profiler = Profiler()
+        if self.config['level0_1'].get('cache', False):
+            self.enable_level0_cache()
         return
 
 
+    def enable_level0_cache(
+        self,
+        max_mb : float | None=None
+        ) -> Level0Cache:
+        """
+        Cache parsed level-0 files on disk, so that they do not need to be parsed
+        again unless the file or the options used to load it change.
+
+        The cache is stored in firn_stations/cache/level-0 under the data_root.
+        Sets self.level0_cache.
+
+        :param max_mb: maximum size of the cache in megabytes, beyond which the 
+        least-recently-used entries are evicted. If None, uses option 
+        `cache_max_mb` in [level0_1], default 1024.
+        """
+        if max_mb is None:
+            max_mb = self.config['level0_1'].get('cache_max_mb', 1024)
+        self.level0_cache = Level0Cache(self._get_level0_cache_path(), 
+            max_bytes=int(max_mb * 1e6))
+        return self.level0_cache
+
+
+    def _get_level0_cache_path(self) -> str:
+        """
+        Default location of the level-0 cache.
+        """
+        return os.path.join(self.data_root, 'firn_stations/cache/level-0')
+
+
     def _load_config(
         self, 
         config_file : str
@@ -65,9 +506,11 @@ class fs():
         return
       
 
+    @instrumented()
     def level0_to_level1(
         self,
-        add_latest_serviced : bool=True
+        add_latest_serviced : bool=True,
+        jobs : int | None=None
         ) -> pd.DataFrame:
         """ 
         Transform Level-0 data to Level-1.
@@ -76,8 +519,261 @@ class fs():
 
         :param add_latest_serviced: if True, append the data from the first *MainTable*
         file found in the `serviced` sub-directory of the latest subdataset.
+        :param jobs: number of worker processes/threads with which to load the 
+        level-0 files concurrently. If None, uses option `jobs` from [level0_1], 
+        or loads serially if this is not set. See _iter_level0_files.
+        """
+        self._level0_summary = {}
+        self._level1_manifest = None
+        tasks = self._level0_tasks()
+        ds = self._merge_level0(tasks, jobs=jobs)
+
+        # Check for entire columns of NANs and remove them
+        empty = ds.columns[ds.isna().all()]
+        if len(empty) > 0:
+            ds = ds.drop(columns=empty)
+
+        self.ds_level1 = ds
+        return ds
+
+
+    @instrumented()
+    def update_level1(
+        self,
+        level1_file : str | None=None,
+        jobs : int | None=None,
+        fmt : str | None=None
+        ) -> pd.DataFrame:
+        """
+        Incrementally update an existing Level-1 dataset with new Level-0 data.
+
+        Only level-0 files which are not listed in the manifest of the existing
+        Level-1 dataset, or which have changed since (size, modification time,
+        content hash or load options), are loaded. 
+        
+        If files are only new, they are merged into the existing Level-1 data
+        from the time of the first new record onwards, see _merge_level0. The
+        existing data take precedence.
+
+        If files have changed, the existing data from the earliest record of 
+        the changed and new files (before or after the change) onwards are 
+        discarded, and rebuilt from all the level-0 files which have records 
+        from then onwards, as level0_to_level1 would.
+
+        If the Level-1 dataset or its manifest do not exist yet, falls back to
+        a full level0_to_level1.
+
+        Sets self.ds_level1. Call write_l1 to save the dataset and its updated 
+        manifest.
+
+        :param level1_file: path/filename of existing Level-1 dataset. If None 
+        then uses the default location.
+        :param jobs: number of concurrent workers, see _iter_level0_files.
+        :param fmt: format of the Level-1 dataset at the default location, see
+        write_l1. If None, looks for an existing dataset in any format, see 
+        _find_level1_path. Ignored if level1_file is provided.
+        """
+        if level1_file is None:
+            if fmt is None:
+                level1_file = self._find_level1_path()
+            else:
+                level1_file = self._get_level1_default_path(fmt)
+        manifest_file = self._get_level1_manifest_path(level1_file)
+
+        if not (os.path.exists(level1_file) and os.path.exists(manifest_file)):
+            print('No existing Level-1 dataset and manifest found, processing all Level-0 data.')
+            return self.level0_to_level1(jobs=jobs)
+
+        existing = self.load_level1_dataset(level1_file)
+        manifest = self._level1_manifest
+
+        self._level0_summary = {}
+        tasks = self._level0_tasks()
+        new_tasks = []
+        changed = {}
+        for filename, load_opts in tasks:
+            key = os.path.relpath(filename, self.data_root)
+            if key in manifest['files']:
+                entry = manifest['files'][key]
+                if not _level0_file_changed(filename, load_opts, entry):
+                    # Keep the record of the file for the next manifest.
+                    self._level0_summary[filename] = entry
+                    continue
+                print('Level-0 file has changed: %s' %filename)
+                changed[filename] = entry
+            else:
+                print('New Level-0 file: %s' %filename)
+            new_tasks.append((filename, load_opts))
+
+        if len(new_tasks) == 0:
+            print('No new Level-0 data, Level-1 dataset is up to date.')
+            return self.ds_level1
+
+        # Only the existing data which overlap the new data need to be merged.
+        starts = [self._level0_start(f, opts) for f, opts in new_tasks]
+        # The existing data also hold the records of changed files as they were.
+        old_starts = [pd.Timestamp(e['first_timestamp']) for e in changed.values() 
+            if e.get('first_timestamp') is not None]
+        if any([s is None for s in starts]):
+            window_start = existing.index.min()
+        else:
+            window_start = min(starts + old_starts)
+        before = existing[existing.index < window_start]
+        overlap = existing[existing.index >= window_start]
+
+        if len(changed) == 0:
+            print('Merging new data from %s onwards.' %window_start)
+            window = self._merge_level0(new_tasks, jobs=jobs, starts=starts, 
+                leading=(level1_file, overlap))
+        else:
+            print('Rebuilding Level-1 data from %s onwards.' %window_start)
+            rebuild = []
+            rebuild_starts = []
+            new_starts = dict(zip([t[0] for t in new_tasks], starts))
+            for filename, load_opts in tasks:
+                if filename in new_starts:
+                    first = new_starts[filename]
+                else:
+                    entry = self._level0_summary[filename]
+                    if entry.get('last_timestamp') is None or \
+                        pd.Timestamp(entry['last_timestamp']) < window_start:
+                        continue
+                    first = pd.Timestamp(entry['first_timestamp'])
+                rebuild.append((filename, load_opts))
+                rebuild_starts.append(first)
+            window = self._merge_level0(rebuild, jobs=jobs, starts=rebuild_starts)
+            window = window[window.index >= window_start]
+        # Remove entire columns of NaNs brought in by the new data.
+        empty = window.columns[window.isna().all()].difference(existing.columns)
+        window = window.drop(columns=empty)
+
+        ds = pd.concat((before, window), axis=0)
+        self.ds_level1 = ds
+        return ds
+
+
+    @instrumented()
+    def stream_level0_to_level1(
+        self,
+        outpath : str | None=None,
+        fmt : str | None=None,
+        chunk_rows : int | None=None
+        ) -> str:
         """
-        store = []
+        Transform Level-0 data to Level-1 and write it to disk, out-of-core.
+
+        Gives the same Level-1 dataset as level0_to_level1 followed by write_l1,
+        but peak memory is bounded by chunk_rows rather than by the length of
+        the record. Level-0 files are read in chunks and streamed through the 
+        merge (see _merge_level0), which removes duplicates. The level-0 cache
+        and concurrent loading are not used.
+
+        Whether each column has any data, and the dtype it will need, are 
+        only known once all the data have been read. The merged chunks are 
+        therefore first written to a temporary folder alongside outpath; in a
+        second pass each chunk is given the final columns and dtypes and is 
+        appended to the Level-1 dataset, see sink.Level1Sink. The whole record
+        is therefore written to disk twice (and read back once), and the 
+        folder needs as much free space as the Level-1 dataset.
+
+        Also writes the manifest of the level-0 files, see write_l1. 
+        self.ds_level1 is not set.
+
+        :param outpath: path/filename to write to. If None, uses the default
+        location for the format.
+        :param fmt: format, see write_l1.
+        :param chunk_rows: number of rows of each level-0 file to read and
+        merge at a time. If None, uses option `chunk_rows` in [level0_1] 
+        (default 100000).
+        :returns: path/filename of Level-1 dataset.
+        """
+        fmt = self._level1_format(outpath, fmt)
+        if outpath is None:
+            outpath = self._get_level1_default_path(fmt)
+        opts = self.config['level0_1']
+        if chunk_rows is None:
+            chunk_rows = opts.get('chunk_rows', 100000)
+
+        self._level0_summary = {}
+        self._level1_manifest = None
+        tasks = self._level0_tasks()
+        starts = [self._level0_start(f, load_opts) for f, load_opts in tasks]
+        merge = SortedMerge([t[0] for t in tasks], starts, chunk_rows=chunk_rows)
+
+        def frames():
+            for i in merge.open_order():
+                yield self._iter_level0_chunks(tasks[i][0], tasks[i][1], chunk_rows)
+
+        print('Streaming %s level-0 files in chunks of %s rows ...' %(len(tasks), chunk_rows))
+        with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(outpath))) as tmp:
+            # First pass: merge, and keep track of the columns which have data
+            # and of the dtypes of each chunk.
+            spooled = []
+            has_data = set()
+            probes = {}
+            midnight = True
+            subsecond = False
+            for chunk in merge.merge(frames()):
+                has_data.update(chunk.columns[chunk.notna().any().to_numpy()])
+                if isinstance(chunk.index, pd.DatetimeIndex):
+                    midnight = midnight and (chunk.index == chunk.index.normalize()).all()
+                    subsecond = subsecond or (chunk.index != chunk.index.floor('s')).any()
+                # The first row of each distinct set of columns and dtypes 
+                # is enough to work out the dtypes of the whole dataset.
+                probes.setdefault(tuple(chunk.dtypes.items()), chunk.iloc[:1].copy())
+                spooled.append(os.path.join(tmp, 'chunk%06d.pkl' %len(spooled)))
+                chunk.to_pickle(spooled[-1])
+
+            columns = [c for c in merge.columns if c in has_data]
+            if len(probes) > 0:
+                dtypes = pd.concat(list(probes.values()), axis=0).dtypes[columns]
+            else:
+                dtypes = pd.Series(dtype=object)
+
+            # pandas writes timestamps to CSV as briefly as the whole index 
+            # allows; do the same for every chunk.
+            if midnight:
+                date_format = '%Y-%m-%d'
+            elif subsecond:
+                date_format = '%Y-%m-%d %H:%M:%S.%f'
+            else:
+                date_format = '%Y-%m-%d %H:%M:%S'
+
+            # Second pass: write each chunk with the final columns and dtypes.
+            with Level1Sink(outpath, fmt=fmt, 
+                    float_dtype=opts.get('l1_float_dtype', 'float32'), 
+                    compression=opts.get('l1_compression', 'zstd'),
+                    date_format=date_format) as sink:
+                for f in spooled:
+                    chunk = pd.read_pickle(f)
+                    os.remove(f)
+                    if list(chunk.columns) != columns:
+                        chunk = chunk.reindex(columns=columns)
+                    changed = {c:d for c, d in dtypes.items() if chunk[c].dtype != d}
+                    if len(changed) > 0:
+                        chunk = chunk.astype(changed)
+                    sink.write(chunk)
+                if sink.rows == 0:
+                    sink.write(pd.DataFrame(columns=columns, 
+                        index=pd.DatetimeIndex([], name=opts['index_col'])))
+
+        self.profiler.record(rows_read=merge.rows_in, chunks=len(spooled))
+        print('Level-1 data written to %s' %outpath)
+        self._report_merge(merge)
+        self._write_level1_manifest(outpath)
+        return outpath
+
+
+    def _level0_tasks(self) -> list:
+        """
+        Build the complete, ordered list of level-0 files to load across all 
+        datasets, so that they can all be loaded concurrently.
+
+        The `serviced` data are only looked for in the latest dataset.
+
+        :returns: list of (filename, load_opts) tuples.
+        """
+        tasks = []
         nds = len(self.config['level0'])
         n = 1
         for dataset in self.config['level0']:
@@ -85,31 +781,119 @@ class fs():
                 serviced = True
             else:
                 serviced = False
-            sds = self.load_level0_dataset(dataset, add_serviced=serviced)
-            store.append(sds)
+            ds_load_opts = self._setup_level0_options(dataset)
+            for f in self._level0_dataset_files(dataset, add_serviced=serviced):
+                tasks.append((f, ds_load_opts))
             n += 1
+        return tasks
 
-        ds = pd.concat(store, axis=0)
 
-        # Check for entire columns of NANs and remove them
-        ds = ds.dropna(how='all', axis='columns')
-
-        # Checking for duplicates...
-        print('%s records before removal of duplicates' %len(ds))
-        # Delete any duplicates which have slipped in due to non-cleared MainTables
-        ds = ds.drop_duplicates()
-        print('%s records after duplicated rows dropped' %len(ds))
-        # Delete any temporal duplicates
-        ds = ds[~ds.index.duplicated()]
-        print('%s records after duplicated indexes dropped' %len(ds))
-        self.ds_level1 = ds
+    def _record_duplicates(self) -> None:
+        """
+        Add the number of duplicated records dropped from each level-0 file
+        to its summary, and so to the Level-1 manifest.
+        """
+        for f, row in self.duplicates_report.iterrows():
+            if f in self._level0_summary:
+                self._level0_summary[f]['duplicates_dropped'] = int(row['identical'] + row['conflicting'])
+                if row.get('late', 0) > 0:
+                    self._level0_summary[f]['late_dropped'] = int(row['late'])
+        return
+
+
+    @instrumented()
+    def _merge_level0(
+        self,
+        tasks : list,
+        jobs : int | None=None,
+        starts : list | None=None,
+        leading : tuple | None=None
+        ) -> pd.DataFrame:
+        """
+        Merge level-0 files into a single time-sorted DataFrame without 
+        duplicated timestamps.
+
+        The files are streamed through a k-way merge (see merge.SortedMerge)
+        rather than all being loaded and concatenated: each file is only 
+        loaded once the merge reaches the time of its first record, and is
+        released once merged. Where records share a timestamp, the record 
+        from the earliest file in tasks is kept.
+
+        Option `chunk_rows` in [level0_1] (default 100000) sets the number of 
+        rows of each file merged at a time.
+
+        Sets self.duplicates_report, a DataFrame of the number of identical, 
+        conflicting and late records dropped from each file.
+
+        :param tasks: list of (filename, load_opts) tuples, in order of precedence.
+        :param jobs: number of concurrent workers, see _iter_level0_files.
+        :param starts: timestamp of the first record of each file, if already
+        known. Otherwise they are read, see _level0_start.
+        :param leading: optional (name, DataFrame) of data which take precedence
+        over all the files, e.g. existing Level-1 data.
+        :returns: merged DataFrame.
+        """
+        if starts is None:
+            starts = [self._level0_start(f, opts) for f, opts in tasks]
+        names = [t[0] for t in tasks]
+        if leading is not None:
+            first = leading[1].index.min() if len(leading[1]) > 0 else None
+            names = [leading[0]] + names
+            starts = [first] + starts
+        chunk_rows = self.config['level0_1'].get('chunk_rows', 100000)
+        merge = SortedMerge(names, starts, chunk_rows=chunk_rows)
+
+        def frames():
+            # Load the files in the order in which the merge opens them.
+            offset = 0 if leading is None else 1
+            order = [i - offset for i in merge.open_order() if i >= offset]
+            loaded = self._iter_level0_files([tasks[i] for i in order], jobs=jobs)
+            for i in merge.open_order():
+                if i < offset:
+                    yield leading[1]
+                else:
+                    yield next(loaded)
+            # Finish the generator, so that the level-0 cache is trimmed.
+            for data in loaded:
+                pass
+
+        print('Merging %s level-0 files ...' %len(tasks))
+        chunks = list(merge.merge(frames()))
+        if len(chunks) > 0:
+            ds = pd.concat(chunks, axis=0)
+        else:
+            ds = pd.DataFrame(columns=merge.columns)
+        if list(ds.columns) != merge.columns:
+            ds = ds[merge.columns]
+        self.profiler.record(rows_read=merge.rows_in, chunks=len(chunks))
+        self._report_merge(merge)
         return ds
 
 
+    def _report_merge(
+        self,
+        merge : SortedMerge
+        ) -> None:
+        """
+        Print the number of records dropped by a merge of level-0 files and 
+        keep them in self.duplicates_report and the level-0 file summaries.
+
+        :param merge: the merge, once complete.
+        """
+        self.duplicates_report = merge.report
+        print('%s records read, %s records after removal of duplicates' %(merge.rows_in, merge.rows_out))
+        for source, row in self.duplicates_report.iterrows():
+            print('\t %s: %s identical, %s conflicting, %s late' %(source, row['identical'], 
+                row['conflicting'], row['late']))
+        self._record_duplicates()
+        return
+
+
     def load_level0_dataset(
         self,
         dataset : str,
-        add_serviced : bool=False
+        add_serviced : bool=False,
+        jobs : int | None=None
         ) -> pd.DataFrame:
         """
         Load a complete dataset (single file or bales) into memory.
@@ -119,15 +903,32 @@ class fs():
         also look for a subfolder named `serviced`, located within config 
         option `subpath`. It will add data saved here, the idea being to 
         concatenate the newly-read-out data downloaded at the end of the servicing visit.
+        :param jobs: number of concurrent workers, see _iter_level0_files.
         """
-        ds_config = self.config['level0'][dataset]        
         ds_load_opts = self._setup_level0_options(dataset)
+        files = self._level0_dataset_files(dataset, add_serviced=add_serviced)
+        ds = self._merge_level0([(f, ds_load_opts) for f in files], jobs=jobs)
+        return ds
+
+
+    def _level0_dataset_files(
+        self,
+        dataset : str,
+        add_serviced : bool=False
+        ) -> list:
+        """
+        List the level-0 files which make up a dataset, in the order in which 
+        they must be concatenated.
+
+        :param dataset: name of level-0 dataset as listed in TOML file.
+        :param add_serviced: see load_level0_dataset.
+        """
+        ds_config = self.config['level0'][dataset]        
 
         if ds_config['type'] == 'bales':
-            ds = self._concat_bale(dataset, ds_load_opts)
+            files = self._bale_files(dataset)
         elif ds_config['type'] == 'onefile':
-            p = os.path.join(self.data_root, dataset, ds_config['subpath'])
-            ds = self._load_level0_file(p, ds_load_opts)
+            files = [os.path.join(self.data_root, dataset, ds_config['subpath'])]
 
         if add_serviced:
             if ds_config['type'] == 'onefile':
@@ -142,79 +943,465 @@ class fs():
 
             serviced_root = os.path.join(self.data_root, dataset, subpath_root, 'serviced')
             if os.path.exists(serviced_root):
-                files = glob.glob(os.path.join(serviced_root, '*MainTable*'))
-                if len(files) == 1:
-                    print('Found post-servicing dataset %s' %files[0])
-                    ds2 = self._load_level0_file(files[0], ds_load_opts)
-                    ds = pd.concat((ds, ds2), axis=0)
+                serviced_files = glob.glob(os.path.join(serviced_root, '*MainTable*'))
+                if len(serviced_files) == 1:
+                    print('Found post-servicing dataset %s' %serviced_files[0])
+                    files.append(serviced_files[0])
 
-        return ds
+        return files
+
+
+    def _iter_level0_files(
+        self,
+        tasks : list,
+        jobs : int | None=None
+        ):
+        """
+        Load level-0 files one after the other, optionally with workers loading
+        the next files ahead concurrently.
+
+        :param tasks: list of (filename, load_opts) tuples, see _load_level0_file.
+        :param jobs: number of workers, i.e. the number of files loaded ahead. 
+        If None, uses option `jobs` from [level0_1] (default 1, i.e. serial). 
+        If < 1, uses all available CPUs. The type of worker pool is set by 
+        option `pool` in [level0_1], either "process" (default) or "thread".
+        :yields: DataFrame of each file, in the order of tasks.
+        """
+        if jobs is None:
+            jobs = self.config['level0_1'].get('jobs', 1)
+        if jobs < 1:
+            jobs = os.cpu_count()
+        jobs = min(jobs, len(tasks))
+
+        if jobs <= 1:
+            for filename, load_opts in tasks:
+                data = self._load_level0_file(filename, load_opts)
+                self._collect_level0_metadata([filename], [data], [load_opts])
+                yield data
+            self._evict_level0_cache()
+            return
+
+        pool = self.config['level0_1'].get('pool', 'process')
+        if pool == 'process':
+            executor = concurrent.futures.ProcessPoolExecutor
+        elif pool == 'thread':
+            executor = concurrent.futures.ThreadPoolExecutor
+        else:
+            raise ValueError('Unknown pool type "%s", use "process" or "thread".' %pool)
 
+        if pool == 'process':
+            # Send only the file, its options and the cache location to the workers.
+            cache_root = self.level0_cache.root if self.level0_cache is not None else None
+            load, extra = _load_level0_file_worker, (cache_root,)
+        else:
+            load, extra = self._load_level0_file, ()
+
+        print('Loading %s level-0 files with %s %s workers ...' %(len(tasks), jobs, pool))
+        with executor(max_workers=jobs) as ex:
+            tasks = iter(tasks)
+            pending = collections.deque()
+            for filename, load_opts in itertools.islice(tasks, jobs):
+                pending.append((filename, load_opts, ex.submit(load, filename, load_opts, *extra)))
+            while len(pending) > 0:
+                filename, load_opts, future = pending.popleft()
+                for f, opts in itertools.islice(tasks, 1):
+                    pending.append((f, opts, ex.submit(load, f, opts, *extra)))
+                data = future.result()
+                self._collect_level0_metadata([filename], [data], [load_opts])
+                yield data
+        self._evict_level0_cache()
+        return
 
+
+    def _evict_level0_cache(self) -> None:
+        """
+        Restrict the level-0 cache to its size limit. Only done once all files 
+        have been loaded, so that concurrent workers do not evict each other's entries.
+        """
+        if self.level0_cache is not None:
+            n = self.level0_cache.evict()
+            if n > 0:
+                print('Evicted %s entries from level-0 cache.' %n)
+        return
+
+
+    def _collect_level0_metadata(
+        self,
+        filenames : list,
+        store : list,
+        load_opts : list
+        ) -> None:
+        """
+        Keep the TOA5 header metadata and a summary of each loaded level-0 file.
+
+        Sets self.level0_metadata, a dict of filename:header. Only files read 
+        with the TOA5 reader have metadata. The summaries are used to write the
+        Level-1 manifest. This is done after loading so that it also works when
+        files are loaded by worker processes.
+
+        :param filenames: list of filenames.
+        :param store: list of DataFrames loaded from filenames.
+        :param load_opts: list of load options used for each file.
+        """
+        for f, data, opts in zip(filenames, store, load_opts):
+            self._record_level0_file(f, opts, len(data), 
+                data.index.min() if len(data) > 0 else None,
+                data.index.max() if len(data) > 0 else None,
+                data.attrs.get('toa5'))
+        return
+
+
+    def _record_level0_file(
+        self,
+        filename : str,
+        load_opts : dict,
+        nrows : int,
+        first : pd.Timestamp | None,
+        last : pd.Timestamp | None,
+        header : dict | None=None
+        ) -> None:
+        """
+        Keep the summary of a loaded level-0 file, and its TOA5 header if any,
+        see _collect_level0_metadata.
+
+        :param filename: filename.
+        :param load_opts: load options used for the file.
+        :param nrows: number of records loaded.
+        :param first: earliest timestamp, or None if no records.
+        :param last: latest timestamp, or None if no records.
+        :param header: TOA5 header, see toa5.read_toa5_header.
+        """
+        if self.level0_metadata is None:
+            self.level0_metadata = {}
+        if header is not None:
+            self.level0_metadata[filename] = header
+        self._level0_summary[filename] = {
+            'options': load_opts,
+            'nrows': nrows,
+            'first_timestamp': first.isoformat() if first is not None else None,
+            'last_timestamp': last.isoformat() if last is not None else None
+        }
+        return
+
+
+    def _iter_level0_chunks(
+        self,
+        filename : str,
+        load_opts : dict,
+        chunksize : int
+        ):
+        """
+        Read a level-0 file in chunks, bypassing the level-0 cache. The file 
+        is summarised once it has been read, see _record_level0_file.
+
+        :param filename: file path and name of the file to open.
+        :param load_opts: dict of options, see _read_level0_file.
+        :param chunksize: number of rows to read at a time.
+        :yields: DataFrame of each chunk.
+        """
+        nrows = 0
+        first = last = header = None
+        for data in self._read_level0_file(filename, load_opts, chunksize=chunksize):
+            if len(data) > 0:
+                first = data.index.min() if first is None else min(first, data.index.min())
+                last = data.index.max() if last is None else max(last, data.index.max())
+            nrows += len(data)
+            header = data.attrs.get('toa5', header)
+            yield data
+        self._record_level0_file(filename, load_opts, nrows, first, last, header)
+        return
+
+
+    def schema(self) -> SiteSchema:
+        """
+        Positions of the Level-1 columns of each sensor family, see 
+        cassandra_fs_pp.schema. Built once per set of Level-1 columns.
+        """
+        return site_schema(tuple(self.ds_level1.columns))
+
+
+    def level0_units(self) -> dict:
+        """
+        Units of each level-0 column, as recorded in the TOA5 file headers.
+
+        Where files disagree, the most recently loaded file takes precedence.
+        Requires level-0 files to have been loaded with the TOA5 reader.
+        """
+        units = {}
+        if self.level0_metadata is not None:
+            for header in self.level0_metadata.values():
+                units.update(header['units'])
+        return units
+
+
+    @instrumented(data_in='ds_level1')
     def write_l1(
         self,
-        outpath: str | None = None
+        outpath: str | None = None,
+        fmt : str | None=None
         ) -> None:
         """
-        Write Level-1 dataset to disk as CSV. 
+        Write Level-1 dataset to disk as CSV, Parquet or Feather.
+
+        The columnar formats (Parquet, Feather) store measurements as 
+        float32 (option `l1_float_dtype` in [level0_1]) and keep the dtypes 
+        and the datetime index, so they are much faster to load than CSV. 
+        They are compressed with option `l1_compression` (default zstd). 
+        They require pyarrow.
+
+        Also writes the manifest of the level-0 files it contains, 
+        see update_level1.
+
+        :param outpath: path/filename to write to. If None, uses the default
+        location for the format.
+        :param fmt: one of "csv", "parquet" or "feather". If None, inferred 
+        from the extension of outpath, or else uses option `l1_format` in 
+        [level0_1] (default csv).
         """
         assert(type(self.ds_level1) is pd.DataFrame)
+        fmt = self._level1_format(outpath, fmt)
         if outpath is None:
-            outpath = self._get_level1_default_path()
-        self.ds_level1.to_csv(outpath)
+            outpath = self._get_level1_default_path(fmt)
+
+        if fmt == 'csv':
+            self.ds_level1.to_csv(outpath)
+        else:
+            opts = self.config['level0_1']
+            float_dtype = opts.get('l1_float_dtype', 'float32')
+            compression = opts.get('l1_compression', 'zstd')
+            ds = self.ds_level1.astype({c:float_dtype for c in 
+                self.ds_level1.select_dtypes(include='floating').columns})
+            if fmt == 'parquet':
+                ds.to_parquet(outpath, engine='pyarrow', compression=compression)
+            elif fmt == 'feather':
+                # Feather does not support indexes, store it as a column.
+                ds.reset_index().to_feather(outpath, compression=compression)
+
+        self._write_level1_manifest(outpath)
+        return
+
+
+    def _write_level1_manifest(
+        self,
+        level1_file : str
+        ) -> None:
+        """
+        Write the manifest of level-0 files which have been ingested into a 
+        Level-1 dataset: for each file its size, modification time, content 
+        hash, load options, number of rows and first and last timestamps.
+
+        If ds_level1 was not made from level-0 data but loaded from a Level-1
+        dataset, the manifest of that dataset is written instead, or nothing
+        if it has none.
+
+        :param level1_file: path/filename of the Level-1 dataset.
+        """
+        if len(self._level0_summary) == 0:
+            if self._level1_manifest is not None:
+                with open(self._get_level1_manifest_path(level1_file), 'w') as f:
+                    json.dump(self._level1_manifest, f, indent=1)
+            return
+
+        files = {}
+        for filename, summary in self._level0_summary.items():
+            key = os.path.relpath(filename, self.data_root)
+            entry = dict(summary)
+            stat = os.stat(filename)
+            if entry.get('size') != stat.st_size or entry.get('mtime') != stat.st_mtime:
+                entry['sha256'] = file_hash(filename)
+            entry['size'] = stat.st_size
+            entry['mtime'] = stat.st_mtime
+            files[key] = entry
+
+        manifest = {'site': self.config['site'], 'files': files}
+        with open(self._get_level1_manifest_path(level1_file), 'w') as f:
+            json.dump(manifest, f, indent=1)
         return
 
 
+    def _get_level1_manifest_path(
+        self,
+        level1_file : str | None=None
+        ) -> str:
+        """
+        Location of the manifest of a level-1 dataset.
+
+        :param level1_file: path/filename of the level-1 dataset. If None, uses
+        the default location.
+        """
+        if level1_file is None:
+            level1_file = self._get_level1_default_path()
+        return os.path.splitext(level1_file)[0] + '_manifest.json'
+
+
+    @instrumented(data_out='ds_level1')
     def load_level1_dataset(
         self,
-        dataset : str | None=None
-        ) -> pd.DataFrame():
+        dataset : str | None=None,
+        columns : list | None=None,
+        start : str | pd.Timestamp | None=None,
+        end : str | pd.Timestamp | None=None
+        ) -> pd.DataFrame:
         """
         Load a Level-1 processed file.
         Primarily useful if seeking to run only Level-2 processing.
 
+        The format (CSV, Parquet or Feather) is inferred from the file extension.
+
         :param dataset: path/filename of file to load. If None then attempts
-        to find from the data_root.
+        to find from the data_root, trying first the format given by option 
+        `l1_format`, then the other formats.
+        :param columns: only load these columns. The index is always loaded.
+        :param start: only load data from this time onwards (inclusive).
+        :param end: only load data up to this time (inclusive). Note that
+        both are converted to Timestamps, so e.g. '2021-05-02' means midnight.
+
+        Unless option `downcast` in [level0_1] is false, the data are 
+        converted to compact dtypes, see downcast_dtypes.
+
+        If the whole dataset is loaded, its manifest (if any) is kept so that 
+        write_l1 saves it alongside the dataset again.
         """
         if dataset is None:
-            dataset = self._get_level1_default_path()
-        self.ds_level1 = pd.read_csv(dataset, parse_dates=True, 
-            index_col=self.config['level0_1']['index_col'])
-        return
+            dataset = self._find_level1_path()
+        fmt = self._level1_format(dataset)
+        index_col = self.config['level0_1']['index_col']
+        if start is not None:
+            start = pd.Timestamp(start)
+        if end is not None:
+            end = pd.Timestamp(end)
+
+        if fmt == 'csv':
+            usecols = None
+            if columns is not None:
+                usecols = [index_col] + list(columns)
+            ds = pd.read_csv(dataset, parse_dates=True, 
+                index_col=index_col, usecols=usecols)
+        elif fmt == 'parquet':
+            # Push the time range down to the reader so that only the row 
+            # groups needed are read.
+            filters = []
+            if start is not None:
+                filters.append((index_col, '>=', start))
+            if end is not None:
+                filters.append((index_col, '<=', end))
+            if len(filters) == 0:
+                filters = None
+            ds = pd.read_parquet(dataset, engine='pyarrow', columns=columns, 
+                filters=filters)
+        elif fmt == 'feather':
+            if columns is not None:
+                columns = [index_col] + list(columns)
+            ds = pd.read_feather(dataset, columns=columns)
+            ds = ds.set_index(index_col)
+
+        if start is not None or end is not None:
+            ds = ds.loc[start:end]
+
+        opts = self.config['level0_1']
+        if opts.get('downcast', True):
+            ds = downcast_dtypes(ds, float_dtype=opts.get('float_dtype', 'float32'))
+
+        self._level0_summary = {}
+        self._level1_manifest = None
+        manifest_file = self._get_level1_manifest_path(dataset)
+        if columns is None and start is None and end is None and os.path.exists(manifest_file):
+            with open(manifest_file, 'r') as f:
+                self._level1_manifest = json.load(f)
+
+        self.ds_level1 = ds
+        return ds
 
 
-    def _get_level1_default_path(self) -> None:
+    def _get_level1_default_path(
+        self,
+        fmt : str | None=None
+        ) -> str:
         """
         Default location of level-1 dataset.
+
+        :param fmt: format of dataset, see write_l1. If None, uses option 
+        `l1_format` in [level0_1] (default csv).
+        """
+        return level1_default_path(self.config, self.data_root, fmt)
+
+
+    def _find_level1_path(self) -> str:
+        """
+        Find an existing level-1 dataset at the default location, trying first
+        the format given by option `l1_format` in [level0_1].
         """
-        return os.path.join(self.data_root, 'firn_stations/level-1', self.config['site'] + '.csv')
+        fmt = self.config['level0_1'].get('l1_format', 'csv')
+        fmts = [fmt] + [f for f in LEVEL1_FORMATS if f != fmt]
+        for f in fmts:
+            p = self._get_level1_default_path(f)
+            if os.path.exists(p):
+                return p
+        # Nothing exists: return the default path and let the reader fail.
+        return self._get_level1_default_path(fmt)
+
+
+    def _level1_format(
+        self,
+        path : str | None=None,
+        fmt : str | None=None
+        ) -> str:
+        """
+        Determine the format of a level-1 dataset.
+
+        :param path: path/filename of dataset, format inferred from extension.
+        :param fmt: format, if provided this takes precedence.
+        """
+        if fmt is None:
+            if path is not None:
+                ext = os.path.splitext(path)[1].lower()
+                for f, e in LEVEL1_FORMATS.items():
+                    if ext == e:
+                        fmt = f
+            if fmt is None:
+                fmt = self.config['level0_1'].get('l1_format', 'csv')
+        if fmt not in LEVEL1_FORMATS:
+            raise ValueError('Unknown Level-1 format "%s", use one of %s.' %(fmt, list(LEVEL1_FORMATS.keys())))
+        return fmt
 
 
     def _concat_bale(
         self,
         bale_dataset : str,
-        load_opts : dict
+        load_opts : dict,
+        jobs : int | None=None
         ) -> pd.DataFrame:
         """
-        Join together 'bales' of dat files into a common dataset.
+        Join together 'bales' of dat files into a common dataset, see _merge_level0.
 
         :param bale_dataset: the folder name of the dataset.
+        :param load_opts: dict of options to pass to _load_level0_file.
+        :param jobs: number of concurrent workers, see _iter_level0_files.
+        """
+        files = self._bale_files(bale_dataset)
+        bale = self._merge_level0([(f, load_opts) for f in files], jobs=jobs)
+        return bale
+
+
+    def _bale_files(
+        self,
+        bale_dataset : str
+        ) -> list:
         """
+        List the bale files of a dataset, in bale order.
 
+        :param bale_dataset: the folder name of the dataset.
+        """
         bale_config = self.config['level0'][bale_dataset]
 
         pth_root = os.path.join(self.data_root, bale_dataset, bale_config['subpath'])
 
         bs = bale_config['bales_start']
         be = bale_config['bales_stop']
-        store = []
+        files = []
         for i in range(bs, be+1):
-            pth = os.path.join(pth_root, 'MainTable%s.dat' %i)
-            data = self._load_level0_file(pth, load_opts)
-            store.append(data)
-
-        bale = pd.concat(store, axis=0)
-        return bale
+            files.append(os.path.join(pth_root, 'MainTable%s.dat' %i))
+        return files
 
 
     def _setup_level0_options(
@@ -240,6 +1427,14 @@ class fs():
                 if key in self.config['level0'][dataset].keys():
                         args[key] = self.config['level0'][dataset][key]
 
+        # Optional options which may be set universally and/or per dataset
+        for key in ["reader", "float_dtype", "downcast"]:
+            if key in self.config['level0_1'].keys():
+                args[key] = self.config['level0_1'][key]
+            if dataset is not None:
+                if key in self.config['level0'][dataset].keys():
+                    args[key] = self.config['level0'][dataset][key]
+
         return args
 
 
@@ -249,17 +1444,105 @@ class fs():
         load_opts : dict
         ) -> pd.DataFrame:
         """
-        Load a Campbell level-0 .dat file into a pandas DataFrame.
+        Load a Campbell level-0 .dat file into a pandas DataFrame, from the 
+        level-0 cache if it is enabled and holds the file.
 
         :param filename: file path and name of the file to open.
         :param load_opts: dict of options to pass to pd.read_csv.
         """
+        if self.level0_cache is None:
+            return self._read_level0_file(filename, load_opts)
+
+        key = self.level0_cache.key(filename, load_opts)
+        data = self.level0_cache.get(key)
+        if data is None:
+            data = self._read_level0_file(filename, load_opts)
+            self.level0_cache.put(key, data)
+        return data
+
+
+    @staticmethod
+    def _read_level0_file(
+        filename : str,
+        load_opts : dict,
+        chunksize : int | None=None
+        ) -> pd.DataFrame:
+        """
+        Parse a Campbell level-0 .dat file into a pandas DataFrame.
+
+        If load_opts['reader'] is "toa5" then the file is read with the 
+        dedicated TOA5 reader, which uses only the `index_col`, `na_values`, 
+        `nrows` and `float_dtype` options. Otherwise the file is read with 
+        pd.read_csv.
+
+        Unless load_opts['downcast'] is False, the data are converted to 
+        compact dtypes, see downcast_dtypes.
 
-        data = pd.read_csv(filename, parse_dates=True, **load_opts)
-        data = data.drop_duplicates()
+        :param filename: file path and name of the file to open.
+        :param load_opts: dict of options to pass to pd.read_csv.
+        :param chunksize: if provided, returns an iterator of DataFrames of up
+        to chunksize rows each, rather than a single DataFrame.
+        """
+        load_opts = dict(load_opts)
+        reader = load_opts.pop('reader', 'csv')
+        float_dtype = load_opts.pop('float_dtype', 'float32')
+        downcast = load_opts.pop('downcast', True)
+
+        if reader == 'toa5':
+            data = toa5.read_toa5(filename, 
+                index_col=load_opts['index_col'], 
+                na_values=load_opts.get('na_values'),
+                float_dtype=float_dtype,
+                nrows=load_opts.get('nrows'),
+                chunksize=chunksize)
+        elif reader == 'csv':
+            data = pd.read_csv(filename, parse_dates=True, chunksize=chunksize, **load_opts)
+        else:
+            raise ValueError('Unknown level-0 reader "%s", use "csv" or "toa5".' %reader)
+        if chunksize is not None:
+            if downcast:
+                return (downcast_dtypes(chunk, float_dtype=float_dtype) for chunk in data)
+            return iter(data)
+        if downcast:
+            data = downcast_dtypes(data, float_dtype=float_dtype)
+        # Duplicates are removed when files are merged, see _merge_level0.
         return data
 
 
+    def _level0_start(
+        self,
+        filename : str,
+        load_opts : dict
+        ) -> pd.Timestamp | None:
+        """
+        Timestamp of the first record of a level-0 file, read without loading
+        the whole file.
+
+        :param filename: file path and name of the file.
+        :param load_opts: dict of options with which the file is loaded, see _read_level0_file.
+        :returns: timestamp, or None if the file has no records or its index is not a time.
+        """
+        load_opts = dict(load_opts)
+        load_opts.pop('float_dtype', None)
+        load_opts.pop('downcast', None)
+        load_opts['nrows'] = 1
+        reader = load_opts.pop('reader', 'csv')
+        if reader == 'toa5':
+            first = toa5.read_toa5(filename, index_col=load_opts['index_col'], 
+                na_values=load_opts.get('na_values'), nrows=1, usecols=[])
+        else:
+            if isinstance(load_opts['index_col'], str):
+                load_opts['usecols'] = [load_opts['index_col']]
+            try:
+                first = pd.read_csv(filename, parse_dates=True, **load_opts)
+            except pd.errors.EmptyDataError:
+                return None
+        if len(first) == 0 or not isinstance(first.index, pd.DatetimeIndex):
+            return None
+        return first.index[0]
+
+
+    @instrumented(data_in='ds_level1', data_out='ds_level2')
     def level1_to_level2(
         self
         ) -> None:
@@ -268,31 +1551,54 @@ class fs():
         """
 
         # Apply data ranges directly to level1 (not level2)
-        self.ds_level1 = self._apply_valid_data_ranges(self.ds_level1)
-
-        # Apply modifications to dataframe
-        # Start with a copy of level1 ds
-        level2 = copy.copy(self.ds_level1)
-
-        # Delete unwanted columns
-        for c in self.config['level1_2']['remove_columns']:
-            level2 = level2.drop(c, axis='columns')
-
-        # Rename
+        # Keep the out-of-range flags as a QC layer.
+        self.ds_level1, self.valid_range_flags = self._apply_valid_data_ranges(
+            self.ds_level1, return_flags=True)
+
+        # Level-2 is assembled in a single pass: work out the name and source
+        # of each output column, then allocate the output DataFrame once, 
+        # rather than copying the whole frame at each step.
+        level1 = self.ds_level1
+        remove = set(self.config['level1_2']['remove_columns'])
+        missing = [c for c in self.config['level1_2']['remove_columns'] if c not in level1.columns]
+        if len(missing) > 0:
+            raise KeyError('Columns %s in remove_columns are not in the level-1 data.' %missing)
         new_col_names = self._define_l2_column_names()
-        level2 = level2.rename(new_col_names, axis='columns')
 
+        # Columns which are replaced by derived data.
+        derived = {}
         # UDG
         l2_udg = self._normalise_udg()
         l2_udg = self._filter_udg(l2_udg)
-        level2['TCDT(m)'] = l2_udg
-
+        derived[self.config['level0_1']['udg_key']] = l2_udg
         # Overwrite mV EC with mS EC
         l2_ec = self._calibrate_ec()
-        # df.assign() requires a dict of Series!
-        level2 = level2.assign(**{c:l2_ec[c] for c in l2_ec.columns})
+        for c in l2_ec.columns:
+            derived[c] = l2_ec[c]
 
-        level2 = level2.drop_duplicates()
+        columns = {}
+        for c in level1.columns:
+            if c in remove:
+                continue
+            source = derived.pop(c) if c in derived else level1[c]
+            columns[new_col_names.get(c, c)] = source
+        # Any derived columns which were removed from level-1 are added at the end.
+        for c, source in derived.items():
+            columns[new_col_names.get(c, c)] = source
+
+        # Columns of the same dtype are consolidated into one block, this is 
+        # the only copy of the data.
+        level2 = pd.DataFrame(columns, index=level1.index, copy=False)
+        allocations = 1
+
+        dups = level2.duplicated()
+        if dups.any():
+            level2 = level2[~dups.to_numpy()]
+            allocations += 1
+
+        if self.profiler is not None:
+            self.profiler.record(allocations=allocations, 
+                dtypes={str(k):int(v) for k, v in level2.dtypes.value_counts().items()})
 
         # Set to object
         self.ds_level2 = level2
@@ -303,37 +1609,65 @@ class fs():
         """
         Default location of level-2 dataset.
         """
-        return os.path.join(self.data_root, 'firn_stations/level-2', self.config['site'] + '.nc')
+        return level2_default_path(self.config, self.data_root)
 
 
+    @instrumented()
     def _apply_valid_data_ranges(
         self,
         df : pd.DataFrame,
         spec_file : str | None=None,
-        ) -> pd.DataFrame:
-
+        return_flags : bool=False
+        ) -> pd.DataFrame | tuple:
+        """
+        Set values outside of their valid data range to NaN.
+
+        The valid ranges of all columns are resolved once into min/max arrays 
+        and applied as a single mask over the block of columns concerned. 
+        Column names listed in the spec but not present in df are ignored.
+
+        :param df: DataFrame of level-1 data. Modified in place.
+        :param spec_file: TOML file of valid data ranges. By default uses the 
+        file contained within the repository.
+        :param return_flags: if True, also return the boolean DataFrame 
+        flagging the values which were out of range (i.e. a QC layer).
+        :returns: df, or (df, flags) if return_flags.
+        """
         if spec_file is None:
             _module_path = os.path.dirname(__file__)
             spec_file = os.path.join(_module_path, 'valid_data_ranges.toml')
 
-        with open(spec_file, "rb") as f:
-            spec = tomli.load(f)
+        positions, vmin, vmax = _valid_range_arrays(spec_file, 
+            os.stat(spec_file).st_mtime, tuple(df.columns))
+        subset = df.iloc[:, positions]
+        cols = list(subset.columns)
     
         print('Restricting to valid data ranges...')
-        for col in spec:
-            if col[0:3].upper() == 'TDR':
-                var = col[4:]
-                cs = df.filter(regex='TDR[0-9]*\_%s'%var).columns
-            elif col[0:2].upper() == 'EC':
-                cs = df.filter(regex='EC\([0-9]*\)').columns
-            else:
-                cs = [col]
-            vmin, vmax = spec[col]    
-            for c in cs:
-                print('    %s (%s, %s)'%(c, vmin, vmax))
-                df.loc[:,c] = df.loc[:,c].where(df.loc[:,c] <= vmax)
-                df.loc[:,c] = df.loc[:,c].where(df.loc[:,c] >= vmin)
-
+        for c, lo, hi in zip(cols, vmin, vmax):
+            print('    %s (%s, %s)'%(c, lo, hi))
+
+        # Work in the precision of the data, e.g. float32, rather than letting 
+        # any integer columns promote the whole block to float64.
+        float_dtypes = [d for d in subset.dtypes if d.kind == 'f']
+        if len(float_dtypes) == 0:
+            float_dtypes = [np.dtype('float64')]
+        block = subset.to_numpy(dtype=np.result_type(*float_dtypes))
+        # NaNs compare False so are never flagged.
+        flags = (block < vmin) | (block > vmax)
+        # Only write back columns which have any values out of range, so that
+        # e.g. integer columns keep their dtype if nothing is masked.
+        changed = flags.any(axis=0)
+        if changed.any():
+            write = [c for c, ch in zip(cols, changed) if ch]
+            masked = pd.DataFrame(
+                np.where(flags[:, changed], block.dtype.type(np.nan), block[:, changed]),
+                index=df.index, columns=write)
+            # Float columns keep their own precision.
+            dtypes = {c:(df[c].dtype if df[c].dtype.kind == 'f' else block.dtype) for c in write}
+            df[write] = masked.astype(dtypes, copy=False)
+
+        if return_flags:
+            return df, pd.DataFrame(flags, index=df.index, columns=cols)
         return df
 
 
@@ -345,6 +1679,9 @@ class fs():
         A level-2 operation.
         Creates mapping dict old:new to be supplied to df.rename().
 
+        The mapping rules are compiled once per process, and the mapping is 
+        memoized per set of level-1 columns, see _l2_column_mapping.
+
         :param mapping_file: filename of old->new regexes. By default
         uses the file contained within the repository.
 
@@ -354,38 +1691,9 @@ class fs():
             _module_path = os.path.dirname(__file__)
             mapping_file = os.path.join(_module_path, 'fs_column_names.csv')
 
-        mapping = pd.read_csv(mapping_file)
-        mapping.index = mapping['level0']
-
-        new_mapping = {}
-        for ix, mapp in mapping.iterrows():
-            filtered = self.ds_level1.filter(regex=ix, axis=1)
-            cols = filtered.columns
-            
-            # 'Array'-type variables (e.g. DTC)
-            if len(cols) > 1:
-                for col in cols:
-                    # Get sensor number
-                    # First try array-type variable
-                    res = re.search(r'\((?P<id>[0-9]+)\)$', col)
-                    if res == None:
-                        # If that doesn't work, try generic multiple type
-                        res = re.search(r'[A-Za-z]+(?P<id>[0-9]+)\_', col)
-                    if res == None:
-                        print('Could not find sensor ID.')
-                        raise ValueError
-
-                    sensor_id = res.groupdict()['id']
-
-                    renumber = re.compile(r'\*')
-                    new_mapping[col] = renumber.sub(sensor_id, mapp.loc['level2'])
-            elif len(cols) == 1:
-                col = cols[0]
-                new_mapping[col] = mapp.iloc[1]
-            else:
-                continue
-
-        return new_mapping
+        new_mapping = _l2_column_mapping(mapping_file, 
+            os.stat(mapping_file).st_mtime, tuple(self.ds_level1.columns))
+        return dict(new_mapping)
 
 
     def load_dtc_positions(
@@ -412,7 +1720,7 @@ class fs():
             filename = os.path.join(self.data_root, filename)
 
         opts = self._setup_level0_options()
-        pos = pd.read_csv(filename, **opts)
+        pos = self._read_level0_file(filename, opts)
         pos = pos.drop('RECORD', axis='columns')
         pos = pos.iloc[0]
 
@@ -449,6 +1757,7 @@ class fs():
         return sensor_depths_t0.to_dict()
       
 
+    @instrumented()
     def _normalise_udg(
         self,
         udg : pd.Series | None=None
@@ -459,11 +1768,12 @@ class fs():
 
         Requires level-1 data in memory.
         """
+        # Copied as it is modified below.
         if udg is None:
             udg_key = self.config['level0_1']['udg_key']
-            udg = copy.deepcopy(self.ds_level1[udg_key])
+            udg = self.ds_level1[udg_key].copy()
         else:
-            udg = copy.deepcopy(udg)
+            udg = udg.copy()
 
         changes = self.config['level1_2']['udg_height_change']
         if len(changes) == 1:
@@ -511,13 +1821,15 @@ class fs():
         return udg
 
 
+    @instrumented()
     def _filter_udg(
         self,
-        udg : pd.Series | None=None,
-        q : pd.Series | None=None,
+        udg : pd.Series | pd.DataFrame | None=None,
+        q : pd.Series | pd.DataFrame | None=None,
         med_window : str='2D',
-        threshold : float=0.5
-        ) -> pd.Series:
+        threshold : float=0.5,
+        limit : int=3
+        ) -> pd.Series | pd.DataFrame:
         """
         Apply filtering strategies to UDG: remove Campbell Sci bad values and
         use temporal median filtering to identify and remove other bad values.
@@ -527,46 +1839,79 @@ class fs():
         Note that the UDG record is likely to benefit from further smoothing,
         depending on the desired application.
 
-        :param udg: Series of UDG values. If not provided defaults to self.ds_level1.
-        :param q: Series of UDG quality values. If not provided defaults to self.ds_level1.
+        The median is taken over the record regularised to its most common
+        sampling interval, see _regularise. Several UDG channels with the same
+        timestamps can be filtered in one go by passing a DataFrame.
+
+        :param udg: Series of UDG values, or DataFrame of several UDG channels. 
+        If not provided defaults to self.ds_level1.
+        :param q: Series of UDG quality values, or DataFrame with one column 
+        per UDG channel, in the same order. A Series applies to all channels.
+        If not provided defaults to self.ds_level1.
         :param med_window: temporal window over which to calculate rolling median.
         :param threshold: absolute difference from median to tolerate.
+        :param limit: maximum number of steps of the regular grid over which 
+        to hold a record, see _regularise.
+        :returns: filtered Series or DataFrame, like udg.
 
+        The rolling median of the last call is kept, so calls with the same 
+        data and window but another threshold return in milliseconds.
         """
+        # Neither udg nor q are modified in place, so no need to copy them.
         if udg is None:
             udg_key = self.config['level0_1']['udg_key']
-            udg = copy.deepcopy(self.ds_level1[udg_key])
+            udg = self.ds_level1[udg_key]
 
         if q is None:
             q_key = 'Q'
-            q = copy.deepcopy(self.ds_level1[q_key])
-        else:
-            q = copy.deepcopy(q)
+            q = self.ds_level1[q_key]
 
-        q_nans = np.sum(q.isna())
+        values = udg.to_numpy()
+        if values.dtype.kind != 'f':
+            values = values.astype('float64')
+        else:
+            values = values.copy()
+        if values.ndim == 1:
+            values = values[:, np.newaxis]
+        q = np.asarray(q, dtype='float64')
+        if q.ndim == 1:
+            q = q[:, np.newaxis]
+        if len(q) != len(values) or q.shape[1] not in [1, values.shape[1]]:
+            raise ValueError('q must have one value per UDG record, for all channels or for each channel.')
+
+        q_nans = np.sum(np.isnan(q))
         if q_nans > 0:
             print('WARNING: %s NaNs found in UDG Q column, indicating no Q value recorded. Quality checks will not be made on these UDG rows.' %q_nans)
             q = np.where(np.isnan(q), 150, q)
 
         # Only retain data with quality flag according to SR50A manual
-        udg = udg.where(q >= 150).where(q <= 210)
-
-        # Interpolate to make the Series monotonic - primarily needed due to 
-        # different sampling rates in summer versus winter.
-        # First calculate most likely appropriate frequency in minutes
-        r = (udg.index[1:] - udg.index[0:-1])
-        freq = pd.DataFrame(r).mode().iloc[0,0].total_seconds() / 60
-        udg_reg = udg.resample('%smin'%freq).ffill(limit=3)
+        values[~((q >= 150) & (q <= 210)) & np.ones(values.shape, dtype=bool)] = np.nan
+
+        # The median does not depend on the threshold, so it is kept for 
+        # repeated calls with other thresholds, e.g. when tuning QC.
+        h = hashlib.sha256()
+        h.update(values.tobytes())
+        h.update(udg.index.asi8.tobytes())
+        key = (h.hexdigest(), values.shape, med_window, limit)
+        if self._udg_median_memo is not None and self._udg_median_memo[0] == key:
+            med = self._udg_median_memo[1]
+        else:
+            # Regularise, primarily needed due to different sampling rates in 
+            # summer versus winter.
+            step, positions, hold, n_grid = _regularise(udg.index, limit=limit)
+            window = int(-(-pd.Timedelta(med_window).value // step.value))
+            med = _rolling_median_at(values, positions, hold, n_grid, window)
+            self._udg_median_memo = (key, med)
 
         # Remove high-frequency "problems"
-        med = udg_reg.rolling(med_window).median()
-        filt = udg_reg.where(np.abs(med-udg_reg) < threshold)
- 
-        # Revert to original sampling frequency
-        filt_orig_freq = filt[udg.index]
-        return filt_orig_freq
+        values[~(np.abs(med - values.astype('float64')) < threshold)] = np.nan
+
+        if isinstance(udg, pd.DataFrame):
+            return pd.DataFrame(values, index=udg.index, columns=udg.columns)
+        return pd.Series(values[:, 0], index=udg.index, name=udg.name)
 
 
+    @instrumented()
     def _calibrate_ec(
         self,
         cal_file : str | None=None,
@@ -575,73 +1920,220 @@ class fs():
         """ 
         Convert EC sensor millivolts to physical units using linear regression.
 
-        :param cal_file: path to calibration coefficients file.
+        Each set of calibration coefficients is applied to the records in its
+        period of validity, see ec_calibration_sets.
+
+        :param cal_file: path to calibration coefficients file, applied to
+        the whole record. If None, uses ec_calibration_sets.
         :param transform: if true, do (1-EC values)
         """
 
         assert isinstance(self.ds_level1, pd.DataFrame)
 
-        def _apply_cal(column):
-            try:
-                m = calibrations.loc[column.name, 'm']
-                c = calibrations.loc[column.name, 'c']
-            except KeyError:
-                print('No cal. data for %s, using average of other sensors' %column.name)
-                m = calibrations['m'].mean()
-                c = calibrations['c'].mean()
+        if cal_file is None:
+            sets = self.ec_calibration_sets()
+        else:
+            sets = [(None, cal_file)]
+
+        just_ec = self.ds_level1.iloc[:, self.schema().ec_positions()]
+        columns = tuple(just_ec.columns)
+        m = []
+        c = []
+        for start, f in sets:
+            m_set, c_set, missing = _ec_calibration_arrays(f, os.path.getmtime(f), columns)
+            self._report_missing_ec_calibrations(f, missing)
+            m.append(m_set)
+            c.append(c_set)
+        # Coefficients of each set by row, shape (sets, columns).
+        m = np.vstack(m)
+        c = np.vstack(c)
+
+        # Set of coefficients which applies to each record.
+        if len(sets) > 1:
+            segments = self._ec_calibration_intervals(sets).get_indexer(just_ec.index)
+        else:
+            segments = None
+
+        # Apply (1 - x) * m + c to each block of columns of the same dtype at once.
+        # Coefficients take the precision of floating-point data.
+        positions = pd.Series(np.arange(len(columns)), index=just_ec.columns)
+        blocks = []
+        for dtype, cols in just_ec.columns.groupby(just_ec.dtypes).items():
+            idx = positions[cols].to_numpy()
+            x = just_ec[cols].to_numpy()
+            if dtype.kind == 'f':
+                mm, cc = m[:, idx].astype(dtype), c[:, idx].astype(dtype)
+            else:
+                x = x.astype('float64')
+                mm, cc = m[:, idx], c[:, idx]
+            if segments is None:
+                mm, cc = mm[0], cc[0]
+            else:
+                # Records without a valid timestamp cannot be calibrated.
+                mm = np.vstack((mm, np.full(mm.shape[1], np.nan, dtype=mm.dtype)))[segments]
+                cc = np.vstack((cc, np.full(cc.shape[1], np.nan, dtype=cc.dtype)))[segments]
             if transform:
-                column = 1 - column
-            ec = m * column + c
-            return ec
+                x = 1 - x
+            blocks.append(pd.DataFrame(x * mm + cc, index=just_ec.index, columns=cols))
+        if len(blocks) == 0:
+            return just_ec.astype('float64')
+        ec_ms = pd.concat(blocks, axis=1)[just_ec.columns]
 
-        if cal_file is None:
-             cal_file = os.path.join(
-                self.data_root, 
-                'ec_calibration', 
-                'calibration_coefficients_%s_c0.csv' %self.config['site'].upper()
-            )
-        calibrations = pd.read_csv(cal_file, index_col=0)
+        return ec_ms
 
-        just_ec = self.ds_level1.filter(regex=r'EC\([0-9]+\)', axis=1)
-        ec_ms = just_ec.apply(_apply_cal)
 
-        return ec_ms
+    def ec_calibration_sets(self) -> list:
+        """
+        Sets of EC calibration coefficients and the date from which each applies.
+
+        Defined by [level1_2.ec_calibration] in the metadata TOML file, in 
+        which each entry is [start date, filename in ec_calibration/]. Each 
+        set applies until the start of the next one; the first set also 
+        applies to any records before its start. If not defined, 
+        calibration_coefficients_<SITE>_c0.csv applies to the whole record.
+
+        :returns: list of (start Timestamp or None, path to file), in time order.
+        """
+        folder = os.path.join(self.data_root, 'ec_calibration')
+        spec = self.config['level1_2'].get('ec_calibration', None)
+        if spec is None or len(spec) == 0:
+            f = 'calibration_coefficients_%s_c0.csv' %self.config['site'].upper()
+            return [(None, os.path.join(folder, f))]
+
+        sets = []
+        for key, values in spec.items():
+            if len(values) != 2:
+                raise ValueError('[level1_2.ec_calibration] %s must be [start date, filename].' %key)
+            start, f = values
+            sets.append((pd.Timestamp(start), os.path.join(folder, f)))
+        sets = sorted(sets, key=lambda s: s[0])
+        starts = [s[0] for s in sets]
+        if len(set(starts)) < len(starts):
+            raise ValueError('[level1_2.ec_calibration] contains several sets with the same start date.')
+        return sets
+
+
+    def _ec_calibration_intervals(
+        self,
+        sets : list
+        ) -> pd.IntervalIndex:
+        """
+        Periods of validity of sets of EC calibration coefficients.
+
+        :param sets: list of (start, path), in time order, see ec_calibration_sets.
+        :returns: IntervalIndex of one left-closed interval per set. The first
+        starts at the earliest time possible and the last ends at the latest.
+        """
+        breaks = [pd.Timestamp.min] + [s[0] for s in sets[1:]] + [pd.Timestamp.max]
+        return pd.IntervalIndex.from_breaks(breaks, closed='left')
+
+
+    def _report_missing_ec_calibrations(
+        self,
+        cal_file : str,
+        missing : list
+        ) -> None:
+        """
+        Report EC sensors without calibration, once per sensor and file per site.
+
+        :param cal_file: path to calibration coefficients file.
+        :param missing: EC column names without calibration in cal_file.
+        """
+        if self._ec_missing_reported is None:
+            self._ec_missing_reported = set()
+        new = [c for c in missing if (cal_file, c) not in self._ec_missing_reported]
+        if len(new) > 0:
+            print('No cal. data for %s in %s, using average of other sensors' %(', '.join(new), 
+                os.path.basename(cal_file)))
+            self._ec_missing_reported.update([(cal_file, c) for c in new])
+        return
 
 
     def _calc_depth_tdr(
         self,
         tdr : int | str,
-        udg
-        ) -> np.array:
-        """ Calculate depth of single TDR
+        udg : pd.Series
+        ) -> pd.Series:
+        """ Calculate depth of single TDR.
+
+        See _calc_depth_tdrs, of which this is a single-sensor convenience wrapper.
         """
-        
-        install_date, install_depth, _ = self.config['level1_2']['tdr_info'][str(tdr)]
-        
-        udg_at_install = float(udg.loc[install_date.isoformat():].iloc[0])
-        nearest_udg_date = udg.loc[install_date.isoformat():].index[0]
-        if nearest_udg_date != pd.Timestamp(install_date):
-            print('WARNING: TDR %s depth calculation: No UDG data available at \
-specified installation date of %s, using next record (%s) instead.'%(tdr, install_date, nearest_udg_date))
+        install_date = self.config['level1_2']['tdr_info'][str(tdr)][0]
+        depths = self._calc_depth_tdrs([tdr], udg)
+        DD = depths['TDR%s_Depth'%tdr].loc[install_date.isoformat():]
+        return DD
+
 
-        offset =  install_depth 
+    @instrumented()
+    def _calc_depth_tdrs(
+        self,
+        tdrs : list,
+        udg : pd.Series
+        ) -> pd.DataFrame:
+        """ Calculate time-varying depths of several TDRs in one batched operation.
 
-        # Select UDG data, starting at install date, and normalise the record 
-        # relative to the installation reading
-        udg = udg.loc[install_date:] - udg_at_install
-        # Now, +ve UDG means net surface melting compared to installation
-        # And -ve UDG means net surface accumulation compared to installation
+        The depth of each TDR below the surface is its installation depth
+        adjusted by the UDG record relative to the installation reading. Net 
+        surface lowering (melting) brings the TDR towards the surface; once the
+        TDR reaches the surface it stays there and the surface lowering 'resets' 
+        the reference for subsequent accumulation. 
         
-        D = []
-        for ix,udgt in udg.iteritems():
-            Dt = udgt + offset
-            Dt = np.minimum(0, Dt)
-            offset = np.where(Dt == 0, (udgt*-1), offset)
-            D.append(Dt)
-
-        DD = np.array(D)
-        DD = pd.Series(DD, index=udg.index, name='TDR%s_Depth'%tdr)
-        return DD
+        Written sequentially, for each timestep:
+
+            Dt = min(0, udgt + offset)
+            offset = -udgt if Dt == 0 else offset
+        
+        As the offset only ever decreases, at any time it is the minimum of the
+        installation depth and all previous values of -udgt. It can therefore be
+        computed with a cumulative minimum (NaNs are skipped, just as in the 
+        sequential form) rather than a Python loop.
+
+        :param tdrs: list of TDR IDs, as keyed in level1_2.tdr_info.
+        :param udg: Series of UDG values, typically smoothed.
+        :returns: DataFrame (time x TDR) of depths (-ve below surface), with 
+        columns named TDR<n>_Depth. Times before a TDR's installation are NaN.
+        The index starts at the first installation date.
+        """
 
+        values = udg.to_numpy(dtype='float64')
+        n = len(values)
+        ntdr = len(tdrs)
+
+        starts = np.zeros(ntdr, dtype='int64')
+        offsets = np.zeros(ntdr, dtype='float64')
+        rel = np.full((ntdr, n), np.nan)
+        for i, tdr in enumerate(tdrs):
+            install_date, install_depth, _ = self.config['level1_2']['tdr_info'][str(tdr)]
+
+            # Same semantics as udg.loc[install_date.isoformat():]
+            start = udg.index.slice_indexer(start=install_date.isoformat()).start
+            if start is None:
+                start = 0
+            if start >= n:
+                raise ValueError('TDR %s depth calculation: no UDG data on or after installation date of %s.' %(tdr, install_date))
+            nearest_udg_date = udg.index[start]
+            if nearest_udg_date != pd.Timestamp(install_date):
+                print('WARNING: TDR %s depth calculation: No UDG data available at \
+specified installation date of %s, using next record (%s) instead.'%(tdr, install_date, nearest_udg_date))
 
+            starts[i] = start
+            offsets[i] = install_depth
+            # Normalise the record relative to the installation reading.
+            # Now, +ve UDG means net surface melting compared to installation
+            # And -ve UDG means net surface accumulation compared to installation
+            rel[i, start:] = values[start:] - float(values[start])
+
+        # The offset in force at each timestep depends only on previous timesteps,
+        # so prepend the installation depth and accumulate.
+        running = np.concatenate((offsets[:, np.newaxis], -rel[:, :-1]), axis=1)
+        offset = np.fmin.accumulate(running, axis=1)
+        D = np.minimum(0, rel + offset)
+
+        first = starts.min()
+        DD = pd.DataFrame(
+            D[:, first:].T, 
+            index=udg.index[first:], 
+            columns=['TDR%s_Depth'%tdr for tdr in tdrs]
+        )
+        return DD
 
@@ -0,0 +1,364 @@
+"""
+Timing and memory instrumentation of the processing chain.
+
+Each stage of the processing chain (e.g. level0_to_level1) is recorded by a
+Profiler: its wall time, the peak memory allocated during it, the peak
+resident set size (RSS) of the process, and the number of rows and columns
+of data going in and out. Stages may be nested, e.g. _normalise_udg within
+level1_to_level2.
+
+Recording is always on but cheap. Only the most recent stages are kept, 
+together with totals per stage name, so that a long-lived object which runs
+the same stages many times (e.g. when tuning QC parameters) does not grow.
+Tracing of memory allocations (with tracemalloc) and profiling of function
+calls (with cProfile) slow down processing so are only done if requested.
+
+Each completed stage is logged to the `cassandra_fs_pp` logger at INFO level.
+The full report can be saved as JSON.
+"""
+from __future__ import annotations
+
+import collections
+import contextlib
+import cProfile
+import functools
+import json
+import logging
+import sys
+import time
+import tracemalloc
+
+import pandas as pd
+
+try:
+    import resource
+except ImportError:  # pragma: no cover
+    # Not available on Windows.
+    resource = None
+
+logger = logging.getLogger('cassandra_fs_pp')
+
+
+def peak_rss_mb() -> float | None:
+    """ Peak resident set size of this process so far, in megabytes. """
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Reported in bytes on macOS, kilobytes elsewhere.
+    if sys.platform == 'darwin':
+        return rss / 1e6
+    return rss / 1e3
+
+
+def data_shape(
+    data
+    ) -> tuple:
+    """
+    Number of rows and columns of a DataFrame or Series, or the total rows 
+    and maximum columns of a list of them (e.g. level-0 files to be concatenated).
+
+    :returns: (rows, columns), or (None, None) if data is not a DataFrame or Series.
+    """
+    if isinstance(data, pd.DataFrame):
+        return data.shape
+    elif isinstance(data, pd.Series):
+        return (len(data), 1)
+    elif isinstance(data, list) and len(data) > 0:
+        shapes = [data_shape(d) for d in data]
+        if all([r is not None for r, c in shapes]):
+            return (sum([r for r, c in shapes]), max([c for r, c in shapes]))
+    return (None, None)
+
+
+class Stage():
+
+    def __init__(
+        self,
+        name : str,
+        depth : int=0
+        ) -> None:
+        """
+        Record of one stage of processing, see Profiler.stage.
+
+        :param name: name of stage.
+        :param depth: nesting level of stage.
+        """
+        self.name = name
+        self.depth = depth
+        self.wall_s = None
+        self.peak_traced_mb = None
+        self.peak_rss_mb = None
+        self.rows_in = self.cols_in = None
+        self.rows_out = self.cols_out = None
+        self.extra = {}
+        self._peak = 0
+        self._start_traced = 0
+        return
+
+
+    def data_in(
+        self,
+        data
+        ) -> None:
+        """ Record the shape of the input data (DataFrame or Series). """
+        self.rows_in, self.cols_in = data_shape(data)
+        return
+
+
+    def data_out(
+        self,
+        data
+        ) -> None:
+        """ Record the shape of the output data (DataFrame or Series). """
+        self.rows_out, self.cols_out = data_shape(data)
+        return
+
+
+    def to_dict(self) -> dict:
+        d = {
+            'stage': self.name,
+            'depth': self.depth,
+            'wall_s': self.wall_s,
+            'peak_traced_mb': self.peak_traced_mb,
+            'peak_rss_mb': self.peak_rss_mb,
+            'rows_in': self.rows_in,
+            'cols_in': self.cols_in,
+            'rows_out': self.rows_out,
+            'cols_out': self.cols_out
+        }
+        d.update(self.extra)
+        return d
+
+
+class Profiler():
+
+    def __init__(
+        self,
+        trace_memory : bool=False,
+        cprofile : bool=False,
+        max_stages : int | None=1000
+        ) -> None:
+        """
+        Initialise the profiler.
+
+        :param trace_memory: trace memory allocations with tracemalloc, to
+        report the peak memory allocated during each stage.
+        :param cprofile: profile all function calls made during stages with cProfile.
+        :param max_stages: number of most recent stages to keep. Earlier ones
+        are only counted in the totals per stage name. If None, keep all.
+        """
+        self.trace_memory = trace_memory
+        self.stages = collections.deque(maxlen=max_stages)
+        # Stage name : {calls, wall_s, peak_traced_mb}, over all stages.
+        self.totals = {}
+        self.n_stages = 0
+        self._stack = []
+        self._cprofile = cProfile.Profile() if cprofile else None
+        return
+
+
+    def __getstate__(self) -> dict:
+        # Profiler is copied to worker processes along with the fs object;
+        # stages recorded there are not reported.
+        state = self.__dict__.copy()
+        state['_cprofile'] = None
+        state['_stack'] = []
+        state['stages'] = collections.deque(maxlen=self.stages.maxlen)
+        state['totals'] = {}
+        state['n_stages'] = 0
+        return state
+
+
+    def _start(
+        self,
+        stage : Stage
+        ) -> None:
+        if self.trace_memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            current, peak = tracemalloc.get_traced_memory()
+            if len(self._stack) > 0:
+                # Peak of the enclosing stage up to now, before resetting.
+                parent = self._stack[-1]
+                parent._peak = max(parent._peak, peak)
+            tracemalloc.reset_peak()
+            stage._start_traced = current
+        if self._cprofile is not None and len(self._stack) == 0:
+            self._cprofile.enable()
+        self._stack.append(stage)
+        return
+
+
+    def _stop(
+        self,
+        stage : Stage
+        ) -> None:
+        self._stack.pop()
+        if self._cprofile is not None and len(self._stack) == 0:
+            self._cprofile.disable()
+        if self.trace_memory:
+            current, peak = tracemalloc.get_traced_memory()
+            peak = max(stage._peak, peak)
+            stage.peak_traced_mb = (peak - stage._start_traced) / 1e6
+            if len(self._stack) > 0:
+                parent = self._stack[-1]
+                parent._peak = max(parent._peak, peak)
+            tracemalloc.reset_peak()
+        stage.peak_rss_mb = peak_rss_mb()
+        return
+
+
+    @contextlib.contextmanager
+    def stage(
+        self,
+        name : str,
+        data_in=None
+        ):
+        """
+        Context manager recording a stage of processing.
+
+            with profiler.stage('level1_to_level2', data_in=df) as st:
+                ...
+                st.data_out(result)
+
+        :param name: name of stage.
+        :param data_in: input DataFrame or Series, to record its shape.
+        :yields: Stage.
+        """
+        stage = Stage(name, depth=len(self._stack))
+        if data_in is not None:
+            stage.data_in(data_in)
+        # Record stages in the order in which they start.
+        self.stages.append(stage)
+        self.n_stages += 1
+        self._start(stage)
+        t0 = time.perf_counter()
+        try:
+            yield stage
+        finally:
+            stage.wall_s = time.perf_counter() - t0
+            self._stop(stage)
+            self._add_to_totals(stage)
+            logger.info('%s%s: %.3f s, rows %s -> %s, columns %s -> %s, peak traced %s MB, peak RSS %s MB',
+                '  ' * stage.depth, name, stage.wall_s, stage.rows_in, stage.rows_out,
+                stage.cols_in, stage.cols_out, _fmt_mb(stage.peak_traced_mb), 
+                _fmt_mb(stage.peak_rss_mb))
+        return
+
+
+    def _add_to_totals(
+        self,
+        stage : Stage
+        ) -> None:
+        total = self.totals.setdefault(stage.name, {'calls':0, 'wall_s':0., 'peak_traced_mb':None})
+        total['calls'] += 1
+        total['wall_s'] += stage.wall_s
+        if stage.peak_traced_mb is not None:
+            total['peak_traced_mb'] = max(total['peak_traced_mb'] or 0, stage.peak_traced_mb)
+        return
+
+
+    def record(
+        self,
+        **kwargs
+        ) -> None:
+        """
+        Record additional information about the stage currently running, 
+        e.g. profiler.record(allocations=2). Ignored if no stage is running.
+        """
+        if len(self._stack) > 0:
+            self._stack[-1].extra.update(kwargs)
+        return
+
+
+    def report(self) -> dict:
+        """ 
+        Report of the stages kept so far, in the order in which they started,
+        and the totals per stage name of all stages.
+        """
+        return {
+            'stages': [s.to_dict() for s in self.stages],
+            'stages_dropped': self.n_stages - len(self.stages),
+            'totals': self.totals,
+            'peak_rss_mb': peak_rss_mb(),
+            'trace_memory': self.trace_memory
+        }
+
+
+    def write_report(
+        self,
+        filename : str
+        ) -> None:
+        """
+        Save report to JSON.
+
+        :param filename: path/filename of JSON file.
+        """
+        with open(filename, 'w') as f:
+            json.dump(self.report(), f, indent=1)
+        return
+
+
+    def write_cprofile(
+        self,
+        filename : str
+        ) -> None:
+        """
+        Save cProfile statistics, e.g. for inspection with pstats or snakeviz.
+
+        :param filename: path/filename of statistics file.
+        """
+        if self._cprofile is None:
+            raise ValueError('cProfile was not enabled for this Profiler.')
+        self._cprofile.dump_stats(filename)
+        return
+
+
+def _fmt_mb(
+    mb : float | None
+    ) -> str:
+    return 'n/a' if mb is None else '%.1f' %mb
+
+
+def instrumented(
+    name : str | None=None,
+    data_in : str | None=None,
+    data_out : str | None=None
+    ):
+    """
+    Decorator to record a method of an object with a `profiler` attribute 
+    as a stage, see Profiler.stage.
+
+    By default the input data are the first DataFrame or Series argument,
+    and the output data are the return value.
+
+    :param name: name of stage, by default the name of the method.
+    :param data_in: name of attribute of the object holding the input data.
+    :param data_out: name of attribute of the object holding the output data.
+    """
+    def decorator(method):
+        stage_name = method.__name__ if name is None else name
+
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            profiler = getattr(self, 'profiler', None)
+            if profiler is None:
+                return method(self, *args, **kwargs)
+
+            if data_in is not None:
+                d_in = getattr(self, data_in)
+            else:
+                d_in = None
+                for a in list(args) + list(kwargs.values()):
+                    if isinstance(a, (pd.DataFrame, pd.Series)):
+                        d_in = a
+                        break
+            with profiler.stage(stage_name, data_in=d_in) as st:
+                result = method(self, *args, **kwargs)
+                if data_out is not None:
+                    st.data_out(getattr(self, data_out))
+                else:
+                    st.data_out(result[0] if isinstance(result, tuple) else result)
+            return result
+        return wrapper
+    return decorator
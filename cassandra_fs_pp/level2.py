@@ -0,0 +1,459 @@
+"""
+Level-2 NetCDF export.
+
+Organises the Level-2 DataFrame of a firn station into an xarray Dataset of
+sub-surface (TDR, DTC, EC) and surface variables, and writes it to NetCDF.
+"""
+from __future__ import annotations
+
+import datetime as dt
+import importlib.util
+import os
+
+import netCDF4
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from cassandra_fs_pp.schema import site_schema
+
+#######
+version = 'v1.1'
+#######
+
+
+def subsurf_DataArray(
+    df : pd.DataFrame,
+    sensor_type : str,
+    name : str,
+    units : str,
+    positions : np.ndarray,
+    sensors_info : dict
+    ) -> xr.DataArray:
+    """
+    Create DataArray of a sub-surface sensor array (time x sensor).
+
+    :param df: Level-2 DataFrame, or a time subset of it.
+    :param sensor_type: e.g. tdr, dtc1, ec1.
+    :param name: standard_name of variable.
+    :param units: units of variable.
+    :param positions: positions of the level-2 columns of the variable, in
+    the order of sensors_info, see schema.SiteSchema.
+    :param sensors_info: dict of sensor ID: installation depth.
+    """
+    arr = xr.DataArray(
+        df.iloc[:, positions],
+        dims=['time', '%s_sensor' %sensor_type],
+        coords={
+            'time': df.index,
+            '%s_sensor' %sensor_type: list(sensors_info.keys()),
+            '%s_install_depth' %sensor_type: ('%s_sensor' %sensor_type, list(sensors_info.values())),
+        }
+    )
+    # if sensor_type == 'tdr':
+    #     arr.coords['tdr_depth'] = data_vars['TDR_Depth']
+
+    arr.attrs['standard_name'] = name
+    arr.attrs['units'] = units
+    return arr
+
+
+def surf_DataArray(
+    df : pd.DataFrame,
+    name : str,
+    units : str,
+    key : str
+    ) -> xr.DataArray:
+    """
+    Create DataArray of a surface variable (time).
+
+    :param df: Level-2 DataFrame, or a time subset of it.
+    :param name: standard_name of variable.
+    :param units: units of variable.
+    :param key: level-2 column name.
+    """
+    arr = xr.DataArray(
+        df[key],
+        dims=['time'],
+        coords={'time':df.index},
+        )
+    arr.attrs['standard_name'] = name
+    arr.attrs['units'] = units
+    return arr
+
+
+def active_tdrs(
+    fs
+    ) -> dict:
+    """
+    TDRs which have data in the Level-2 DataFrame.
+
+    :param fs: fs object with ds_level2 in memory.
+    :returns: dict of TDR number : installation depth.
+    """
+    tdr_info = fs.config['level1_2']['tdr_info']
+    recorded = site_schema(tuple(fs.ds_level2.columns)).tdr.get('T', {})
+
+    active = {}
+    for tdr in tdr_info.keys():
+        if int(tdr) in recorded:
+            # Create a dict of TDR number : depth
+            active[int(tdr)] = tdr_info[tdr][1]
+    return active
+
+
+def level2_tdr_depths(
+    fs
+    ) -> pd.DataFrame:
+    """
+    Time-varying depths of all active TDRs, see fs._calc_depth_tdrs.
+
+    These depend on the whole UDG record so are calculated once, for the 
+    whole Level-2 record, rather than per time chunk.
+
+    :param fs: fs object with ds_level2 in memory.
+    """
+    # Smooth the UDG record for calculating depths
+    udg_median = fs.ds_level2['TCDT(m)'].rolling('3D', center=True).median()
+    tdr_depths = fs._calc_depth_tdrs(list(active_tdrs(fs).keys()), udg_median)
+    return tdr_depths
+
+
+def level2_chain_depths(
+    fs
+    ) -> dict:
+    """
+    Installation depths of the sensors of each DTC and EC chain.
+
+    These are read from the sensor position files, so are read once for
+    the whole Level-2 record rather than per time chunk.
+
+    :param fs: fs object with ds_level1 in memory.
+    :returns: dict of variable name (e.g. dtc1, ec1) : dict of sensor ID : 
+    installation depth.
+    """
+    depths = {}
+    for dtc_key, values in fs.config['level1_2']['dtc_info'].items():
+        install_date, sensor_positions_f, first_sensor, depth = values
+        sensor_positions = fs.load_dtc_positions(filename=os.path.join(fs.data_root,sensor_positions_f))
+        depths['dtc%s'%dtc_key] = fs.chain_installation_depths(sensor_positions, first_sensor, depth)
+    for ec_key, values in fs.config['level1_2']['ec_info'].items():
+        install_date, sensor_positions_f, first_sensor, depth = values
+        sensor_positions = pd.read_csv(os.path.join(fs.data_root,sensor_positions_f)).squeeze()
+        depths['ec%s'%ec_key] = fs.chain_installation_depths(sensor_positions, first_sensor, depth)
+    return depths
+
+
+def level2_dataset(
+    fs,
+    rows : slice | None=None,
+    tdr_depths : pd.DataFrame | None=None,
+    chain_depths : dict | None=None
+    ) -> xr.Dataset:
+    """
+    Organise the Level-2 data of a site into an xarray Dataset.
+
+    :param fs: fs object with ds_level2 in memory, see fs.level1_to_level2.
+    :param rows: only include this slice of rows (by position) of ds_level2.
+    Used to build the Dataset one time chunk at a time.
+    :param tdr_depths: TDR depths from level2_tdr_depths. If None, calculated.
+    :param chain_depths: DTC and EC sensor depths from level2_chain_depths.
+    If None, read from the sensor position files.
+    """
+    df = fs.ds_level2
+    if rows is not None:
+        df = df.iloc[rows]
+
+    if tdr_depths is None:
+        tdr_depths = level2_tdr_depths(fs)
+    tdr_depths = tdr_depths.reindex(df.index)
+    if chain_depths is None:
+        chain_depths = level2_chain_depths(fs)
+    schema = site_schema(tuple(df.columns))
+
+    data_vars = {}
+
+    ## -------------------------------------------------------------------------
+    ## Organise Sub-Surface data
+
+    # TDRs
+    tdrs = active_tdrs(fs)
+
+    # Create time-varying depth variable
+    # However, we don't attach this as a coordinate to the TDR variables as it isn't
+    # really valid - it probably contains NANs depending on UDG status, TDR status...
+    data_vars['tdr_depth'] = xr.DataArray(
+        tdr_depths,
+        dims=('time', 'tdr_sensor'),
+        coords={
+            'time':tdr_depths.index,
+            'tdr_sensor':list(tdrs.keys())
+        },
+        attrs={
+            'standard_name':'tdr_depth_below_surface',
+            'units':'m',
+            'description':'Estimated depth of TDR sensor below surface at given timestamp'
+        }
+    )
+
+    tdr_ids = list(tdrs.keys())
+    data_vars['tdr_t'] = subsurf_DataArray(df, 'tdr', 'land_ice_temperature', 'degree_Celsius', schema.tdr_positions('T', tdr_ids), tdrs)
+    data_vars['tdr_ec'] = subsurf_DataArray(df, 'tdr', 'bulk_electrical_conductivity', 'dS/m', schema.tdr_positions('EC', tdr_ids), tdrs)
+    #data_vars['tdr_vwc'] = subsurf_DataArray(df, 'tdr', 'volumetric_water_content', 'm^3/m^3', schema.tdr_positions('VWC', tdr_ids), tdrs)
+    data_vars['tdr_perm'] = subsurf_DataArray(df, 'tdr', 'permittivity', '', schema.tdr_positions('Perm', tdr_ids), tdrs)
+    data_vars['tdr_vr'] = subsurf_DataArray(df, 'tdr', 'voltage_ratio', '', schema.tdr_positions('VR', tdr_ids), tdrs)
+    data_vars['tdr_period'] = subsurf_DataArray(df, 'tdr', 'period', 'micro_seconds', schema.tdr_positions('Period', tdr_ids), tdrs)
+
+    #DTC
+    for dtc_key in fs.config['level1_2']['dtc_info'].keys():
+        dtc_depths_t0 = chain_depths['dtc%s'%dtc_key]
+        # consider mask of valid DTC sensors - this is only relevant where extra sensors
+        # have been coiled at the surface.
+        dtc = subsurf_DataArray(df, 'dtc%s'%dtc_key, 'land_ice_temperature', 'degree_Celsius', 
+            schema.dtc_positions(dtc_key, list(dtc_depths_t0.keys())), dtc_depths_t0)
+        data_vars['dtc%s'%dtc_key] = dtc
+
+    # EC
+    for ec_key in fs.config['level1_2']['ec_info'].keys():
+        ec_depths_t0 = chain_depths['ec%s'%ec_key]
+        ec = subsurf_DataArray(df, 'ec%s'%ec_key, 'electrical_conductivity', 'microSiemens', 
+            schema.ec_positions(list(ec_depths_t0.keys())), ec_depths_t0)
+        data_vars['ec%s'%ec_key] = ec
+
+    ## -------------------------------------------------------------------------
+    ## Organise surface data
+    data_vars['t_air'] = surf_DataArray(df, 'air_temperature', 'degree_Celsius', 'T107_C')
+    data_vars['surface_height'] = surf_DataArray(df, 'distance_to_surface_from_stake', 'm', 'TCDT(m)')
+    data_vars['batt'] = surf_DataArray(df, 'battery_minimum', 'volts', 'BattV_Min')
+
+    # --------------------------------------------------------------------------
+    ## Create xarray Dataset
+    attrs = {
+        'site_id': fs.config['site'],
+        'title': 'Near-surface and sub-surface data from {site}, Greenland Ice Sheet'.format(site=fs.config['site']),
+        'institution': 'University of Fribourg, Switzerland',
+        'creator_name': 'Andrew Tedstone',
+        'creator_email': 'andrew.tedstone@unifr.ch',
+        'contributors': 'Horst Machguth, Nicole Clerx, Nicolas Jullien, Hannah Picton',
+        'source': 'https://www.github.com/erc-cassandra/cassandra_fs_pp/bin/fs_process_l2.py',
+        'processing_level':'Level 2',
+        'product_version': version,
+        'processing_date': dt.datetime.now().isoformat("T","minutes"),
+        'license':'Creative Commons Attribution 4.0 International (CC-BY-4.0) https://creativecommons.org/licenses/by/4.0',
+        'latitude':fs.config['lat'],
+        'longitude':fs.config['lon'],
+        'timezone':'UTC'
+    }
+
+    dataset = xr.Dataset(data_vars=data_vars, attrs=attrs)
+    return dataset
+
+
+def level2_encoding(
+    dataset : xr.Dataset,
+    complevel : int | dict | None=None,
+    shuffle : bool=True,
+    chunk_size : int | None=None
+    ) -> dict:
+    """
+    NetCDF encoding of each data variable of a Level-2 Dataset.
+
+    Data are stored as int32 scaled by 0.001. Times are stored as int64
+    seconds since 1970-01-01, rather than in units chosen by xarray from 
+    the first chunk written, so that chunks and appended data sampled more
+    finely than the first chunk are stored exactly.
+
+    :param dataset: Level-2 Dataset, see level2_dataset.
+    :param complevel: zlib compression level (1-9) of all variables, or a 
+    dict of variable:level for per-variable levels. None or 0 for no compression.
+    :param shuffle: if compressing, apply the HDF5 shuffle filter first.
+    :param chunk_size: length of HDF5 chunks along time. If None, the netCDF
+    library default is used.
+    """
+    encoding = {'time':{'units':'seconds since 1970-01-01', 'dtype':'int64', 
+        'calendar':'proleptic_gregorian'}}
+    # {"my_variable": {"dtype": "int16", "scale_factor": 0.1, "zlib": True}, ...}
+    for var in dataset.variables:
+        if var in dataset.coords:
+            continue
+        encoding[var] = {'dtype':'int32', 'scale_factor':0.001, 'zlib':False, '_FillValue':-9999}
+        #dataset[var].attrs['_FillValue'] = -999
+
+        if isinstance(complevel, dict):
+            level = complevel.get(var)
+        else:
+            level = complevel
+        if level:
+            encoding[var].update({'zlib':True, 'complevel':level, 'shuffle':shuffle})
+
+        if chunk_size is not None:
+            shape = dataset[var].shape
+            encoding[var]['chunksizes'] = tuple([min(chunk_size, max(shape[0], 1))] + list(shape[1:]))
+    return encoding
+
+
+def write_level2(
+    fs,
+    outfile : str | None=None,
+    chunk_size : int | None=None,
+    complevel : int | dict | None=None,
+    shuffle : bool | None=None,
+    append : bool=False
+    ) -> None:
+    """
+    Export the Level-2 data of a site to CSV and NetCDF.
+
+    The CSV is always written to firn_stations/level-2/<site>.csv.
+
+    The NetCDF file is written in time chunks: only one chunk of the data 
+    is held as an xarray Dataset at a time. Options which are None are 
+    taken from [level1_2] of the metadata (nc_chunk_size, nc_complevel, 
+    nc_shuffle) if set there.
+
+    :param fs: fs object with ds_level2 in memory, see fs.level1_to_level2.
+    :param outfile: path/filename of the NetCDF file. If None, uses the default
+    location, see fs._get_level2_default_path.
+    :param chunk_size: number of time steps to write at once (default 50000).
+    This is also the length of the HDF5 chunks along time.
+    :param complevel: zlib compression level, see level2_encoding.
+    :param shuffle: apply shuffle filter when compressing (default True).
+    :param append: if True and outfile exists, only append the time steps 
+    later than the last time in the file, rather than rewriting the file.
+    Time steps already in the file are not updated, even though e.g. their 
+    TDR depths may change once later UDG data are available.
+    """
+    opts = fs.config['level1_2']
+    if chunk_size is None:
+        chunk_size = opts.get('nc_chunk_size', 50000)
+    if complevel is None:
+        complevel = opts.get('nc_complevel', None)
+    if shuffle is None:
+        shuffle = opts.get('nc_shuffle', True)
+
+    if outfile is None:
+        outfile = fs._get_level2_default_path()
+
+    fs.ds_level2.to_csv(os.path.join(fs.data_root, 'firn_stations/level-2/%s.csv' %fs.config['site']))
+
+    tdr_depths = level2_tdr_depths(fs)
+    chain_depths = level2_chain_depths(fs)
+    n = len(fs.ds_level2)
+
+    if append and os.path.exists(outfile):
+        with netCDF4.Dataset(outfile, 'a') as nc:
+            times = nc['time']
+            if len(times) > 0:
+                last = netCDF4.num2date(times[-1], units=times.units, 
+                    calendar=getattr(times, 'calendar', 'standard'))
+                start = fs.ds_level2.index.searchsorted(pd.Timestamp(last.isoformat()), side='right')
+            else:
+                start = 0
+            print('Appending %s new time steps to %s.' %(n - start, outfile))
+            for i in range(start, n, chunk_size):
+                chunk = level2_dataset(fs, rows=slice(i, i+chunk_size), tdr_depths=tdr_depths,
+                    chain_depths=chain_depths)
+                _append_netcdf(nc, chunk)
+        return
+
+    for i in range(0, max(n, 1), chunk_size):
+        chunk = level2_dataset(fs, rows=slice(i, i+chunk_size), tdr_depths=tdr_depths,
+            chain_depths=chain_depths)
+        if i == 0:
+            encoding = level2_encoding(chunk, complevel=complevel, shuffle=shuffle, 
+                chunk_size=chunk_size)
+            # Write to netcdf
+            chunk.to_netcdf(outfile, encoding=encoding, unlimited_dims=['time'])
+        else:
+            with netCDF4.Dataset(outfile, 'a') as nc:
+                _append_netcdf(nc, chunk)
+    return
+
+
+def _append_netcdf(
+    nc : netCDF4.Dataset,
+    chunk : xr.Dataset
+    ) -> None:
+    """
+    Append a time chunk of Level-2 data to an open NetCDF file along its 
+    unlimited time dimension.
+
+    The netCDF library applies the scale factor and fill value of each 
+    variable, so values are written in physical units.
+
+    :param nc: NetCDF file opened in append mode, with the same variables
+    and non-time coordinates as chunk.
+    :param chunk: Level-2 Dataset of times later than those in the file.
+    """
+    m = chunk.sizes['time']
+    if m == 0:
+        return
+    n0 = len(nc.dimensions['time'])
+
+    for coord in chunk.coords:
+        if 'time' in chunk[coord].dims:
+            continue
+        if not np.array_equal(nc[coord][:], chunk[coord].values):
+            raise ValueError('Coordinate %s differs from that in the existing NetCDF file.' %coord)
+
+    times = nc['time']
+    values = netCDF4.date2num(chunk['time'].to_index().to_pydatetime(), 
+        units=times.units, calendar=getattr(times, 'calendar', 'standard'))
+    if times.dtype.kind in 'iu' and not np.array_equal(np.round(values), values):
+        # Files written before times were stored in seconds may have coarser units.
+        raise ValueError('Times cannot be stored exactly in the units of the existing NetCDF file (%s), write a new file instead.' %times.units)
+    times[n0:n0+m] = values
+
+    for var in chunk.data_vars:
+        da = chunk[var].transpose(*nc[var].dimensions)
+        values = np.ma.fix_invalid(da.values, fill_value=0)
+        nc[var][n0:n0+m, ...] = values
+    return
+
+
+def open_level2(
+    filename : str,
+    start=None,
+    finish=None,
+    variables : list | None=None,
+    sensors : dict | None=None,
+    time_chunks : int | None=None
+    ) -> xr.Dataset:
+    """
+    Open a Level-2 NetCDF file lazily.
+
+    No data are read on opening, apart from the coordinates. The time and
+    sensor selections are applied before any data are read, so that only
+    the HDF5 chunks which hold them are read from the file when variables
+    are used, e.g. a week of a multi-year record. Use the Dataset as a
+    context manager, or close it, to close the file.
+
+    If dask is installed, variables are dask arrays chunked along time, 
+    otherwise they are read from the file each time their values are used:
+    call .compute() on a variable to use its values several times.
+
+    :param filename: path to Level-2 NetCDF file.
+    :param start: if provided, only select data from this time onwards.
+    :param finish: if provided, only select data up to this time.
+    :param variables: if provided, only these data variables are opened, 
+    with their coordinates.
+    :param sensors: if provided, dict of sensor dimension : sensor IDs to 
+    select, e.g. {'tdr_sensor': [1, 2]}.
+    :param time_chunks: number of time steps per dask chunk. If None, uses 
+    the chunks of the file. Ignored if dask is not installed.
+    """
+    chunks = None
+    if importlib.util.find_spec('dask') is not None:
+        chunks = {} if time_chunks is None else {'time': time_chunks}
+
+    data = xr.open_dataset(filename, chunks=chunks)
+    if variables is not None:
+        missing = set(variables) - set(data.data_vars)
+        if len(missing) > 0:
+            data.close()
+            raise ValueError('Variables %s are not in %s.' %(sorted(missing), filename))
+        data = data[list(variables)]
+    if start is not None or finish is not None:
+        data = data.sel(time=slice(start, finish))
+    if sensors is not None:
+        data = data.sel(sensors)
+    return data
@@ -0,0 +1,348 @@
+"""
+K-way merge of time-sorted level-0 data.
+
+Each level-0 file (bale, subdataset or post-servicing download) is in time
+order, but consecutive files overlap where the MainTable was not cleared at
+a station visit. Rather than concatenating every file and then removing
+duplicates, SortedMerge streams the files in time order: a file is only
+opened once the merge reaches the time of its first record, and records are
+emitted in chunks as soon as no file which is still open or yet to be opened
+can hold an earlier record. Only the files which overlap the current chunk
+are held in memory, and only the records where files overlap are re-ordered.
+
+Where several records have the same timestamp, the record of the source
+with the highest precedence (the first in the list of sources) is kept, and
+within a source the first record, see find_duplicates.
+"""
+from __future__ import annotations
+
+import numpy as np
+import pandas as pd
+
+DUPLICATE_KINDS = ['identical', 'conflicting', 'late']
+
+
+def find_duplicates(
+    ds : pd.DataFrame
+    ) -> tuple:
+    """
+    Find records with a timestamp already held by an earlier record.
+
+    Only the timestamps are hashed; full records are only hashed and compared
+    where timestamps collide.
+
+    :param ds: DataFrame with rows in order of precedence.
+    :returns: (drop, identical) boolean arrays. `drop` marks every record
+    except the first of each timestamp, `identical` the records which are
+    identical to an earlier record (all columns, including RECORD).
+    """
+    if ds.index.is_unique:
+        drop = np.zeros(len(ds), dtype=bool)
+        return drop, drop
+    collide = ds.index.duplicated(keep=False)
+    drop = ds.index.duplicated(keep='first')
+    identical = np.zeros(len(ds), dtype=bool)
+    # Hashing rows is much faster than comparing each column in turn.
+    hashes = pd.util.hash_pandas_object(ds[collide], index=True)
+    identical[collide] = pd.Series(hashes.to_numpy()).duplicated(keep='first').to_numpy()
+    return drop, identical
+
+
+class SortedMerge():
+
+    def __init__(
+        self,
+        names : list,
+        starts : list,
+        chunk_rows : int=100000
+        ) -> None:
+        """
+        Set up the merge of several time-sorted sources.
+
+        :param names: name of each source (e.g. level-0 filename), in order
+        of precedence.
+        :param starts: timestamp of the first record of each source, used to
+        decide when to open it. None if not known, in which case the source
+        is opened at the start of the merge.
+        :param chunk_rows: maximum number of rows of each source to merge at
+        a time. Chunks yielded may exceed this where several sources overlap.
+        """
+        if len(names) != len(starts):
+            raise ValueError('One start time is needed for each source.')
+        self.names = list(names)
+        self.starts = list(starts)
+        self.chunk_rows = max(int(chunk_rows), 1)
+        self.rows_in = 0
+        self.rows_out = 0
+        self._counts = np.zeros((len(names), len(DUPLICATE_KINDS)), dtype=np.int64)
+        self._columns = {}
+        # Last chunk emitted, against which records arriving too late are checked.
+        self._last_chunk = None
+        return
+
+
+    def open_order(self) -> list:
+        """
+        Indexes of the sources in the order in which they are opened: those
+        without a start time first, then by start time, then by precedence.
+        """
+        def key(i):
+            start = self.starts[i]
+            if start is None or pd.isnull(start):
+                return (0, 0, i)
+            return (1, pd.Timestamp(start).value, i)
+        return sorted(range(len(self.names)), key=key)
+
+
+    def merge(
+        self,
+        frames
+        ):
+        """
+        Merge the sources.
+
+        A source is either a DataFrame, or an iterator of DataFrames which 
+        follow on from each other in time, e.g. a file read in chunks. Only 
+        the current and the next chunk of each open source are held.
+
+        Chunks which are not in time order are sorted. Records earlier than 
+        records which have already been emitted cannot be placed and are 
+        dropped. Those with the timestamp of a record of the last chunk
+        emitted are counted as identical or conflicting duplicates of it; 
+        the others are dropped with a warning, and counted as `late` in the
+        report. This only happens if a source starts earlier than its start 
+        time given to __init__, or if the chunks of a source are out of order.
+
+        :param frames: iterable of the sources, in the order given by 
+        open_order. Each is only requested when it is needed.
+        :yields: DataFrames of records in time order, without duplicated timestamps.
+        """
+        order = self.open_order()
+        frames = iter(frames)
+        # Source index: [current chunk, position in it, next chunk, iterator of further chunks]
+        active = {}
+        n_open = 0
+        emitted = None
+        self._last_chunk = None
+
+        while n_open < len(order) or len(active) > 0:
+            for i in list(active.keys()):
+                self._refill(active, i, emitted)
+            if len(active) > 0:
+                watermark, side = self._watermark(active)
+            elif n_open == len(order):
+                break
+            if n_open < len(order):
+                i = order[n_open]
+                start = self.starts[i]
+                if start is not None and pd.isnull(start):
+                    start = None
+                if len(active) == 0 or start is None or start <= watermark:
+                    if start is not None and any([a[0].index[a[1]] < start for a in active.values()]):
+                        # First merge the records before the next source starts,
+                        # so that only the records where sources overlap are re-ordered.
+                        watermark = start
+                        side = 'left'
+                    else:
+                        n_open += 1
+                        source = next(frames)
+                        if isinstance(source, pd.DataFrame):
+                            source = [source]
+                        active[i] = [None, 0, None, iter(source)]
+                        continue
+
+            # No source can hold records up to the watermark apart from those
+            # open, so these records can be merged.
+            pieces = []
+            sources = []
+            for i in sorted(active.keys()):
+                df, pos = active[i][:2]
+                stop = df.index.searchsorted(watermark, side=side)
+                if stop > pos:
+                    pieces.append(df.iloc[pos:stop])
+                    sources.append(i)
+                active[i][1] = stop
+            chunk = self._merge_chunk(pieces, sources)
+            emitted = chunk.index[-1]
+            self._last_chunk = chunk
+            yield chunk
+        return
+
+
+    def _refill(
+        self,
+        active : dict,
+        i : int,
+        emitted
+        ) -> None:
+        """
+        Move on to the next chunk of an open source once its current chunk is
+        merged, and read the chunk after. The source is closed once all its 
+        chunks are merged.
+
+        :param active: the open sources, see merge.
+        :param i: index of source.
+        :param emitted: last timestamp emitted so far, or None.
+        """
+        df, pos, ahead, it = active[i]
+        while True:
+            if ahead is None and it is not None:
+                ahead = next(it, None)
+                if ahead is None:
+                    it = None
+                else:
+                    ahead = self._prepare(i, ahead)
+                    continue
+            if df is None or pos == len(df):
+                if ahead is None:
+                    del active[i]
+                    return
+                df, pos, ahead = self._drop_late(i, ahead, emitted), 0, None
+                continue
+            if ahead is not None and df.index[pos] == df.index[-1] and ahead.index[0] <= df.index[-1]:
+                # Only records with the last timestamp remain, and the next 
+                # chunk has more records with it (or earlier).
+                df = pd.concat((df.iloc[pos:], ahead), axis=0)
+                if not df.index.is_monotonic_increasing:
+                    df = df.sort_index(kind='stable')
+                df, pos, ahead = self._drop_late(i, df, emitted), 0, None
+                continue
+            break
+        active[i] = [df, pos, ahead, it]
+        return
+
+
+    def _watermark(
+        self,
+        active : dict
+        ) -> tuple:
+        """
+        Timestamp up to which the open sources can be merged: the earliest 
+        last timestamp of the next chunk_rows records of each source.
+
+        :param active: the open sources, see merge.
+        :returns: (timestamp, side) where side is "right" if records at the
+        timestamp can be merged and "left" if not, see np.searchsorted.
+        """
+        ends = []
+        for df, pos, ahead, it in active.values():
+            end = min(pos + self.chunk_rows, len(df)) - 1
+            # The next chunk of the source may hold more records with the last timestamp.
+            exclusive = end == len(df) - 1 and ahead is not None and ahead.index[0] <= df.index[end]
+            ends.append((df.index[end], exclusive))
+        watermark = min([t for t, exclusive in ends])
+        if any([t == watermark and exclusive for t, exclusive in ends]):
+            return watermark, 'left'
+        return watermark, 'right'
+
+
+    def _prepare(
+        self,
+        i : int,
+        df : pd.DataFrame
+        ) -> pd.DataFrame:
+        """
+        Prepare a chunk of a source for merging, sorting it if needed.
+
+        :param i: index of source.
+        :param df: chunk of source.
+        """
+        self.rows_in += len(df)
+        if i not in self._columns:
+            self._columns[i] = list(df.columns)
+        if not df.index.is_monotonic_increasing:
+            print('%s is not in time order, sorting.' %self.names[i])
+            df = df.sort_index(kind='stable')
+        return df
+
+
+    def _drop_late(
+        self,
+        i : int,
+        df : pd.DataFrame,
+        emitted
+        ) -> pd.DataFrame:
+        """
+        Drop the records of a chunk which are no later than records already emitted.
+
+        Records with the timestamp of a record of the last chunk emitted are
+        compared with it, and counted as identical or conflicting duplicates.
+        Other records are counted as late.
+
+        :param i: index of source.
+        :param df: chunk of source.
+        :param emitted: last timestamp emitted so far, or None.
+        """
+        if emitted is not None and len(df) > 0 and df.index[0] <= emitted:
+            n = df.index.searchsorted(emitted, side='right')
+            dropped = df.iloc[:n]
+            df = df.iloc[n:]
+            if self._last_chunk is not None:
+                repeat = dropped.index.isin(self._last_chunk.index)
+            else:
+                repeat = np.zeros(n, dtype=bool)
+            if repeat.any():
+                earlier = self._last_chunk[self._last_chunk.index.isin(dropped.index[repeat])]
+                # The emitted records come first, so each dropped record is a duplicate.
+                _, identical = find_duplicates(pd.concat((earlier, dropped[repeat]), axis=0))
+                identical = identical[len(earlier):]
+                self._counts[i, DUPLICATE_KINDS.index('identical')] += np.sum(identical)
+                self._counts[i, DUPLICATE_KINDS.index('conflicting')] += np.sum(~identical)
+            n_late = n - np.sum(repeat)
+            if n_late > 0:
+                print('Warning: %s records of %s are earlier than records already merged and are dropped.' %(n_late, self.names[i]))
+                self._counts[i, DUPLICATE_KINDS.index('late')] += n_late
+        return df
+
+
+    def _merge_chunk(
+        self,
+        pieces : list,
+        sources : list
+        ) -> pd.DataFrame:
+        """
+        Merge the pieces of each source which fall into one chunk.
+
+        :param pieces: time-sorted DataFrames, in order of precedence.
+        :param sources: index of the source of each piece.
+        """
+        if len(pieces) == 1:
+            chunk = pieces[0]
+            codes = np.full(len(chunk), sources[0])
+        else:
+            chunk = pd.concat(pieces, axis=0)
+            codes = np.repeat(sources, [len(p) for p in pieces])
+            # A stable sort keeps records with the same timestamp in order of precedence.
+            order = np.argsort(chunk.index.values, kind='stable')
+            chunk = chunk.iloc[order]
+            codes = codes[order]
+
+        drop, identical = find_duplicates(chunk)
+        if drop.any():
+            np.add.at(self._counts[:, 0], codes[drop & identical], 1)
+            np.add.at(self._counts[:, 1], codes[drop & ~identical], 1)
+            chunk = chunk[~drop]
+        self.rows_out += len(chunk)
+        return chunk
+
+
+    @property
+    def columns(self) -> list:
+        """ Columns of all the sources opened, in order of precedence. """
+        columns = {}
+        for i in sorted(self._columns.keys()):
+            columns.update(dict.fromkeys(self._columns[i]))
+        return list(columns.keys())
+
+
+    @property
+    def report(self) -> pd.DataFrame:
+        """
+        Number of records dropped from each source: those identical to an
+        earlier record, those with conflicting data for a timestamp already
+        held, and those too late to be merged. Only sources with records
+        dropped are listed.
+        """
+        report = pd.DataFrame(self._counts, index=pd.Index(self.names, name='source'),
+            columns=DUPLICATE_KINDS)
+        return report[report.sum(axis=1) > 0]
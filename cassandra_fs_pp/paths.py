@@ -0,0 +1,57 @@
+"""
+Default locations of the datasets of a site.
+
+These only depend on the metadata of the site, and only import the standard
+library, so that the command-line tools can check for existing outputs
+before they import pandas or xarray, see cassandra_fs_pp.cli.
+"""
+from __future__ import annotations
+
+import os
+
+import tomli
+
+LEVEL1_FORMATS = {'csv':'.csv', 'parquet':'.parquet', 'feather':'.feather'}
+
+
+def read_config(
+    config_file : str
+    ) -> dict:
+    """
+    Read the metadata TOML file of a site, without checking it.
+
+    :param config_file: the path/filename to TOML config file.
+    """
+    with open(config_file, "rb") as f:
+        return tomli.load(f)
+
+
+def level1_default_path(
+    config : dict,
+    data_root : str,
+    fmt : str | None=None
+    ) -> str:
+    """
+    Default location of level-1 dataset.
+
+    :param config: metadata of site.
+    :param data_root: the path to the root of where the level-0,1,2 data are stored.
+    :param fmt: format of dataset, see fs.write_l1. If None, uses option
+    `l1_format` in [level0_1] (default csv).
+    """
+    if fmt is None:
+        fmt = config['level0_1'].get('l1_format', 'csv')
+    return os.path.join(data_root, 'firn_stations/level-1', config['site'] + LEVEL1_FORMATS[fmt])
+
+
+def level2_default_path(
+    config : dict,
+    data_root : str
+    ) -> str:
+    """
+    Default location of level-2 dataset.
+
+    :param config: metadata of site.
+    :param data_root: the path to the root of where the level-0,1,2 data are stored.
+    """
+    return os.path.join(data_root, 'firn_stations/level-2', config['site'] + '.nc')
@@ -0,0 +1,330 @@
+"""
+Processing chain of one or more firn stations: Level-0 -> Level-1 -> Level-2.
+
+These functions back the command-line tools (see cassandra_fs_pp.cli), and
+can also be used to process many sites at once, see run_batch.
+
+Importing this module is quick: pandas, xarray and the processing modules
+are only imported once a stage runs, and outputs which already exist are
+detected before they are imported.
+"""
+from __future__ import annotations
+
+import concurrent.futures
+import contextlib
+import datetime as dt
+import glob
+import logging
+import os
+import time
+import traceback
+import typing
+
+from cassandra_fs_pp import paths
+
+if typing.TYPE_CHECKING:
+    import pandas as pd
+    from cassandra_fs_pp.fs_pp import fs as fs_site
+
+# Columns of the summary of each site returned by run_site.
+SUMMARY_COLUMNS = ['site', 'status', 'level1_s', 'level2_s', 'error', 'log']
+
+
+def site_metafile(
+    site : str,
+    data_root : str
+    ) -> str:
+    """
+    Default location of the metadata TOML file of a site.
+
+    :param site: name of site.
+    :param data_root: the path to the root of where the level-0,1,2 data are stored.
+    """
+    return os.path.join(data_root, 'firn_stations/ppconfig', '%s.toml' %site)
+
+
+def profile_files(
+    site : str,
+    data_root : str,
+    level : str
+    ) -> tuple:
+    """
+    Locations of the profiling report and cProfile statistics of a run.
+
+    :param site: name of site.
+    :param data_root: the path to the root of where the level-0,1,2 data are stored.
+    :param level: processing level, e.g. level1.
+    :returns: (JSON report, cProfile statistics), both in firn_stations/logs.
+    """
+    log_dir = os.path.join(data_root, 'firn_stations/logs')
+    os.makedirs(log_dir, exist_ok=True)
+    stem = os.path.join(log_dir, '%s_%s_profile' %(site, level))
+    return stem + '.json', stem + '.prof'
+
+
+def _write_profile(
+    fs : fs_site,
+    site : str,
+    data_root : str,
+    level : str
+    ) -> None:
+    report, stats = profile_files(site, data_root, level)
+    fs.profiler.write_report(report)
+    fs.profiler.write_cprofile(stats)
+    print('Profiling report saved to %s, cProfile statistics to %s.' %(report, stats))
+    return
+
+
+def list_sites(
+    data_root : str
+    ) -> list:
+    """
+    List the sites which have metadata TOML files in firn_stations/ppconfig.
+
+    :param data_root: the path to the root of where the level-0,1,2 data are stored.
+    """
+    files = sorted(glob.glob(os.path.join(data_root, 'firn_stations/ppconfig', '*.toml')))
+    return [os.path.splitext(os.path.basename(f))[0] for f in files]
+
+
+def run_level1(
+    site : str,
+    data_root : str,
+    metafile : str | None=None,
+    outfile : str | None=None,
+    fmt : str | None=None,
+    overwrite : bool=False,
+    incremental : bool=False,
+    jobs : int | None=None,
+    use_cache : bool=True,
+    clear_cache : bool=False,
+    profile : bool=False,
+    stream : bool=False
+    ) -> fs_site:
+    """
+    Process level-0 data of a site up to level-1 status and save to disk.
+
+    :param site: name of site, normally corresponding to TOML metadata file.
+    :param data_root: the path to the root of where the level-0,1,2 data are stored.
+    :param metafile: path to metadata TOML file. If None, uses site_metafile.
+    :param outfile: path to output file. If None, uses the default location.
+    :param fmt: format of output file, see fs.write_l1.
+    :param overwrite: if False, raise IOError if the output file already exists.
+    :param incremental: only load new/changed level-0 files, see fs.update_level1.
+    :param jobs: number of workers with which to load level-0 files, see fs.level0_to_level1.
+    :param use_cache: if False, do not use the level-0 cache even if enabled in the metadata.
+    :param clear_cache: if True, empty the level-0 cache before processing.
+    :param profile: if True, trace memory and profile function calls, and save 
+    the report to firn_stations/logs, see profile_files.
+    :param stream: if True, process out-of-core, see fs.stream_level0_to_level1.
+    fs.ds_level1 is then not set. Cannot be combined with incremental.
+    """
+    if stream and incremental:
+        raise ValueError('Streamed processing cannot be combined with incremental processing.')
+    if metafile is None:
+        metafile = site_metafile(site, data_root)
+
+    # Check for existence of Level-1 file.
+    if not overwrite and not incremental:
+        if outfile is None:
+            p = paths.level1_default_path(paths.read_config(metafile), data_root, fmt)
+        else:
+            p = outfile
+        check = os.path.exists(p)
+
+        if check:
+            raise IOError('The Level-1 output file for this site already exists. To overwrite, specify -ow.')
+
+    from cassandra_fs_pp.fs_pp import fs as fs_site
+    from cassandra_fs_pp.instrument import Profiler
+
+    fs = fs_site(metafile, data_root)
+    if profile:
+        fs.profiler = Profiler(trace_memory=True, cprofile=True)
+        logging.getLogger('cassandra_fs_pp').setLevel(logging.INFO)
+
+    if clear_cache:
+        fs.enable_level0_cache().clear()
+        if not fs.config['level0_1'].get('cache', False):
+            fs.level0_cache = None
+    if not use_cache:
+        fs.level0_cache = None
+
+    if stream:
+        fs.stream_level0_to_level1(outpath=outfile, fmt=fmt)
+    else:
+        if incremental:
+            fs.update_level1(level1_file=outfile, jobs=jobs, fmt=fmt)
+        else:
+            fs.level0_to_level1(jobs=jobs)
+        fs.write_l1(outpath=outfile, fmt=fmt)
+
+    if profile:
+        _write_profile(fs, site, data_root, 'level1')
+    return fs
+
+
+def run_level2(
+    site : str,
+    data_root : str,
+    metafile : str | None=None,
+    infile : str | None=None,
+    outfile : str | None=None,
+    overwrite : bool=False,
+    chunk_size : int | None=None,
+    complevel : int | None=None,
+    append : bool=False,
+    profile : bool=False
+    ) -> fs_site:
+    """
+    Process level-1 data of a site up to level-2 status and save to disk.
+
+    :param site: name of site, normally corresponding to TOML metadata file.
+    :param data_root: the path to the root of where the level-0,1,2 data are stored.
+    :param metafile: path to metadata TOML file. If None, uses site_metafile.
+    :param infile: path to Level-1 file. If None, found automatically.
+    :param outfile: path to output NetCDF. If None, uses the default location.
+    :param overwrite: if False, raise IOError if the output file already exists.
+    :param chunk_size: number of time steps to write to NetCDF at once, see level2.write_level2.
+    :param complevel: zlib compression level of NetCDF variables.
+    :param append: append only new time steps to an existing NetCDF file.
+    :param profile: see run_level1.
+    """
+    if metafile is None:
+        metafile = site_metafile(site, data_root)
+
+    # Check for existence of Level-2 file.
+    if not overwrite and not append:
+        if outfile is None:
+            p = paths.level2_default_path(paths.read_config(metafile), data_root)
+        else:
+            p = outfile
+        check = os.path.exists(p)
+
+        if check:
+            raise IOError('The Level-2 output file for this site already exists. To overwrite, specify -ow.')
+
+    from cassandra_fs_pp.fs_pp import fs as fs_site
+    from cassandra_fs_pp import level2
+    from cassandra_fs_pp.instrument import Profiler
+
+    fs = fs_site(metafile, data_root)
+    if profile:
+        fs.profiler = Profiler(trace_memory=True, cprofile=True)
+        logging.getLogger('cassandra_fs_pp').setLevel(logging.INFO)
+
+    fs.load_level1_dataset(infile)
+    fs.ds_level1.index.name = 'time'
+    # Convert the data to level-2 format.
+    fs.level1_to_level2()
+
+    with fs.profiler.stage('write_level2', data_in=fs.ds_level2):
+        level2.write_level2(fs, outfile=outfile, chunk_size=chunk_size, 
+            complevel=complevel, append=append)
+
+    if profile:
+        _write_profile(fs, site, data_root, 'level2')
+    return fs
+
+
+def run_site(
+    site : str,
+    data_root : str,
+    log_dir : str | None=None,
+    do_level1 : bool=True,
+    do_level2 : bool=True,
+    level1_opts : dict | None=None,
+    level2_opts : dict | None=None
+    ) -> dict:
+    """
+    Run the processing chain of one site, logging its output to its own file.
+
+    Failures are caught and reported, rather than raised, so that one site
+    cannot stop the processing of others.
+
+    :param site: name of site.
+    :param data_root: the path to the root of where the level-0,1,2 data are stored.
+    :param log_dir: directory in which to write <site>_<time>.log. If None,
+    uses firn_stations/logs under data_root.
+    :param do_level1: run run_level1.
+    :param do_level2: run run_level2.
+    :param level1_opts: keyword arguments to pass to run_level1.
+    :param level2_opts: keyword arguments to pass to run_level2.
+    :returns: dict summarising the run: site, status, error, timings and log file.
+    """
+    if log_dir is None:
+        log_dir = os.path.join(data_root, 'firn_stations/logs')
+    os.makedirs(log_dir, exist_ok=True)
+    log_file = os.path.join(log_dir, '%s_%s.log' %(site, dt.datetime.now().strftime('%Y%m%dT%H%M%S')))
+
+    if level1_opts is None:
+        level1_opts = {}
+    if level2_opts is None:
+        level2_opts = {}
+
+    result = {'site':site, 'status':'ok', 'level1_s':None, 'level2_s':None, 'error':'', 'log':log_file}
+    handler = logging.FileHandler(log_file)
+    root_logger = logging.getLogger()
+    root_logger.addHandler(handler)
+    with open(log_file, 'a') as log, contextlib.redirect_stdout(log), contextlib.redirect_stderr(log):
+        stage = None
+        try:
+            if do_level1:
+                stage = 'level1'
+                t0 = time.perf_counter()
+                run_level1(site, data_root, **level1_opts)
+                result['level1_s'] = time.perf_counter() - t0
+            if do_level2:
+                stage = 'level2'
+                t0 = time.perf_counter()
+                run_level2(site, data_root, **level2_opts)
+                result['level2_s'] = time.perf_counter() - t0
+        except Exception as e:
+            traceback.print_exc()
+            result['status'] = 'failed (%s)' %stage
+            result['error'] = '%s: %s' %(type(e).__name__, e)
+        finally:
+            root_logger.removeHandler(handler)
+            handler.close()
+
+    return result
+
+
+def run_batch(
+    sites : list,
+    data_root : str,
+    workers : int | None=None,
+    **kwargs
+    ) -> pd.DataFrame:
+    """
+    Run the processing chain of several sites concurrently, one site per process.
+
+    :param sites: list of site names, e.g. from list_sites.
+    :param data_root: the path to the root of where the level-0,1,2 data are stored.
+    :param workers: number of worker processes. If None, one per site up to the number of CPUs.
+    :param kwargs: passed to run_site.
+    :returns: DataFrame summarising the run of each site, in the order of `sites`.
+    Empty if there are no sites. A site whose worker process dies (e.g. killed
+    when out of memory) is reported as "failed (worker)"; as the pool is then
+    broken, so are the sites which had not finished yet.
+    """
+    import pandas as pd
+
+    if workers is None:
+        workers = min(len(sites), os.cpu_count())
+
+    if workers <= 1:
+        results = [run_site(site, data_root, **kwargs) for site in sites]
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as ex:
+            futures = [ex.submit(run_site, site, data_root, **kwargs) for site in sites]
+            results = []
+            for site, f in zip(sites, futures):
+                try:
+                    results.append(f.result())
+                except Exception as e:
+                    results.append({'site':site, 'status':'failed (worker)', 'level1_s':None,
+                        'level2_s':None, 'error':'%s: %s' %(type(e).__name__, e), 'log':None})
+
+    summary = pd.DataFrame(results, columns=SUMMARY_COLUMNS).set_index('site')
+    return summary
@@ -0,0 +1,387 @@
+"""
+Figures of firn station Level-2 datasets, see bin/plot_L2.py.
+
+Each figure is an independent job which only needs the Level-2 NetCDF file,
+see figure_jobs. render_figures renders the jobs in a pool of processes.
+Each process opens the dataset once, lazily, so that only the variables,
+time range and sensors plotted are read from the file, see
+level2.open_level2. Each process uses the non-interactive Agg backend. Each
+figure is closed as soon as it has been saved, so memory does not grow with
+the number of figures.
+
+By default, long series are decimated to the number of pixels across the
+figure before they are drawn, see cassandra_fs_pp.decimate.
+"""
+from __future__ import annotations
+
+import concurrent.futures
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from cassandra_fs_pp import decimate as dec
+from cassandra_fs_pp import level2
+
+FIGSIZE = (9.0, 5.5)
+
+# TDRs
+# Bounds based (at least initially) on FS1 2021-22 data.
+TDR_VARS = {
+    'vwc': dict(vmin=0, vmax=1.0),
+    'ec': dict(vmin=0, vmax=0.01),
+    't': dict(cmap='RdBu_r', vmin=-10, vmax=10),
+    'perm': dict(vmin=0, vmax=50),
+    'period': dict(vmin=0, vmax=3000),
+    'vr': dict(vmin=0.99, vmax=1.01)
+}
+TDR_ITEMS = ['ec', 't', 'perm', 'period', 'vr'] #vwc removed 2024-06-17 AJT
+OTHER_ITEMS = ['batt', 't_air', 'surface_height']
+
+# Dataset and options of a worker process, see _init_worker.
+_worker = {}
+
+
+def figure_jobs(
+    data,
+    site : str,
+    tstr : str='',
+    fmt : str='png'
+    ) -> list:
+    """
+    List the figures of a Level-2 dataset.
+
+    :param data: xarray Dataset of Level-2 data, only used to check which
+    variables are present.
+    :param site: name of site, used in titles and filenames.
+    :param tstr: suffix of filenames, e.g. denoting the time range plotted.
+    :param fmt: file format, e.g. "png", or "pdf" for vector output.
+    :returns: list of (kind, variable, filename) tuples, see render_figures.
+    """
+    jobs = []
+    for item in TDR_ITEMS:
+        if 'tdr_%s' %item not in data.data_vars:
+            continue
+        jobs.append(('tdr_depth', item, '{site}_tdr_{item}_depth{t}.{fmt}'.format(site=site, item=item, t=tstr, fmt=fmt)))
+        jobs.append(('tdr', item, '{site}_tdr_{item}{t}.{fmt}'.format(site=site, item=item, t=tstr, fmt=fmt)))
+    for item in ['dtc1', 'dtc2']:
+        if item in data.data_vars:
+            jobs.append(('dtc', item, '{site}_{n}{t}.{fmt}'.format(site=site, n=item, t=tstr, fmt=fmt)))
+    if 'ec1' in data.data_vars:
+        jobs.append(('ec', 'ec1', '{site}_ec1{t}.{fmt}'.format(site=site, t=tstr, fmt=fmt)))
+    for item in OTHER_ITEMS:
+        if item in data.data_vars:
+            jobs.append(('other', item, '{site}_{item}{t}.{fmt}'.format(site=site, item=item, t=tstr, fmt=fmt)))
+    return jobs
+
+
+def render_figures(
+    filename : str,
+    jobs : list,
+    site : str,
+    outpath : str='.',
+    start=None,
+    finish=None,
+    workers : int | None=None,
+    dpi : int=300,
+    rasterize : bool=False,
+    decimate : bool=True,
+    sensors : dict | None=None
+    ) -> pd.DataFrame:
+    """
+    Render figures of a Level-2 dataset, concurrently.
+
+    :param filename: path to Level-2 NetCDF file.
+    :param jobs: list of figures to render, see figure_jobs.
+    :param site: name of site, used in titles.
+    :param outpath: path to save the figures to.
+    :param start: if provided, only plot data from this date onwards.
+    :param finish: if provided, only plot data up to this date.
+    :param workers: number of worker processes. If None, one per figure up
+    to the number of CPUs. If 1, figures are rendered in this process.
+    :param dpi: resolution of figures.
+    :param rasterize: if True, rasterize dense artists (scatters, lines,
+    meshes) so that vector formats stay small and quick to draw. Axes and
+    text remain vectors.
+    :param decimate: if True, only draw the samples of long series which 
+    are visible at the resolution of the figure, see cassandra_fs_pp.decimate.
+    :param sensors: if provided, dict of sensor dimension : sensor IDs to 
+    plot, e.g. {'tdr_sensor': [1, 2]}.
+    :returns: DataFrame of the time taken to render each figure, indexed by filename.
+    """
+    if workers is None:
+        workers = min(len(jobs), os.cpu_count())
+    variables = list(dict.fromkeys([v for job in jobs for v in _job_variables(job)]))
+    initargs = (filename, site, outpath, start, finish, dpi, rasterize, decimate, 
+        variables, sensors)
+
+    timings = {}
+    if workers <= 1:
+        _init_worker(*initargs)
+        for job in jobs:
+            f, seconds = _render(job)
+            print('%s: %.1f s' %(f, seconds))
+            timings[f] = seconds
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers,
+            initializer=_init_worker, initargs=initargs) as ex:
+            futures = [ex.submit(_render, job) for job in jobs]
+            for future in concurrent.futures.as_completed(futures):
+                f, seconds = future.result()
+                print('%s: %.1f s' %(f, seconds))
+                timings[f] = seconds
+
+    report = pd.DataFrame({'seconds':[timings[job[2]] for job in jobs]},
+        index=pd.Index([job[2] for job in jobs], name='figure'))
+    return report
+
+
+def _init_worker(
+    filename : str,
+    site : str,
+    outpath : str,
+    start,
+    finish,
+    dpi : int,
+    rasterize : bool,
+    decimate : bool,
+    variables : list,
+    sensors : dict | None
+    ) -> None:
+    """ Open the dataset and set up matplotlib in a worker process, see render_figures. """
+    import matplotlib
+    matplotlib.use('Agg')
+    import seaborn as sns
+
+    if 'data' in _worker:
+        _worker['data'].close()
+    data = level2.open_level2(filename, start=start, finish=finish, variables=variables,
+        sensors=sensors)
+    sns.set_style('whitegrid')
+
+    _worker.clear()
+    _worker.update(data=data, site=site, outpath=outpath, dpi=dpi, rasterize=rasterize,
+        decimate=decimate)
+    return
+
+
+def _job_variables(
+    job : tuple
+    ) -> list:
+    """ Level-2 variables read to render a figure. """
+    kind, item = job[:2]
+    if kind == 'tdr_depth':
+        return ['tdr_%s' %item, 'tdr_depth']
+    if kind == 'tdr':
+        return ['tdr_%s' %item]
+    if kind in ['dtc', 'ec']:
+        return [item, 'surface_height']
+    return [item]
+
+
+def _shared(
+    key : str
+    ):
+    """
+    Values shared by several figures, read or converted once per worker:
+    "time" (DatetimeIndex), "surf_loc" (see _surface_location), or a variable.
+    """
+    shared = _worker.setdefault('shared', {})
+    if key not in shared:
+        data = _worker['data']
+        if key == 'time':
+            shared[key] = data.time.to_index()
+        elif key == 'surf_loc':
+            shared[key] = _surface_location(_shared('surface_height').to_pandas())
+        else:
+            shared[key] = data[key].compute()
+    return shared[key]
+
+
+def _surface_location(
+    surface_height : pd.Series
+    ) -> pd.Series:
+    """ Smoothed surface height, to add to DTC and EC records. """
+    return surface_height.interpolate().rolling('24H').mean() * -1
+
+
+def _render(
+    job : tuple
+    ) -> tuple:
+    """
+    Render one figure in a worker process.
+
+    :param job: (kind, variable, filename), see figure_jobs.
+    :returns: (filename, seconds taken)
+    """
+    import matplotlib.pyplot as plt
+
+    t0 = time.perf_counter()
+    kind, item, filename = job
+    fig = plt.figure(figsize=FIGSIZE)
+    try:
+        ax = plt.subplot(111)
+        if _worker['decimate']:
+            budget = dec.pixel_budget(fig, ax, _worker['dpi'])
+        else:
+            budget = None
+        _PLOTS[kind](ax, item, _worker['data'], _worker['rasterize'], budget)
+        _place_legend(fig, ax, _worker['dpi'])
+        plt.savefig(os.path.join(_worker['outpath'], filename), dpi=_worker['dpi'])
+    finally:
+        plt.close(fig)
+    return filename, time.perf_counter() - t0
+
+
+def _place_legend(
+    fig,
+    ax,
+    dpi : int
+    ) -> None:
+    """
+    Fix the "best" location of the legend of axes with meshes (e.g. DTC).
+
+    To find the best location, matplotlib converts every cell of each mesh
+    into a path, which takes minutes for a multi-year record, but only uses
+    the offset of the mesh, which lies outside the axes. The best location 
+    is therefore found with the meshes detached and then fixed, so the
+    figure is the same.
+    """
+    import matplotlib.collections as mcoll
+    legend = ax.get_legend()
+    meshes = [c for c in ax.collections if isinstance(c, mcoll.QuadMesh)]
+    if legend is None or len(meshes) == 0:
+        return
+    for mesh in meshes:
+        mesh.remove()
+    fig.set_dpi(dpi)
+    fig.canvas.draw()
+    bbox = legend.get_window_extent().transformed(ax.transAxes.inverted())
+    legend.set_loc((bbox.x0, bbox.y0))
+    for mesh in meshes:
+        ax.add_collection(mesh, autolim=False)
+    return
+
+
+def _style_common(
+    ax,
+    main_title : str,
+    sub_title : str
+    ) -> None:
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+    sns.despine(ax=ax)
+    plt.legend()
+    plt.title(r"$\bf{" + main_title + "}$ " + " {sname}\n{site} ".format(sname=sub_title, site=_worker['site']),
+        loc='left', fontdict={'fontsize':10})
+    return
+
+
+def _line(
+    x,
+    y,
+    budget : int | None
+    ) -> np.ndarray:
+    """ Positions of samples of a line to draw, see decimate.decimate_line. """
+    if budget is None:
+        return slice(None)
+    return dec.decimate_line(x, y, 2 * budget)
+
+
+def _plot_tdr_depth(ax, item, data, rasterize, budget):
+    """ Coloured scatter of a TDR variable by depth. """
+    import matplotlib.pyplot as plt
+    var_name = 'tdr_%s' %item
+    time = _shared('time')
+    depths = _shared('tdr_depth')
+    array = data[var_name].compute()
+    for sensor in data.tdr_sensor:
+        depth = depths.sel(tdr_sensor=sensor).values
+        values = array.sel(tdr_sensor=sensor).values
+        keep = slice(None) if budget is None else dec.decimate_points(time, values, budget)
+        plt.scatter(
+            time[keep], 
+            depth[keep], 
+            c=values[keep], 
+            **TDR_VARS[item], label=int(sensor.values), rasterized=rasterize)
+    plt.colorbar()
+    plt.ylabel(data['tdr_depth'].attrs['units'])
+    _style_common(ax, 'Time Domain Reflectometry', data[var_name].attrs['standard_name'])
+    return
+
+
+def _plot_tdr(ax, item, data, rasterize, budget):
+    """ Line of each TDR sensor, without depth dimension. """
+    import matplotlib.pyplot as plt
+    var_name = 'tdr_%s' %item
+    time = _shared('time')
+    array = data[var_name].compute()
+    for sensor in data.tdr_sensor:
+        values = array.sel(tdr_sensor=sensor).values
+        keep = _line(time, values, budget)
+        plt.plot(
+            time[keep], 
+            values[keep],
+            label=int(sensor.values), rasterized=rasterize)
+    try:
+        plt.ylabel(data[var_name].attrs['units'])
+    except KeyError:
+        pass
+    _style_common(ax, 'Time Domain Reflectometry', data[var_name].attrs['standard_name'])
+    return
+
+
+def _plot_mesh(ax, item, data, rasterize, budget, **kwargs):
+    """ Sensor chain by installation depth, with the surface location. """
+    array = data[item].compute()
+    if budget is not None:
+        array = array.isel(time=dec.decimate_columns(_shared('time'), array.values, 
+            budget, axis=array.dims.index('time')))
+    array.plot(x='time', y='%s_install_depth' %item, ax=ax, rasterized=rasterize, **kwargs)
+    surf_loc = _shared('surf_loc')
+    surf_loc = surf_loc.iloc[_line(surf_loc.index, surf_loc.values, budget)]
+    return surf_loc
+
+
+def _plot_dtc(ax, item, data, rasterize, budget):
+    """ DTC temperatures by installation depth, with the surface location. """
+    surf_loc = _plot_mesh(ax, item, data, rasterize, budget)
+    surf_loc.plot(label='Surface location', color='black', ax=ax, rasterized=rasterize)
+    _style_common(ax, item, data[item].attrs['standard_name'])
+    return
+
+
+def _plot_ec(ax, item, data, rasterize, budget):
+    """ EC by installation depth, with the surface location. """
+    surf_loc = _plot_mesh(ax, item, data, rasterize, budget, vmin=0, vmax=15)
+    surf_loc.plot(label='Surface location', color='white', ax=ax, rasterized=rasterize)
+    _style_common(ax, 'EC', data[item].attrs['standard_name'])
+    return
+
+
+def _plot_other(ax, item, data, rasterize, budget):
+    """ Time series with its 24-hour rolling median. """
+    item_title = item.replace('_', r'\_')
+    sname = data[item].standard_name
+
+    array = _shared(item) if item == 'surface_height' else data[item].compute()
+    keep = _line(_shared('time'), array.values, budget)
+    array.isel(time=keep).plot(ax=ax, marker='.', linestyle='-', markersize=3, 
+        color='lightblue', alpha=0.5, rasterized=rasterize)
+    as_pd = array.to_pandas()
+    # there was an interpolate() in here
+    med = as_pd.rolling('24H', min_periods=10, center=True).median()
+    med.iloc[_line(med.index, med.values, budget)].plot(label='24H rolling',
+        color='tab:blue', linewidth=2, alpha=0.9, ax=ax, rasterized=rasterize)
+    _style_common(ax, item_title, sname)
+    return
+
+
+_PLOTS = {
+    'tdr_depth':_plot_tdr_depth,
+    'tdr':_plot_tdr,
+    'dtc':_plot_dtc,
+    'ec':_plot_ec,
+    'other':_plot_other
+}
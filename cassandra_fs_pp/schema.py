@@ -0,0 +1,136 @@
+"""
+Index of the columns of a firn station dataset by sensor family.
+
+The columns of Level-1 and Level-2 datasets are named after the sensor
+which recorded them:
+
+* TDRs: TDR<sensor>_<variable>, e.g. TDR1_T, or TDR1_T(C) at Level-2;
+* DTC chains: DTC<chain>(<sensor>), e.g. DTC1(3), or DTC1_3(C) at Level-2;
+* EC chain: EC(<sensor>);
+* surface and station variables: any other column, e.g. TCDT(m), BattV_Min.
+
+SiteSchema parses the column names once and maps each family to the
+positions of its columns by sensor ID, so that the columns of a variable
+can be selected by position (e.g. df.iloc[:, positions]) rather than by
+scanning every column name with a regex at each stage of processing.
+"""
+from __future__ import annotations
+
+import functools
+import re
+
+import numpy as np
+
+_RE_TDR = re.compile(r'TDR(?P<id>[0-9]+)_(?P<var>[A-Za-z]+)')
+_RE_DTC = re.compile(r'DTC(?P<chain>[0-9]+)(?:\((?P<id>[0-9]+)\)|_(?P<id2>[0-9]+))')
+_RE_EC = re.compile(r'EC\((?P<id>[0-9]+)\)')
+
+
+class SiteSchema():
+
+    def __init__(
+        self,
+        columns : list
+        ) -> None:
+        """
+        Index columns by sensor family.
+
+        :param columns: column names of a Level-1 or Level-2 dataset, in order.
+        """
+        self.columns = list(columns)
+        # TDR variable : {sensor ID : position}
+        self.tdr = {}
+        # DTC chain : {sensor ID : position}
+        self.dtc = {}
+        # EC sensor ID : position
+        self.ec = {}
+        # Column name : position
+        self.surface = {}
+
+        for i, col in enumerate(self.columns):
+            res = _RE_TDR.match(col)
+            if res is not None:
+                self.tdr.setdefault(res['var'], {})[int(res['id'])] = i
+                continue
+            res = _RE_DTC.match(col)
+            if res is not None:
+                sensor = res['id'] if res['id'] is not None else res['id2']
+                self.dtc.setdefault(int(res['chain']), {})[int(sensor)] = i
+                continue
+            res = _RE_EC.fullmatch(col)
+            if res is not None:
+                self.ec[int(res['id'])] = i
+                continue
+            self.surface[col] = i
+        return
+
+
+    def tdr_positions(
+        self,
+        variable : str,
+        sensors : list | None=None
+        ) -> np.ndarray:
+        """
+        Positions of the columns of a TDR variable.
+
+        :param variable: e.g. "T", "EC", "Perm".
+        :param sensors: TDR IDs, in the order wanted. By default all TDRs
+        which recorded the variable, in column order.
+        """
+        return self._positions(self.tdr.get(variable, {}), sensors, 'TDR %s' %variable)
+
+
+    def dtc_positions(
+        self,
+        chain : int | str,
+        sensors : list | None=None
+        ) -> np.ndarray:
+        """
+        Positions of the columns of a DTC chain.
+
+        :param chain: ID of chain, e.g. 1 for DTC1.
+        :param sensors: sensor IDs, in the order wanted. By default all sensors,
+        in column order.
+        """
+        return self._positions(self.dtc.get(int(chain), {}), sensors, 'DTC%s' %chain)
+
+
+    def ec_positions(
+        self,
+        sensors : list | None=None
+        ) -> np.ndarray:
+        """
+        Positions of the columns of the EC chain.
+
+        :param sensors: sensor IDs, in the order wanted. By default all sensors,
+        in column order.
+        """
+        return self._positions(self.ec, sensors, 'EC')
+
+
+    def _positions(
+        self,
+        family : dict,
+        sensors : list | None,
+        name : str
+        ) -> np.ndarray:
+        """ Positions of the sensors of a family, see tdr_positions. """
+        if sensors is None:
+            return np.fromiter(family.values(), dtype='int64', count=len(family))
+        missing = [s for s in sensors if int(s) not in family]
+        if len(missing) > 0:
+            raise ValueError('No %s columns for sensors %s.' %(name, missing))
+        return np.array([family[int(s)] for s in sensors], dtype='int64')
+
+
+@functools.lru_cache(maxsize=32)
+def site_schema(
+    columns : tuple
+    ) -> SiteSchema:
+    """
+    SiteSchema of a set of columns, built once per set of columns.
+
+    :param columns: tuple of column names.
+    :returns: SiteSchema. Do not modify, it is memoized.
+    """
+    return SiteSchema(columns)
@@ -0,0 +1,119 @@
+"""
+Appendable writer of Level-1 datasets.
+
+Level1Sink writes a Level-1 dataset chunk by chunk, so that the whole
+dataset never has to be held in memory, see fs.stream_level0_to_level1.
+The files written are the same as those written by fs.write_l1 in one go:
+
+* CSV: the header is written with the first chunk, later chunks are appended.
+* Parquet: each chunk is written as a row group.
+* Feather: each chunk is written as a record batch of an Arrow IPC file,
+  which is the Feather (version 2) format.
+
+The columnar formats require pyarrow. All chunks must have the same columns
+and dtypes.
+"""
+from __future__ import annotations
+
+import numpy as np
+import pandas as pd
+
+
+class Level1Sink():
+
+    def __init__(
+        self,
+        outpath : str,
+        fmt : str='csv',
+        float_dtype : str='float32',
+        compression : str='zstd',
+        date_format : str | None=None
+        ) -> None:
+        """
+        Open a Level-1 dataset for writing. Any existing file is overwritten.
+
+        :param outpath: path/filename to write to.
+        :param fmt: one of "csv", "parquet" or "feather".
+        :param float_dtype: dtype of floating-point columns in columnar formats.
+        :param compression: compression of columnar formats.
+        :param date_format: format of timestamps in CSV. By default pandas 
+        chooses the format for each chunk, which may differ between chunks.
+        """
+        if fmt not in ['csv', 'parquet', 'feather']:
+            raise ValueError('Unknown Level-1 format "%s".' %fmt)
+        self.outpath = outpath
+        self.fmt = fmt
+        self.float_dtype = np.dtype(float_dtype)
+        self.compression = compression
+        self.date_format = date_format
+        self.rows = 0
+        self._writer = None
+        self._schema = None
+        return
+
+
+    def write(
+        self,
+        chunk : pd.DataFrame
+        ) -> None:
+        """
+        Append a chunk of Level-1 data.
+
+        :param chunk: DataFrame of Level-1 data, which follows on from the
+        previous chunk in time.
+        """
+        if self.fmt == 'csv':
+            first = self.rows == 0
+            chunk.to_csv(self.outpath, mode='w' if first else 'a', header=first, 
+                date_format=self.date_format)
+        else:
+            import pyarrow as pa
+            floats = [c for c, d in chunk.dtypes.items() if d.kind == 'f' and d != self.float_dtype]
+            if len(floats) > 0:
+                chunk = chunk.astype(dict.fromkeys(floats, self.float_dtype))
+            if self.fmt == 'feather':
+                # Feather does not support indexes, store it as a column.
+                chunk = chunk.reset_index()
+            table = pa.Table.from_pandas(chunk, schema=self._schema,
+                preserve_index=self.fmt == 'parquet')
+            if self._writer is None:
+                self._schema = table.schema
+                self._writer = self._open_writer(table.schema)
+            if self.fmt == 'parquet':
+                self._writer.write_table(table)
+            else:
+                for batch in table.to_batches():
+                    self._writer.write_batch(batch)
+        self.rows += len(chunk)
+        return
+
+
+    def _open_writer(
+        self,
+        schema
+        ):
+        """ Open the writer of a columnar format, given the schema of the first chunk. """
+        if self.fmt == 'parquet':
+            import pyarrow.parquet as pq
+            return pq.ParquetWriter(self.outpath, schema, compression=self.compression)
+        import pyarrow as pa
+        compression = None if self.compression == 'uncompressed' else self.compression
+        return pa.ipc.new_file(self.outpath, schema,
+            options=pa.ipc.IpcWriteOptions(compression=compression))
+
+
+    def close(self) -> None:
+        """ Finish writing the dataset. """
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        return
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *args) -> None:
+        self.close()
+        return
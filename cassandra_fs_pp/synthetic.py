@@ -0,0 +1,319 @@
+"""
+Generator of synthetic firn station data sets.
+
+Writes a complete data_root for one site - level-0 TOA5 MainTable bales, DTC
+DiagSettings files, EC chain sensor positions, EC calibration coefficients
+and a metadata TOML file - at any scale, e.g. for benchmarking the
+processing chain. The measurements follow plausible seasonal and daily
+cycles and include the kinds of artefact found in real level-0 data:
+rows repeated between bales, bad UDG readings and UDG pole extensions.
+
+The data are not physically consistent; do not use them for anything else!
+"""
+from __future__ import annotations
+
+import csv
+import datetime as dt
+import os
+
+import numpy as np
+import pandas as pd
+
+from cassandra_fs_pp import toa5
+
+# Station header line of the synthetic TOA5 files, see toa5.TOA5_FILE_INFO.
+_FILE_INFO = ['TOA5', '%s', 'CR800', '99999', 'CR800.Std.32.03', 'CPU:firn_station.CR8', '20701', '%s']
+
+# Spacing of sensors along DTC and EC chains (mm).
+DTC_SPACING = 150
+EC_SPACING = 150
+
+
+def write_toa5(
+    filename : str,
+    data : pd.DataFrame,
+    units : dict,
+    processing : dict,
+    station : str='FSX',
+    table : str='MainTable',
+    float_format : str='%.5g'
+    ) -> None:
+    """
+    Write a DataFrame to a Campbell Scientific TOA5 file.
+
+    :param filename: path/filename of file to write.
+    :param data: DataFrame with a DatetimeIndex (the TIMESTAMP) and a RECORD column.
+    :param units: dict of column:units, see toa5.read_toa5_header.
+    :param processing: dict of column:processing, e.g. Smp, Min.
+    :param station: station name to write in the header.
+    :param table: table name to write in the header.
+    :param float_format: format of measurements.
+    """
+    columns = ['TIMESTAMP'] + list(data.columns)
+    info = list(_FILE_INFO)
+    info[1] = info[1] %station
+    info[7] = info[7] %table
+    header = [
+        info,
+        columns,
+        [toa5.TOA5_TIMESTAMP_UNITS] + [units[c] for c in data.columns],
+        [''] + [processing[c] for c in data.columns]
+    ]
+    with open(filename, 'w', newline='') as f:
+        writer = csv.writer(f, quoting=csv.QUOTE_ALL, lineterminator='\n')
+        writer.writerows(header)
+        # TOA5 quotes timestamps and NANs but not numbers.
+        out = data.copy()
+        out.insert(0, 'TIMESTAMP', '"' + data.index.strftime(toa5.TOA5_TIMESTAMP_FORMAT) + '"')
+        out.to_csv(f, header=False, index=False, na_rep='"NAN"',
+            float_format=float_format, quoting=csv.QUOTE_NONE, quotechar="'",
+            lineterminator='\n')
+    return
+
+
+def _seasonal(
+    t : np.ndarray,
+    phase : float=110
+    ) -> np.ndarray:
+    """ Annual cycle (-1 to 1) peaking in mid-summer, t in days of year. """
+    return np.sin(2 * np.pi * (t - phase) / 365.25)
+
+
+def _diurnal(
+    t : np.ndarray
+    ) -> np.ndarray:
+    """ Daily cycle (-1 to 1) peaking in the afternoon, t in days. """
+    return np.sin(2 * np.pi * (t - 0.375))
+
+
+def make_maintable(
+    start : str,
+    end : str,
+    freq : str='10min',
+    n_tdr : int=3,
+    n_dtc : int=1,
+    n_dtc_sensors : int=12,
+    n_ec : int=12,
+    udg_height : float=2.0,
+    pole_extensions : list | None=None,
+    seed : int=0
+    ) -> tuple:
+    """
+    Create synthetic MainTable data.
+
+    :param start: first timestamp.
+    :param end: last timestamp.
+    :param freq: sampling interval.
+    :param n_tdr: number of TDRs.
+    :param n_dtc: number of DTC chains.
+    :param n_dtc_sensors: number of sensors on each DTC chain.
+    :param n_ec: number of sensors on the EC chain (0 for none).
+    :param udg_height: UDG distance to the surface at installation (m).
+    :param pole_extensions: list of (timestamp, m) at which the UDG was raised.
+    :param seed: seed of random number generator.
+    :returns: (DataFrame with DatetimeIndex, dict of units, dict of processing)
+    """
+    rng = np.random.default_rng(seed)
+    index = pd.date_range(start, end, freq=freq, name='TIMESTAMP')
+    n = len(index)
+    t = ((index - index[0]) / pd.Timedelta(days=1)).to_numpy()
+    doy = index.dayofyear.to_numpy().astype('float64')
+    step = pd.Timedelta(freq) / pd.Timedelta(days=1)
+
+    data = {}
+    units = {}
+    processing = {}
+    def add(col, values, unit, proc='Smp'):
+        data[col] = values
+        units[col] = unit
+        processing[col] = proc
+
+    add('RECORD', np.arange(n), toa5.TOA5_RECORD_UNITS, '')
+
+    t_air = -12 + 12 * _seasonal(doy) + 4 * _diurnal(t) + rng.normal(0, 1, n)
+    t_air = np.minimum(t_air, 8)
+    add('BattV_Min', 12.8 + 0.4 * _diurnal(t) + rng.normal(0, 0.05, n), 'Volts', 'Min')
+    add('PTemp_C_Min', t_air + rng.normal(0, 0.5, n), 'Deg C', 'Min')
+    add('T107_C', t_air, 'Deg C')
+
+    # Surface lowers with melt and rises with snowfall; distance from the UDG
+    # to the surface increases with surface lowering.
+    melt = 0.01 * np.maximum(t_air, 0) * step
+    snow = rng.exponential(0.002, n) * step * (_seasonal(doy) < 0.5)
+    udg = udg_height + np.cumsum(melt - snow)
+    if pole_extensions is not None:
+        for when, height in pole_extensions:
+            udg[index >= pd.Timestamp(when)] += height
+    udg = udg + rng.normal(0, 0.005, n)
+    q = rng.integers(152, 210, n).astype('float64')
+    bad = rng.random(n) < 0.005
+    udg[bad] = rng.uniform(0.5, 8, bad.sum())
+    q[bad] = 0
+    add('TCDT', udg, 'm')
+    add('Q', q, 'Unitless')
+    add('DT', udg + rng.normal(0, 0.01, n), 'm')
+
+    def firn_temperature(depth):
+        """ Temperature at depth (m, +ve), damped and lagged annual cycle. """
+        damping = 2.0
+        tz = -12 + 10 * np.exp(-depth / damping) * _seasonal(doy - 30 * depth / damping)
+        return np.minimum(tz, 0) + rng.normal(0, 0.05, n)
+
+    for tdr in range(1, n_tdr + 1):
+        depth = 0.5 * tdr
+        wet = (firn_temperature(depth) > -0.1).astype('float64')
+        add('TDR%s_VWC' %tdr, 0.05 * wet, 'm^3/m^3')
+        add('TDR%s_EC' %tdr, 0.01 + 0.1 * wet + rng.normal(0, 0.002, n), 'dS/m')
+        add('TDR%s_T' %tdr, firn_temperature(depth), 'Deg C')
+        add('TDR%s_Perm' %tdr, 3.2 + 10 * wet + rng.normal(0, 0.05, n), 'Unitless')
+        add('TDR%s_Period' %tdr, 1.05 + 0.1 * wet + rng.normal(0, 0.002, n), 'microseconds')
+        add('TDR%s_VR' %tdr, 1 + rng.normal(0, 0.01, n), 'Unitless')
+
+    for dtc in range(1, n_dtc + 1):
+        for sensor in range(1, n_dtc_sensors + 1):
+            depth = 0.2 + (sensor - 1) * DTC_SPACING * 1e-3 + 0.1 * dtc
+            add('DTC%s(%s)' %(dtc, sensor), firn_temperature(depth), 'Deg C')
+
+    for sensor in range(1, n_ec + 1):
+        mv = 0.9 + np.cumsum(rng.normal(0, 0.001, n))
+        add('EC(%s)' %sensor, np.clip(mv, 0.4, 1.05), 'milliVolts')
+
+    df = pd.DataFrame(data, index=index)
+    float_cols = [c for c in df.columns if c != 'RECORD']
+    df[float_cols] = df[float_cols].astype('float32')
+    return df, units, processing
+
+
+def make_site(
+    data_root : str,
+    site : str='FSX',
+    start : str='2021-05-01',
+    years : float=1,
+    freq : str='10min',
+    n_tdr : int=3,
+    n_dtc : int=1,
+    n_dtc_sensors : int=12,
+    n_ec : int=12,
+    bale_days : int=30,
+    overlap : int=6,
+    seed : int=0
+    ) -> str:
+    """
+    Write a complete synthetic data set of a site to a data_root.
+
+    One level-0 dataset named `fielddata_synthetic` is written, consisting of
+    bales of `bale_days` days. The last `overlap` rows of each bale are
+    repeated at the start of the next, as happens when MainTables are not
+    cleared. The UDG pole is extended every year.
+
+    :param data_root: directory to write to. The firn_stations/level-1,
+    level-2 and ppconfig directories are created.
+    :param site: name of site.
+    :param start: first timestamp.
+    :param years: length of record in years.
+    :param freq: sampling interval.
+    :param n_tdr: number of TDRs.
+    :param n_dtc: number of DTC chains.
+    :param n_dtc_sensors: number of sensors on each DTC chain.
+    :param n_ec: number of sensors on the EC chain (0 for none).
+    :param bale_days: length of each bale in days.
+    :param overlap: number of rows repeated between bales.
+    :param seed: seed of random number generator.
+    :returns: path/filename of the metadata TOML file.
+    """
+    dataset = 'fielddata_synthetic'
+    for d in ['firn_stations/level-1', 'firn_stations/level-2', 'firn_stations/ppconfig',
+        'ec_calibration', dataset]:
+        os.makedirs(os.path.join(data_root, d), exist_ok=True)
+
+    t0 = pd.Timestamp(start)
+    t1 = t0 + pd.Timedelta(days=365.25 * years)
+    extensions = [(t0 + pd.DateOffset(years=y), 1.0) for y in range(1, int(np.ceil(years)))]
+    extensions = [(when, h) for when, h in extensions if when < t1]
+    maintable, units, processing = make_maintable(t0, t1, freq=freq, n_tdr=n_tdr,
+        n_dtc=n_dtc, n_dtc_sensors=n_dtc_sensors, n_ec=n_ec,
+        pole_extensions=extensions, seed=seed)
+
+    # Level-0 bales
+    edges = pd.date_range(t0, t1 + pd.Timedelta(days=bale_days), freq='%sD' %bale_days)
+    bounds = maintable.index.searchsorted(edges)
+    nbales = 0
+    for i in range(len(bounds) - 1):
+        if bounds[i] >= len(maintable):
+            break
+        first = max(bounds[i] - overlap, 0)
+        bale = maintable.iloc[first:bounds[i+1]]
+        nbales += 1
+        write_toa5(os.path.join(data_root, dataset, 'MainTable%s.dat' %nbales), bale,
+            units, processing, station=site)
+
+    # DTC DiagSettings
+    for dtc in range(1, n_dtc + 1):
+        cols = ['DTC%s_SensorPositions(%s)' %(dtc, s) for s in range(1, n_dtc_sensors + 1)]
+        pos = pd.DataFrame([[0] + list(np.arange(n_dtc_sensors) * DTC_SPACING)],
+            columns=['RECORD'] + cols, index=pd.DatetimeIndex([t0 - pd.Timedelta(days=20)]))
+        write_toa5(os.path.join(data_root, dataset, '%s_DTC%s_DiagSettings.dat' %(site, dtc)), pos,
+            dict(zip(pos.columns, ['RN'] + ['mm']*n_dtc_sensors)),
+            dict(zip(pos.columns, [''] + ['Smp']*n_dtc_sensors)), station=site,
+            table='DTC%s_DiagSettings' %dtc, float_format='%d')
+
+    # EC chain: sensor positions and calibration coefficients
+    if n_ec > 0:
+        pd.DataFrame({'SensorPosition(m)':np.arange(n_ec) * EC_SPACING}).to_csv(
+            os.path.join(data_root, 'EC_%s.csv' %site), index=False)
+    # Level-2 processing always expects a calibration file.
+    rng = np.random.default_rng(seed)
+    cal = pd.DataFrame({
+        'm':rng.uniform(380, 870, n_ec),
+        'c':np.zeros(n_ec),
+        'r2':rng.uniform(0.93, 0.99, n_ec)
+    }, index=['EC(%s)' %s for s in range(1, n_ec + 1)])
+    cal.to_csv(os.path.join(data_root, 'ec_calibration',
+        'calibration_coefficients_%s_c0.csv' %site.upper()))
+
+    # Metadata
+    install = t0.date().isoformat()
+    udg_changes = ['[%s, %s]' %(install, 2.0)] + ['[%s]' %when.isoformat() for when, _ in extensions]
+    lines = [
+        'site="%s"' %site,
+        "tz='UTC'",
+        'lat=67.0',
+        'lon=-47.0',
+        '',
+        '[level0_1]',
+        'skiprows=[0,2,3]',
+        'header=0',
+        "index_col='TIMESTAMP'",
+        "na_values=['NAN']",
+        "udg_key='TCDT'",
+        "sep=','",
+        '',
+        '[level1_2]',
+        'udg_height_change=[%s]' %', '.join(udg_changes),
+        'remove_columns=["RECORD", "PTemp_C_Min", "DT"]',
+        '',
+        '[level1_2.tdr_info]',
+    ]
+    for tdr in range(1, n_tdr + 1):
+        lines.append('%s=[%s,%s,false]' %(tdr, install, -0.5 * tdr))
+    lines += ['', '[level1_2.dtc_info]']
+    for dtc in range(1, n_dtc + 1):
+        lines.append('%s=[%s, "%s/%s_DTC%s_DiagSettings.dat", 1, %s]' %(dtc, install,
+            dataset, site, dtc, -0.2 - 0.1 * dtc))
+    lines += ['', '[level1_2.ec_info]']
+    if n_ec > 0:
+        lines.append('1=[%s, "EC_%s.csv", 1, -0.2]' %(install, site))
+    lines += [
+        '',
+        '[level0]',
+        '[level0.%s]' %dataset,
+        'subpath=""',
+        'type="bales"',
+        'bales_start=1',
+        'bales_stop=%s' %nbales,
+        ''
+    ]
+    metafile = os.path.join(data_root, 'firn_stations/ppconfig', '%s.toml' %site)
+    with open(metafile, 'w') as f:
+        f.write('\n'.join(lines))
+    return metafile
@@ -46,7 +46,15 @@ setup(
     license="BSD-3",
     packages=["cassandra_fs_pp"],
     install_requires=["pandas", "xarray"],
-    scripts=["bin/fs_process_l1.py", "bin/fs_process_l2.py", "bin/plot_L2.py"],
+    scripts=["bin/fs_process_l1.py", "bin/fs_process_l2.py", "bin/fs_process_batch.py", "bin/plot_L2.py"],
+    entry_points={
+        "console_scripts": [
+            "fs_process_l1=cassandra_fs_pp.cli:process_l1",
+            "fs_process_l2=cassandra_fs_pp.cli:process_l2",
+            "fs_process_batch=cassandra_fs_pp.cli:process_batch",
+            "plot_L2=cassandra_fs_pp.cli:plot_l2",
+        ]
+    },
     zip_safe=False,
     classifiers=[
         "Programming Language :: Python :: 3",
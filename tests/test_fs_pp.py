@@ -9,9 +9,17 @@ Andrew Tedstone, July 2022
 
 import pytest
 import os
+import json
+import shutil
+import time
+import numpy as np
 import pandas as pd
 
 import cassandra_fs_pp as fspp
+from cassandra_fs_pp import toa5
+from cassandra_fs_pp.cache import Level0Cache
+from cassandra_fs_pp import pipeline
+from cassandra_fs_pp import fs_pp
 
 import pdb
 
@@ -39,14 +47,78 @@ class TestFS:
         assert self._data.ds_level1.index.day[0] == 30
         assert self._data.ds_level1.index.day[-1] == 3
 
+    def test_level0_to_level1_parallel(self) -> None:
+        """
+        Concurrent loading must give identical results to serial loading.
+        """
+        serial = self._data.ds_level1
+        for pool in ['thread', 'process']:
+            data = fspp.fs('test_data/example_fs1.toml', 'test_data/')
+            data.config['level0_1']['pool'] = pool
+            parallel = data.level0_to_level1(jobs=3)
+            pd.testing.assert_frame_equal(parallel, serial)
+
+    def test_read_toa5(self) -> None:
+        f = 'test_data/fielddata_202107/MainTable1.dat'
+        data = toa5.read_toa5(f, na_values=['NAN'])
+        assert isinstance(data.index, pd.DatetimeIndex)
+        assert data.index[0] == pd.Timestamp('2021-04-30 18:00:00')
+        assert data['TCDT'].dtype == 'float32'
+        assert data['RECORD'].dtype == 'int64'
+        header = data.attrs['toa5']
+        assert header['file_info']['logger_model'] == 'CR800'
+        assert header['file_info']['table_name'] == 'MainTable'
+        assert header['units']['TCDT'] == 'm'
+        assert header['processing']['BattV_Min'] == 'Min'
+
+    def test_level0_to_level1_toa5(self) -> None:
+        """
+        TOA5 reader must give the same level-1 data as the generic reader,
+        to float32 precision.
+        """
+        data = fspp.fs('test_data/example_fs1.toml', 'test_data/')
+        data.config['level0_1']['reader'] = 'toa5'
+        l1 = data.level0_to_level1()
+        pd.testing.assert_frame_equal(l1, self._data.ds_level1, check_dtype=False)
+        assert data.level0_units()['TCDT'] == 'm'
+
     def test_get_level1_default_path(self) -> None:
         p = self._data._get_level1_default_path()
         assert p == 'test_data/firn_stations/level-1/FS1_example.csv'
 
+    def test_level1_columnar_roundtrip(self, tmp_path) -> None:
+        pytest.importorskip('pyarrow')
+        l1 = self._data.ds_level1
+        for fmt in ['parquet', 'feather']:
+            data = fspp.fs('test_data/example_fs1.toml', str(tmp_path))
+            data.ds_level1 = l1
+            p = str(tmp_path / ('level1.' + fmt))
+            data.write_l1(p)
+            loaded = data.load_level1_dataset(p)
+            assert loaded['TCDT'].dtype == 'float32'
+            assert isinstance(loaded.index, pd.DatetimeIndex)
+            pd.testing.assert_frame_equal(loaded, l1, check_dtype=False)
+
+            # Subset by columns and time
+            sub = data.load_level1_dataset(p, columns=['TCDT', 'Q'], 
+                start='2021-05-01', end='2021-05-02')
+            assert list(sub.columns) == ['TCDT', 'Q']
+            assert sub.index[0] == pd.Timestamp('2021-05-01')
+            assert sub.index[-1] == pd.Timestamp('2021-05-02')
+            pd.testing.assert_frame_equal(sub, 
+                l1.loc[pd.Timestamp('2021-05-01'):pd.Timestamp('2021-05-02'), ['TCDT', 'Q']], 
+                check_dtype=False)
+
     def test_load_dtc_positions(self) -> None:
         pos = self._data.load_dtc_positions(key=1)
         assert pos.loc['DTC1_SensorPositions(12)'] == pytest.approx(1650)
 
+    def test_load_dtc_positions_toa5(self) -> None:
+        data = fspp.fs('test_data/example_fs1.toml', 'test_data/')
+        data.config['level0_1']['reader'] = 'toa5'
+        pos = data.load_dtc_positions(key=1, check_length=False)
+        assert pos.loc['DTC1_SensorPositions(12)'] == pytest.approx(1650)
+
     def test_rename_columns(self) -> None:
         assert isinstance(self._data.ds_level1, pd.DataFrame)
         mapping = self._data._define_l2_column_names()
@@ -54,6 +126,20 @@ class TestFS:
         assert mapping['TDR1_VWC'] == 'TDR1_VWC(m3/m3)'
         assert mapping['DTC1(10)'] == 'DTC1_10(C)'
         assert mapping['TCDT'] == 'TCDT(m)'
+        # Second call with the same columns is memoized.
+        hits = fs_pp._l2_column_mapping.cache_info().hits
+        assert self._data._define_l2_column_names() == mapping
+        assert fs_pp._l2_column_mapping.cache_info().hits == hits + 1
+
+    def test_rename_columns_dtc3_5(self) -> None:
+        mapping_file = os.path.join(os.path.dirname(fs_pp.__file__), 'fs_column_names.csv')
+        columns = tuple('DTC%s(%s)' %(chain, i) for chain in (3, 4, 5) for i in range(1, 13))
+        mapping = fs_pp._l2_column_mapping(mapping_file,
+            os.stat(mapping_file).st_mtime, columns)
+        assert mapping['DTC3(1)'] == 'DTC3_1(C)'
+        assert mapping['DTC4(7)'] == 'DTC4_7(C)'
+        assert mapping['DTC5(12)'] == 'DTC5_12(C)'
+        assert len(mapping) == len(columns)
 
     def test_normalise_udg(self) -> None:        
         assert self._data.ds_level1['TCDT'].iloc[0] == pytest.approx(2.069)
@@ -76,10 +162,100 @@ class TestFS:
         assert filtered.iloc[0] == pytest.approx(0, abs=1e-1)
         assert filtered.iloc[-1] == pytest.approx(0, abs=1e-1)
 
+    def test_regularise(self) -> None:
+        # 10-minute summer records, then hourly winter records, then a gap.
+        idx = pd.date_range('2021-09-01', periods=30, freq='10min')
+        idx = idx.append(pd.date_range(idx[-1] + pd.Timedelta('1h'), periods=10, freq='1h'))
+        idx = idx.append(pd.DatetimeIndex([idx[-1] + pd.Timedelta('1D')]))
+        udg = pd.Series(np.arange(len(idx), dtype='float64'), index=idx)
+        step, positions, hold, n_grid = fs_pp._regularise(idx, limit=3)
+        assert step == pd.Timedelta('10min')
+        assert hold[0] == 1 and hold[35] == 4
+        grid = np.full(n_grid, np.nan)
+        for p, h, v in zip(positions, hold, udg):
+            grid[p:p + h] = v
+        expected = udg.resample('10min').ffill(limit=3)
+        np.testing.assert_array_equal(grid, expected.to_numpy())
+
+    def test_filter_udg_batch(self) -> None:
+        normed = self._data._normalise_udg()
+        batch = pd.concat((normed.rename('a'), (normed + 0.1).rename('b')), axis=1)
+        batch.iloc[5, 1] = 3
+        filtered = self._data._filter_udg(batch)
+        assert list(filtered.columns) == ['a', 'b']
+        pd.testing.assert_series_equal(filtered['a'],
+            self._data._filter_udg(batch['a']), check_names=False)
+        pd.testing.assert_series_equal(filtered['b'],
+            self._data._filter_udg(batch['b']), check_names=False)
+        assert np.isnan(filtered.iloc[5, 1])
+        # Quality values per channel
+        q = pd.concat((self._data.ds_level1['Q'], self._data.ds_level1['Q']), axis=1)
+        q.iloc[6, 0] = 250
+        filtered = self._data._filter_udg(batch, q=q)
+        assert np.isnan(filtered.iloc[6, 0]) and not np.isnan(filtered.iloc[6, 1])
+
+    def test_filter_udg_mixed_sampling(self) -> None:
+        # Hourly records, with 10-minute records for a day: not all records
+        # fall on the hourly grid.
+        idx = pd.date_range('2021-09-01', periods=24 * 6, freq='1h')
+        idx = idx.append(pd.date_range(idx[-1] + pd.Timedelta('1h'), periods=144, freq='10min'))
+        udg = pd.Series(np.zeros(len(idx), dtype='float32'), index=idx)
+        udg.iloc[-5] = 5
+        q = pd.Series(180, index=idx)
+        filtered = self._data._filter_udg(udg, q=q)
+        assert np.isnan(filtered.iloc[-5])
+        assert filtered.drop(filtered.index[-5]).notna().all()
+
     def test_calibrate_ec(self) -> None:
         ec = self._data._calibrate_ec()
         assert ec['EC(1)'].iloc[0] == pytest.approx(0)
 
+    def test_calibrate_ec_missing(self, tmp_path, capsys) -> None:
+        cal = pd.read_csv('test_data/ec_calibration/calibration_coefficients_FS1_EXAMPLE_c0.csv', index_col=0)
+        cal_file = str(tmp_path / 'cal.csv')
+        cal.drop(index=['EC(2)', 'EC(3)']).to_csv(cal_file)
+        data = fspp.fs('test_data/example_fs1.toml', 'test_data/')
+        data.ds_level1 = self._data.ds_level1
+        ec = data._calibrate_ec(cal_file=cal_file)
+        ec = data._calibrate_ec(cal_file=cal_file)
+        out = capsys.readouterr().out
+        assert out.count('No cal. data') == 1
+        assert 'EC(2), EC(3)' in out
+        m = cal.drop(index=['EC(2)', 'EC(3)'])['m'].mean()
+        expected = (1 - data.ds_level1['EC(2)'].astype('float64')) * m
+        np.testing.assert_allclose(ec['EC(2)'], expected, rtol=1e-6)
+        expected = (1 - data.ds_level1['EC(1)'].astype('float64')) * cal.loc['EC(1)', 'm']
+        np.testing.assert_allclose(ec['EC(1)'], expected, rtol=1e-6)
+        assert list(ec.columns) == list(data.ds_level1.filter(regex=r'EC\([0-9]+\)').columns)
+
+    def test_calibrate_ec_time_varying(self, tmp_path) -> None:
+        cal = pd.read_csv('test_data/ec_calibration/calibration_coefficients_FS1_EXAMPLE_c0.csv', index_col=0)
+        c1 = cal.copy()
+        c1['m'] = c1['m'] * 2
+        c1['c'] = 1
+        c1.to_csv(tmp_path / 'c1.csv')
+        data = fspp.fs('test_data/example_fs1.toml', 'test_data/')
+        data.ds_level1 = self._data.ds_level1
+        # Default is the single c0 file.
+        single = data._calibrate_ec()
+        assert len(data.ec_calibration_sets()) == 1
+
+        data.config['level1_2']['ec_calibration'] = {
+            'c1':[pd.Timestamp('2021-05-02').date(), str(tmp_path / 'c1.csv')],
+            'c0':[pd.Timestamp('2021-04-30').date(), 'calibration_coefficients_FS1_EXAMPLE_c0.csv']}
+        sets = data.ec_calibration_sets()
+        assert [s[0] for s in sets] == [pd.Timestamp('2021-04-30'), pd.Timestamp('2021-05-02')]
+        ec = data._calibrate_ec()
+        before = ec.index < pd.Timestamp('2021-05-02')
+        assert before.any() and (~before).any()
+        pd.testing.assert_frame_equal(ec[before], single[before])
+        x = 1 - data.ds_level1.loc[~before, 'EC(4)'].astype('float64')
+        np.testing.assert_allclose(ec.loc[~before, 'EC(4)'], x * cal.loc['EC(4)', 'm'] * 2 + 1, rtol=1e-6)
+
+        data.config['level1_2']['ec_calibration']['c1'][0] = pd.Timestamp('2021-04-30').date()
+        with pytest.raises(ValueError):
+            data.ec_calibration_sets()
+
     def test_dtc_installation_depths(self) -> None:
         pos = self._data.load_dtc_positions(key=1)
         ins_date, pth, sensor, depth = self._data.config['level1_2']['dtc_info']['1']
@@ -98,15 +274,748 @@ class TestFS:
         # Chain in this test has 0.15 m spacing.
         assert depths[2] == pytest.approx(-0.16 + -0.15)
 
+    def test_apply_valid_data_ranges(self) -> None:
+        df = self._data.ds_level1.copy()
+        df.loc[df.index[0], 'T107_C'] = 20
+        df.loc[df.index[1], 'TDR2_EC'] = -1
+        df.loc[df.index[2], 'EC(3)'] = 0.1
+        df.loc[df.index[3], 'T107_C'] = np.nan
+        expected = {}
+        for c, (vmin, vmax) in {'T107_C':(-50, 10), 'TDR2_EC':(0, 8), 'EC(3)':(0.5, 1)}.items():
+            expected[c] = df[c].where(df[c] <= vmax).where(df[c] >= vmin)
+
+        out, flags = self._data._apply_valid_data_ranges(df, return_flags=True)
+        for c in expected:
+            pd.testing.assert_series_equal(out[c], expected[c])
+        assert np.isnan(out['T107_C'].iloc[0])
+        assert np.isnan(out['TDR2_EC'].iloc[1])
+        assert np.isnan(out['EC(3)'].iloc[2])
+        assert flags['T107_C'].iloc[0] and flags['TDR2_EC'].iloc[1] and flags['EC(3)'].iloc[2]
+        # NaNs are not flagged.
+        assert not flags['T107_C'].iloc[3]
+        assert 'TDR1_Perm' in flags.columns
+        assert 'RECORD' not in flags.columns
+
     def test_level1_to_level2(self) -> None:
         self._data.level1_to_level2()
         assert isinstance(self._data.ds_level2, pd.DataFrame)
         assert 'TCDT(m)' in self._data.ds_level2.columns
 
+    def test_level1_to_level2_remove_missing(self) -> None:
+        data = fspp.fs('test_data/example_fs1.toml', 'test_data/')
+        data.ds_level1 = self._data.ds_level1.drop(columns='RECORD')
+        with pytest.raises(KeyError):
+            data.level1_to_level2()
+
     def test_calc_depth_tdr(self) -> None:
         udg = self._data.ds_level2['TCDT(m)'].rolling(3, center=True).median()
         udg = udg.dropna()
         udg = udg.interpolate()
         d = self._data._calc_depth_tdr(1, udg)
-        # Need to add an assertion here still.
+        assert d.name == 'TDR1_Depth'
+        assert (d <= 0).all()
+        # First record after installation is at the installation depth.
+        assert d.iloc[0] == pytest.approx(-0.48)
+        # Gaps in the UDG record are kept as NaN depths.
+        udg.iloc[40:45] = np.nan
+        d = self._data._calc_depth_tdr(1, udg)
+        pd.testing.assert_series_equal(d, _calc_depth_tdr_loop(self._data, 1, udg))
+        assert d.iloc[40:45].isna().all()
+
+    def test_calc_depth_tdrs_matches_loop(self) -> None:
+        """ Batched depth engine must be bit-identical to the original loop. """
+        udg = self._data.ds_level2['TCDT(m)'].rolling(3, center=True).median()
+        udg = udg.dropna()
+        # Include some NaNs and some strong surface lowering so that the 
+        # sensor reaches the surface and the offset is reset.
+        udg.iloc[40:45] = np.nan
+        udg.iloc[100:] += np.linspace(0, 2, len(udg) - 100)
+        tdrs = list(self._data.config['level1_2']['tdr_info'].keys())
+        batched = self._data._calc_depth_tdrs(tdrs, udg)
+        assert batched.shape == (len(udg), len(tdrs))
+        for tdr in tdrs:
+            expected = _calc_depth_tdr_loop(self._data, tdr, udg)
+            got = batched['TDR%s_Depth' %tdr].loc[expected.index]
+            np.testing.assert_array_equal(got.to_numpy(), expected.to_numpy())
+        assert (batched['TDR1_Depth'] == 0).any()
+
+
+def _calc_depth_tdr_loop(fs, tdr, udg):
+    """ Reference (original) per-timestep implementation of _calc_depth_tdr. """
+    install_date, install_depth, _ = fs.config['level1_2']['tdr_info'][str(tdr)]
+    udg_at_install = float(udg.loc[install_date.isoformat():].iloc[0])
+    offset = install_depth
+    udg = udg.loc[install_date.isoformat():] - udg_at_install
+    D = []
+    for ix, udgt in udg.items():
+        Dt = udgt + offset
+        Dt = np.minimum(0, Dt)
+        offset = np.where(Dt == 0, (udgt*-1), offset)
+        D.append(Dt)
+    return pd.Series(np.array(D), index=udg.index, name='TDR%s_Depth'%tdr)
+
+
+class TestDowncast:
+
+    def test_downcast_floats(self) -> None:
+        df = pd.DataFrame({'a':np.arange(3, dtype='float64'), 'b':np.ones(3, dtype='float32')})
+        assert (fs_pp.downcast_dtypes(df).dtypes == 'float32').all()
+        assert (fs_pp.downcast_dtypes(df, float_dtype='float64').dtypes == 'float64').all()
+        # Nothing to change: the frame is returned as-is.
+        df = df.astype('float32')
+        assert fs_pp.downcast_dtypes(df) is df
+
+    def test_downcast_ints(self) -> None:
+        i64 = np.iinfo('int64')
+        df = pd.DataFrame({
+            'RECORD':np.array([0, 40000], dtype='int64'),
+            'Q':np.array([180, 190], dtype='int64'),
+            'int8':np.array([-128, 127], dtype='int64'),
+            'int16':np.array([-129, 127], dtype='int64'),
+            'int32':np.array([0, 2**31 - 1], dtype='int64'),
+            'int64':np.array([0, 2**31], dtype='int64'),
+            'int64_bounds':np.array([i64.min, i64.max], dtype='int64'),
+            'uint8':np.array([0, 255], dtype='uint8'),
+            'uint64':np.array([0, i64.max + 1], dtype='uint64'),
+            'bool':np.array([True, False])
+        })
+        out = fs_pp.downcast_dtypes(df)
+        assert out.dtypes.astype(str).to_dict() == {'RECORD':'int32', 'Q':'int16',
+            'int8':'int8', 'int16':'int16', 'int32':'int32', 'int64':'int64', 
+            'int64_bounds':'int64', 'uint8':'int16', 'uint64':'uint64', 'bool':'bool'}
+        pd.testing.assert_frame_equal(out, df, check_dtype=False)
+
+        # Empty: integer columns are left as they are.
+        out = fs_pp.downcast_dtypes(df.iloc[:0])
+        assert out['RECORD'].dtype == 'int64'
+
+    def test_downcast_non_unique(self) -> None:
+        df = pd.DataFrame(np.arange(6).reshape(2, 3), columns=['a', 'a', 'b'])
+        df['c'] = [0.5, 1.5]
+        df.attrs['toa5'] = {'units':{}}
+        out = fs_pp.downcast_dtypes(df)
+        assert list(out.dtypes.astype(str)) == ['int8', 'int8', 'int8', 'float32']
+        assert out.attrs == df.attrs
+        # Columns of a name which need different dtypes are left as they are.
+        df.iloc[1, 1] = 1000
+        out = fs_pp.downcast_dtypes(df)
+        assert list(out.dtypes.astype(str)) == ['int64', 'int64', 'int8', 'float32']
+
+    def test_downcast_attrs(self) -> None:
+        df = pd.DataFrame({'a':np.arange(3, dtype='float64')})
+        df.attrs['toa5'] = {'units':{'a':'m'}}
+        assert fs_pp.downcast_dtypes(df).attrs == df.attrs
+
+    def test_downcast_option(self) -> None:
+        """
+        downcast=false keeps the dtypes of the reader. Downcast Level-1 data 
+        take less than half the memory.
+        """
+        lean = fspp.fs('test_data/example_fs1.toml', 'test_data/').level0_to_level1()
+        data = fspp.fs('test_data/example_fs1.toml', 'test_data/')
+        data.config['level0_1']['downcast'] = False
+        full = data.level0_to_level1()
+        assert set(full.dtypes.astype(str)) == {'float64', 'int64'}
+        pd.testing.assert_frame_equal(lean, full, check_dtype=False)
+        assert set(lean.dtypes.astype(str)) <= {'float32', 'int8', 'int16', 'int32'}
+        assert lean.memory_usage().sum() < 0.5 * full.memory_usage().sum()
+
+
+class TestLevel1Update:
+
+    def test_update_level1(self, tmp_path) -> None:
+        """
+        Incremental update with a new bale must match full reprocessing, and only
+        the new bale should be loaded.
+        """
+        root = tmp_path / 'data'
+        shutil.copytree('test_data', root)
+        os.makedirs(root / 'firn_stations' / 'level-1')
+
+        data = fspp.fs('test_data/example_fs1.toml', str(root))
+        data.config['level0']['fielddata_202107']['bales_stop'] = 2
+        data.level0_to_level1()
+        data.write_l1()
+        assert os.path.exists(data._get_level1_manifest_path())
+
+        full = fspp.fs('test_data/example_fs1.toml', str(root))
+        full.level0_to_level1()
+
+        incr = fspp.fs('test_data/example_fs1.toml', str(root))
+        incr.update_level1()
+        assert list(incr._level0_summary.keys())[-1].endswith('MainTable3.dat')
+        pd.testing.assert_frame_equal(incr.ds_level1, full.ds_level1, 
+            check_dtype=False, check_freq=False)
+        incr.write_l1()
+
+        # Nothing new: no level-0 files are loaded at all.
+        again = fspp.fs('test_data/example_fs1.toml', str(root))
+        loaded = []
+        again._load_level0_file = lambda f, opts: loaded.append(f)
+        again.update_level1()
+        assert loaded == []
+        assert len(again.ds_level1) == len(full.ds_level1)
+
+    def test_update_level1_changed_file(self, tmp_path) -> None:
+        """
+        Incremental update after a level-0 file is edited must match full 
+        reprocessing, i.e. the edit must be kept.
+        """
+        root = tmp_path / 'data'
+        shutil.copytree('test_data', root)
+        os.makedirs(root / 'firn_stations' / 'level-1')
+
+        data = fspp.fs('test_data/example_fs1.toml', str(root))
+        data.level0_to_level1()
+        data.write_l1()
+
+        f = root / 'fielddata_202107' / 'MainTable1.dat'
+        text = open(f).read()
+        old = '"2021-04-30 18:15:00",4,14.94,-1.437,-4.119,2.07,'
+        assert old in text
+        with open(f, 'w') as fh:
+            fh.write(text.replace(old, old.replace('2.07,', '9.999,')))
+
+        full = fspp.fs('test_data/example_fs1.toml', str(root))
+        full.level0_to_level1()
+        incr = fspp.fs('test_data/example_fs1.toml', str(root))
+        incr.update_level1()
+        assert incr.ds_level1.loc['2021-04-30 18:15', 'TCDT'] == pytest.approx(9.999)
+        pd.testing.assert_frame_equal(incr.ds_level1, full.ds_level1, 
+            check_dtype=False, check_freq=False)
+
+    def test_level1_manifest_kept(self, tmp_path) -> None:
+        """
+        Saving a loaded Level-1 dataset again, e.g. in another format, keeps 
+        its manifest, so that a later update does not reprocess everything.
+        """
+        pytest.importorskip('pyarrow')
+        root = tmp_path / 'data'
+        shutil.copytree('test_data', root)
+        os.makedirs(root / 'firn_stations' / 'level-1')
+
+        data = fspp.fs('test_data/example_fs1.toml', str(root))
+        data.level0_to_level1()
+        data.write_l1()
+        with open(data._get_level1_manifest_path()) as fh:
+            manifest = json.load(fh)
+
+        data = fspp.fs('test_data/example_fs1.toml', str(root))
+        data.load_level1_dataset()
+        data.write_l1(fmt='parquet')
+        parquet = data._get_level1_default_path('parquet')
+        with open(data._get_level1_manifest_path(parquet)) as fh:
+            assert json.load(fh) == manifest
+
+        # The update reads the dataset in the format asked for.
+        incr = fspp.fs('test_data/example_fs1.toml', str(root))
+        loaded = []
+        incr._load_level0_file = lambda f, opts: loaded.append(f)
+        incr.update_level1(fmt='parquet')
+        assert loaded == []
+        assert incr._level1_manifest == manifest
+
+
+class TestMerge:
+
+    def test_sorted_merge(self) -> None:
+        """
+        Merging overlapping sources must match concatenation and removal of
+        duplicates, whatever the chunk size.
+        """
+        from cassandra_fs_pp.merge import SortedMerge
+        l1 = self._data.ds_level1
+        a = l1.iloc[:100]
+        b = l1.iloc[90:150].copy()
+        b.loc[b.index[0], 'T107_C'] = -40
+        c = l1.iloc[150:]
+        # The post-servicing download overlaps the end of the last bale.
+        d = l1.iloc[-20:]
+        for chunk_rows in [7, 100000]:
+            merge = SortedMerge(['a', 'b', 'c', 'd'], [a.index[0], b.index[0], c.index[0], d.index[0]],
+                chunk_rows=chunk_rows)
+            assert merge.open_order() == [0, 1, 2, 3]
+            out = pd.concat(list(merge.merge([a, b, c, d])))
+            pd.testing.assert_frame_equal(out, l1)
+            report = merge.report
+            assert report.loc['b', 'identical'] == 9
+            assert report.loc['b', 'conflicting'] == 1
+            assert report.loc['d', 'identical'] == 20
+            assert 'a' not in report.index
+
+    def test_find_duplicates(self) -> None:
+        """ Records of overlapping sources, concatenated in order of precedence. """
+        from cassandra_fs_pp.merge import find_duplicates
+        l1 = self._data.ds_level1
+        a = l1.iloc[:100]
+        b = l1.iloc[90:150].copy()
+        # Same timestamp, different data.
+        b.loc[b.index[0], 'T107_C'] = -40
+        ds = pd.concat((a, b))
+        drop, identical = find_duplicates(ds)
+        pd.testing.assert_frame_equal(ds[~drop], l1.iloc[:150])
+        assert np.sum(drop & identical) == 9
+        assert np.sum(drop & ~identical) == 1
+        assert not drop[:100].any()
+
+    def test_sorted_merge_out_of_order(self) -> None:
+        """
+        Sources are opened in time order, and records which arrive too late
+        are dropped.
+        """
+        from cassandra_fs_pp.merge import SortedMerge
+        l1 = self._data.ds_level1
+        early = l1.iloc[:100]
+        late = l1.iloc[100:]
+        # Given last, but starts first.
+        merge = SortedMerge(['late', 'early'], [late.index[0], early.index[0]])
+        assert merge.open_order() == [1, 0]
+        out = pd.concat(list(merge.merge([early, late])))
+        pd.testing.assert_frame_equal(out, l1)
+
+        # Start time of b is wrong: its first records have already been merged.
+        merge = SortedMerge(['a', 'b'], [l1.index[0], l1.index[150]], chunk_rows=50)
+        out = pd.concat(list(merge.merge([l1.iloc[:150], l1.iloc[[10, 11] + list(range(150, len(l1)))]])))
+        pd.testing.assert_frame_equal(out, l1)
+        assert merge.report.loc['b', 'late'] == 2
+
+        # Chunks of a source repeat records of a chunk already merged.
+        repeated = l1.iloc[[10, 90, 95]].copy()
+        repeated.loc[repeated.index[2], 'T107_C'] = -40
+        merge = SortedMerge(['a'], [l1.index[0]])
+        out = pd.concat(list(merge.merge([[l1.iloc[:50], l1.iloc[50:100], 
+            pd.concat((repeated, l1.iloc[100:]))]])))
+        pd.testing.assert_frame_equal(out, l1)
+        assert merge.report.loc['a'].to_dict() == {'identical':1, 'conflicting':1, 'late':1}
+
+    def test_level0_to_level1_chunked(self) -> None:
+        full = fspp.fs('test_data/example_fs1.toml', 'test_data/')
+        full.level0_to_level1()
+        data = fspp.fs('test_data/example_fs1.toml', 'test_data/')
+        data.config['level0_1']['chunk_rows'] = 10
+        data.level0_to_level1()
+        pd.testing.assert_frame_equal(data.ds_level1, full.ds_level1)
+        assert data.ds_level1.index.is_monotonic_increasing
+
+
+class TestStream:
+
+    def test_read_toa5_chunked(self) -> None:
+        f = 'test_data/fielddata_202107/MainTable1.dat'
+        full = toa5.read_toa5(f, na_values=['NAN'])
+        chunks = list(toa5.read_toa5(f, na_values=['NAN'], chunksize=7))
+        assert len(chunks) > 1
+        assert chunks[-1].attrs['toa5']['units']['TCDT'] == 'm'
+        pd.testing.assert_frame_equal(pd.concat(chunks, axis=0), full)
+
+    def test_stream_level0_to_level1(self, tmp_path) -> None:
+        """ Streamed Level-1 file must be the same as that written in one go. """
+        formats = ['csv']
+        try:
+            import pyarrow
+            formats += ['parquet', 'feather']
+        except ImportError:
+            pass
+        for reader in ['csv', 'toa5']:
+            full = fspp.fs('test_data/example_fs1.toml', 'test_data/')
+            full.config['level0_1']['reader'] = reader
+            full.level0_to_level1()
+            for fmt in formats:
+                p_full = str(tmp_path / ('full.' + fmt))
+                full.write_l1(p_full)
+
+                data = fspp.fs('test_data/example_fs1.toml', 'test_data/')
+                data.config['level0_1']['reader'] = reader
+                p = data.stream_level0_to_level1(str(tmp_path / ('stream.' + fmt)), chunk_rows=10)
+                assert data.ds_level1 is None
+                if fmt == 'csv':
+                    with open(p) as f1, open(p_full) as f2:
+                        assert f1.read() == f2.read()
+                pd.testing.assert_frame_equal(data.load_level1_dataset(p),
+                    full.load_level1_dataset(p_full))
+                assert os.path.exists(data._get_level1_manifest_path(p))
+                # The temporary chunks are removed.
+                assert all([os.path.isfile(tmp_path / f) for f in os.listdir(tmp_path)])
+
+    def test_stream_level0_to_level1_empty(self, tmp_path) -> None:
+        """ Without any level-0 records, an empty Level-1 file is written. """
+        data = fspp.fs('test_data/example_fs1.toml', 'test_data/')
+        data._level0_tasks = lambda: []
+        p = data.stream_level0_to_level1(str(tmp_path / 'empty.csv'))
+        assert len(pd.read_csv(p)) == 0
+
+    def test_run_level1_stream_incremental(self, tmp_path) -> None:
+        with pytest.raises(ValueError):
+            pipeline.run_level1('FS1', str(tmp_path), metafile='test_data/example_fs1.toml',
+                stream=True, incremental=True)
+
+
+class TestLevel0Cache:
+
+    def test_level0_cache(self, tmp_path) -> None:
+        data = fspp.fs('test_data/example_fs1.toml', 'test_data/')
+        data.level0_cache = Level0Cache(str(tmp_path / 'cache'))
+        data.config['level0_1']['reader'] = 'toa5'
+        first = data.level0_to_level1()
+        assert len(data.level0_cache._entries()) == 3
+
+        # Second time round, all files come from the cache.
+        reads = []
+        read = data._read_level0_file
+        def counting_read(filename, load_opts, chunksize=None):
+            reads.append(filename)
+            return read(filename, load_opts, chunksize=chunksize)
+        data._read_level0_file = counting_read
+        second = data.level0_to_level1()
+        assert reads == []
+        pd.testing.assert_frame_equal(first, second)
+        assert data.level0_units()['TCDT'] == 'm'
+
+        # Changing the load options is a cache miss.
+        data.config['level0_1']['float_dtype'] = 'float64'
+        data.level0_to_level1()
+        assert len(reads) == 3
+
+        data.level0_cache.clear()
+        assert data.level0_cache.size() == 0
+
+    def test_level0_cache_process_pool(self, tmp_path, monkeypatch) -> None:
+        data = fspp.fs('test_data/example_fs1.toml', 'test_data/')
+        data.level0_cache = Level0Cache(str(tmp_path / 'cache'))
+        serial = data.level0_to_level1()
+        # Workers load the files from the cache by its location alone. The 
+        # workers are forked, so they count their reads in a file.
+        reads = tmp_path / 'reads.txt'
+        read = fs_pp.fs._read_level0_file
+        def counting_read(filename, load_opts, chunksize=None):
+            with open(reads, 'a') as f:
+                f.write(filename + '\n')
+            return read(filename, load_opts, chunksize=chunksize)
+        monkeypatch.setattr(fs_pp.fs, '_read_level0_file', staticmethod(counting_read))
+        data.config['level0_1']['pool'] = 'process'
+        parallel = data.level0_to_level1(jobs=3)
+        assert not os.path.exists(reads)
+        pd.testing.assert_frame_equal(parallel, serial)
+        assert len(data.level0_cache._entries()) == 3
+
+    def test_level0_cache_index(self, tmp_path) -> None:
+        cache = Level0Cache(str(tmp_path / 'cache'))
+        df = pd.DataFrame({'a':np.arange(3.)}, index=pd.date_range('2021-05-01', periods=3))
+        df.attrs['toa5'] = {'units':{'a':'m'}}
+        for name in [None, 'TIMESTAMP']:
+            df.index.name = name
+            cache.put('k', df)
+            got = cache.get('k')
+            pd.testing.assert_frame_equal(got, df, check_freq=False)
+            assert got.attrs == df.attrs
+
+    def test_level0_cache_eviction(self, tmp_path) -> None:
+        cache = Level0Cache(str(tmp_path / 'cache'))
+        df = pd.DataFrame({'a':np.arange(1000.)})
+        for i in range(3):
+            cache.put('k%s' %i, df)
+            os.utime(cache._path('k%s' %i), (i, i))
+        # Use the oldest entry so that it becomes the most recent.
+        cache.get('k0')
+        cache.max_bytes = cache.size() * 0.7
+        assert cache.evict() == 1
+        assert cache.get('k1') is None
+        assert cache.get('k0') is not None
+
+
+def _run_site_or_die(site, data_root, **kwargs):
+    """ Stand-in for pipeline.run_site whose worker process dies for site "FS9". """
+    if site == 'FS9':
+        time.sleep(0.5)
+        os._exit(1)
+    return {'site':site, 'status':'ok', 'level1_s':0, 'level2_s':0, 'error':'', 'log':None}
+
+
+class TestPipeline:
+
+    def test_run_batch(self, tmp_path) -> None:
+        root = tmp_path / 'data'
+        shutil.copytree('test_data', root)
+        for d in ['level-1', 'level-2', 'ppconfig']:
+            os.makedirs(root / 'firn_stations' / d)
+        shutil.copy('test_data/example_fs1.toml', root / 'firn_stations' / 'ppconfig' / 'FS1_example.toml')
+        # A site whose level-0 data are missing.
+        with open(root / 'firn_stations' / 'ppconfig' / 'FS9.toml', 'w') as f:
+            f.write(open('test_data/example_fs1.toml').read()
+                .replace('bales_stop=3', 'bales_stop=4').replace('FS1_example', 'FS9'))
+
+        sites = pipeline.list_sites(str(root))
+        assert sites == ['FS1_example', 'FS9']
+        summary = pipeline.run_batch(sites, str(root), workers=1)
+        assert summary.loc['FS1_example', 'status'] == 'ok'
+        assert summary.loc['FS9', 'status'] == 'failed (level1)'
+        assert 'MainTable4.dat' in summary.loc['FS9', 'error']
+        assert os.path.exists(root / 'firn_stations' / 'level-2' / 'FS1_example.nc')
+        assert 'Traceback' in open(summary.loc['FS9', 'log']).read()
+
+        empty = pipeline.run_batch([], str(root))
+        assert len(empty) == 0
+        assert list(empty.columns) == list(summary.columns)
+
+    def test_run_batch_worker_dies(self, tmp_path, monkeypatch) -> None:
+        monkeypatch.setattr(pipeline, 'run_site', _run_site_or_die)
+        summary = pipeline.run_batch(['FS1_example', 'FS9'], str(tmp_path), workers=2)
+        assert summary.loc['FS1_example', 'status'] == 'ok'
+        assert summary.loc['FS9', 'status'] == 'failed (worker)'
+        assert summary.loc['FS9', 'error'].startswith('BrokenProcessPool')
+
+
+class TestLevel2:
+
+    def test_write_level2_chunked(self, tmp_path) -> None:
+        """
+        Chunked/compressed and appended NetCDF output must match a single write.
+        """
+        import xarray as xr
+        from cassandra_fs_pp import level2
+
+        root = tmp_path / 'data'
+        shutil.copytree('test_data', root)
+        os.makedirs(root / 'firn_stations' / 'level-2')
+        data = fspp.fs('test_data/example_fs1.toml', str(root))
+        data.level0_to_level1()
+        data.ds_level1.index.name = 'time'
+        data.level1_to_level2()
+
+        level2.write_level2(data, outfile=str(tmp_path / 'single.nc'), chunk_size=10**6)
+        # Sensor positions are read once, not per chunk.
+        calls = []
+        load_dtc_positions = data.load_dtc_positions
+        data.load_dtc_positions = lambda *args, **kwargs: calls.append(1) or load_dtc_positions(*args, **kwargs)
+        level2.write_level2(data, outfile=str(tmp_path / 'chunked.nc'), chunk_size=50, complevel=4)
+        del data.load_dtc_positions
+        assert len(calls) == len(data.config['level1_2']['dtc_info'])
+        # Write the first half, then append the rest.
+        full = data.ds_level2
+        data.ds_level2 = full.iloc[:len(full)//2]
+        level2.write_level2(data, outfile=str(tmp_path / 'appended.nc'))
+        data.ds_level2 = full
+        level2.write_level2(data, outfile=str(tmp_path / 'appended.nc'), append=True)
+
+        single = xr.open_dataset(tmp_path / 'single.nc').load()
+        chunked = xr.open_dataset(tmp_path / 'chunked.nc').load()
+        xr.testing.assert_equal(chunked, single)
+        # TDR depths of the first half were estimated from a shorter UDG record.
+        appended = xr.open_dataset(tmp_path / 'appended.nc').load()
+        assert appended.sizes['time'] == len(full)
+        xr.testing.assert_equal(appended.drop_vars('tdr_depth'), single.drop_vars('tdr_depth'))
+        n = len(full)//2
+        xr.testing.assert_equal(appended.tdr_depth[n:], single.tdr_depth[n:])
+
+        # Sampling becomes finer than that of the first chunk.
+        n = len(full)//2
+        index = pd.DatetimeIndex(list(pd.date_range(full.index[0], periods=n, freq='1H'))
+            + list(pd.date_range(full.index[0] + pd.Timedelta(hours=n), periods=len(full) - n, freq='10min')), 
+            name='time')
+        data.ds_level2 = full.set_axis(index)
+        level2.write_level2(data, outfile=str(tmp_path / 'resampled.nc'), chunk_size=n)
+        data.ds_level2 = full.set_axis(index).iloc[:n]
+        level2.write_level2(data, outfile=str(tmp_path / 'resampled_appended.nc'))
+        data.ds_level2 = full.set_axis(index)
+        level2.write_level2(data, outfile=str(tmp_path / 'resampled_appended.nc'), append=True)
+        data.ds_level2 = full
+        for f in ['resampled.nc', 'resampled_appended.nc']:
+            with xr.open_dataset(tmp_path / f) as ds:
+                assert ds.time.to_index().equals(index)
+
+        # Lazy reads of a time range, variables and sensors.
+        nc = str(tmp_path / 'chunked.nc')
+        with level2.open_level2(nc, start='2021-05-01', finish='2021-05-02', 
+            variables=['tdr_t', 'surface_height'], sensors={'tdr_sensor': [1]}) as lazy:
+            assert list(lazy.data_vars) == ['tdr_t', 'surface_height']
+            expected = single[['tdr_t', 'surface_height']].sel(time=slice('2021-05-01', '2021-05-02'), 
+                tdr_sensor=[1])
+            xr.testing.assert_equal(lazy.compute(), expected)
+        with pytest.raises(ValueError):
+            level2.open_level2(nc, variables=['not_a_variable'])
+
+
+class TestSchema:
+
+    def test_site_schema(self) -> None:
+        """
+        Columns are indexed by sensor family, including sites with more than 9 TDRs.
+        """
+        from cassandra_fs_pp import level2
+        from cassandra_fs_pp.schema import SiteSchema
+
+        tdrs = list(range(1, 13))
+        columns = ['BattV_Min', 'TCDT'] + ['TDR%s_%s' %(i, v) for i in tdrs for v in ['T', 'EC']] \
+            + ['DTC1(%s)' %i for i in range(1, 4)] + ['DTC12_%s(C)' %i for i in range(1, 3)] + ['EC(1)', 'EC(2)']
+        schema = SiteSchema(columns)
+        assert [columns[i] for i in schema.tdr_positions('T')] == ['TDR%s_T' %i for i in tdrs]
+        assert [columns[i] for i in schema.tdr_positions('EC', [11, 2])] == ['TDR11_EC', 'TDR2_EC']
+        assert [columns[i] for i in schema.dtc_positions(1)] == ['DTC1(1)', 'DTC1(2)', 'DTC1(3)']
+        assert [columns[i] for i in schema.dtc_positions('12')] == ['DTC12_1(C)', 'DTC12_2(C)']
+        assert [columns[i] for i in schema.ec_positions()] == ['EC(1)', 'EC(2)']
+        assert list(schema.surface.keys()) == ['BattV_Min', 'TCDT']
+        with pytest.raises(ValueError):
+            schema.tdr_positions('T', [13])
+
+        df = pd.DataFrame(np.arange(len(columns))[np.newaxis, :], columns=columns,
+            index=pd.DatetimeIndex(['2021-05-01']))
+        arr = level2.subsurf_DataArray(df, 'tdr', 'land_ice_temperature', 'degree_Celsius', 
+            schema.tdr_positions('T', tdrs), dict.fromkeys(tdrs, -1.0))
+        assert arr.shape == (1, 12)
+        assert list(arr.values[0]) == list(schema.tdr_positions('T'))
+
+
+class TestCli:
+
+    def test_startup_imports(self, tmp_path) -> None:
+        """
+        -h, and runs whose output already exists, must not import the data libraries.
+        """
+        import subprocess
+        import sys
+        level1 = tmp_path / 'firn_stations' / 'level-1'
+        os.makedirs(level1)
+        (level1 / 'FS1_example.csv').touch()
+        script = '''
+import sys
+from cassandra_fs_pp import cli
+for main in [cli.process_l1, cli.process_l2, cli.process_batch, cli.plot_l2]:
+    try:
+        main(['-h'])
+    except SystemExit:
+        pass
+try:
+    cli.process_l1(['FS1', '-metafile', 'test_data/example_fs1.toml', '-data_root', sys.argv[1]])
+except IOError:
+    print('exists')
+print(sorted({'pandas', 'numpy', 'xarray', 'netCDF4', 'matplotlib', 'seaborn'} & set(sys.modules)))
+'''
+        out = subprocess.run([sys.executable, '-c', script, str(tmp_path)], capture_output=True,
+            text=True, check=True).stdout.splitlines()
+        assert out[-2:] == ['exists', '[]']
+
+
+class TestPlotting:
+
+    def test_render_figures(self, tmp_path) -> None:
+        pytest.importorskip('matplotlib')
+        pytest.importorskip('seaborn')
+        import xarray as xr
+        from cassandra_fs_pp import level2, plotting
+
+        root = tmp_path / 'data'
+        shutil.copytree('test_data', root)
+        os.makedirs(root / 'firn_stations' / 'level-2')
+        data = fspp.fs('test_data/example_fs1.toml', str(root))
+        data.level0_to_level1()
+        data.ds_level1.index.name = 'time'
+        data.level1_to_level2()
+        nc = str(tmp_path / 'FS1.nc')
+        level2.write_level2(data, outfile=nc)
+
+        with xr.open_dataset(nc) as ds:
+            jobs = plotting.figure_jobs(ds, 'FS1', tstr='_20210501_20210503')
+        assert ('dtc', 'dtc1', 'FS1_dtc1_20210501_20210503.png') in jobs
+        assert ('tdr_depth', 'vr', 'FS1_tdr_vr_depth_20210501_20210503.png') in jobs
+        for workers in [1, 2]:
+            out = tmp_path / ('figures%s' %workers)
+            os.makedirs(out)
+            report = plotting.render_figures(nc, jobs, 'FS1', outpath=str(out), 
+                start='2021-05-01', finish='2021-05-03', workers=workers, dpi=30)
+            assert list(report.index) == [job[2] for job in jobs]
+            assert sorted(os.listdir(out)) == sorted(report.index)
+        report = plotting.render_figures(nc, jobs[:2], 'FS1', outpath=str(out), workers=1, 
+            dpi=30, decimate=False)
+        assert len(report) == 2
+
+
+class TestDecimate:
+
+    def test_decimate_line(self) -> None:
+        from cassandra_fs_pp import decimate
+        t = pd.date_range('2021-01-01', periods=10000, freq='10min')
+        y = np.sin(np.arange(10000) / 500)
+        y[1234] = 10
+        y[5000:5100] = np.nan
+        keep = decimate.decimate_line(t, y, 200)
+        assert len(keep) < 300
+        assert np.all(np.diff(keep) > 0)
+        assert keep[0] == 0 and keep[-1] == 9999
+        # Spikes and gaps are kept.
+        assert 1234 in keep
+        assert 5000 in keep
+        assert decimate.lttb(t, y[:100], 200).tolist() == list(range(100))
+
+    def test_decimate_points(self) -> None:
+        from cassandra_fs_pp import decimate
+        t = pd.date_range('2021-01-01', periods=10000, freq='10min')
+        y = np.random.default_rng(0).normal(size=10000)
+        y[777] = -50
+        y[8888] = 50
+        keep = decimate.decimate_points(t, y, 100)
+        assert len(keep) <= 201
+        assert 777 in keep and 8888 in keep
+        values = np.vstack((y, np.zeros(10000)))
+        values[:, 3000:3050] = np.nan
+        cols = decimate.decimate_columns(t, values, 100, axis=1)
+        assert 777 in cols and 8888 in cols and 3000 in cols
+
+
+class TestSynthetic:
+
+    def test_make_site(self, tmp_path) -> None:
+        """
+        Synthetic data must pass through the whole processing chain.
+        """
+        from cassandra_fs_pp import synthetic, level2
+        metafile = synthetic.make_site(str(tmp_path), years=0.05, n_dtc=2, bale_days=5)
+        data = fspp.fs(metafile, str(tmp_path))
+        data.level0_to_level1()
+        # Rows repeated between bales are removed.
+        assert data.duplicates_report['identical'].sum() == 6 * 3
+        t0 = pd.Timestamp('2021-05-01')
+        expected = pd.date_range(t0, t0 + pd.Timedelta(days=365.25*0.05), freq='10min')
+        assert len(data.ds_level1) == len(expected)
+        assert data.ds_level1.index.is_monotonic_increasing
+        data.ds_level1.index.name = 'time'
+        data.level1_to_level2()
+        assert 'DTC2_12(C)' in data.ds_level2.columns
+        level2.write_level2(data)
+        assert os.path.exists(tmp_path / 'firn_stations' / 'level-2' / 'FSX.nc')
+
+
+class TestInstrument:
+
+    def test_profiler_stages(self, tmp_path) -> None:
+        from cassandra_fs_pp.instrument import Profiler
+        data = fspp.fs('test_data/example_fs1.toml', 'test_data/')
+        data.profiler = Profiler(trace_memory=True)
+        data.level0_to_level1()
+        data.level1_to_level2()
+
+        stages = {s['stage']:s for s in data.profiler.report()['stages']}
+        assert stages['level0_to_level1']['depth'] == 0
+        assert stages['_merge_level0']['depth'] == 1
+        assert stages['_merge_level0']['rows_read'] >= stages['level0_to_level1']['rows_out']
+        assert stages['level1_to_level2']['rows_in'] == len(data.ds_level1)
+        assert stages['level1_to_level2']['cols_out'] == len(data.ds_level2.columns)
+        assert sum(stages['level1_to_level2']['dtypes'].values()) == len(data.ds_level2.columns)
+        for s in stages.values():
+            assert s['wall_s'] > 0
+            assert s['peak_traced_mb'] >= 0
+
+        data.profiler.write_report(tmp_path / 'report.json')
+        assert os.path.exists(tmp_path / 'report.json')
 
+    def test_profiler_bounded(self) -> None:
+        from cassandra_fs_pp.instrument import Profiler
+        data = fspp.fs('test_data/example_fs1.toml', 'test_data/')
+        data.profiler = Profiler(max_stages=5)
+        data.ds_level1 = self._data.ds_level1
+        for i in range(20):
+            data._normalise_udg()
+        report = data.profiler.report()
+        assert len(report['stages']) == 5
+        assert report['stages_dropped'] == 15
+        assert report['totals']['_normalise_udg']['calls'] == 20
+        assert report['totals']['_normalise_udg']['wall_s'] > 0